@@ -4,7 +4,7 @@ from .models import *
 
 
 class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('user', 'api_key', 'api_secret')
+    list_display = ('user', 'api_key', 'api_secret', 'nonce_window')
 
 admin.site.register(Profile, ProfileAdmin)
 
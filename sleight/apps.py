@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class SleightConfig(AppConfig):
     name = 'sleight'
+
+    def ready(self):
+        # connect the signal receivers
+        import sleight.consumers.sessions  # noqa
+        import sleight.utils  # noqa
@@ -3,252 +3,199 @@ import logging
 
 import datetime
 
-from channels import Channel
-from channels import Group
+from channels.message import Message
 
-from sleight.models import Order, Trade, Balance
+from sleight.consumers.notifier import Notifier
+from sleight.engine.book import BookOrder, checkpoint, discard_book, get_book, reload_book
+from sleight.engine.journal import ACCEPTED, CANCELLED, TRADE
+from sleight.engine.lease import pair_owner
+from sleight.engine.market_data import book_snapshot, publish_deltas
+from sleight.engine.matching import match
+from sleight.engine.recent_trades import record_recent_trades
+from sleight.engine.settlement import SettlementConflict, settle
+from sleight.engine.ticker import publish_ticker
+from sleight.models import Order
+from sleight.utils import get_pair_group, get_pair_name
 
 log = logging.getLogger(__name__)
 
 
-def update_order(order, new_amount):
-    order.amount = new_amount
-    if new_amount > 0:
-        order.state = 'partial'
-    else:
-        order.state = 'complete'
-    order.save()
-
+@pair_owner
+def remove_order(message):
+    """
+    Run as background task whenever an order is cancelled
+    take the order off the in memory book so it can no longer be matched
+    """
+    book = get_book(message.content['pair_id'])
+    if book.remove(message.content['order_id']) is None:
+        log.info('order {} was not on the book'.format(message.content['order_id']))
+        return
+    book.journal.append([[CANCELLED, message.content['order_id']]])
+    checkpoint(book)
+    publish_ticker(book)
+    publish_deltas(book)
+    log.info('removed order {} from the book'.format(message.content['order_id']))
 
-def send_to_ws_group(group_name, data):
-    Group(group_name).send({'text': json.dumps(data)})
 
+@pair_owner
+def remove_orders(message):
+    """
+    Run as background task whenever several orders are cancelled at once
+    take the orders off the in memory book and publish the changes once
+    """
+    book = get_book(message.content['pair_id'])
+    removed = [
+        order_id
+        for order_id in message.content['order_ids']
+        if book.remove(order_id) is not None
+    ]
+    if not removed:
+        return
+    book.journal.append([[CANCELLED, order_id] for order_id in removed])
+    checkpoint(book)
+    publish_ticker(book)
+    publish_deltas(book)
+    log.info('removed {} orders from the book'.format(len(removed)))
 
-def update_balance(user, currency, amount, order_type):
-    # fetch the current balance objects for both users
-    # ask/sell orders get the base currency
-    # bid/buy orders get the variable currency
-    balance, _ = Balance.objects.get_or_create(
-        user=user,
-        currency=currency
-    )
 
-    # update the balances accordingly
-    # ask/sell order gets the initiating order amount
-    # bid/buy order gets the initiating order amount * the price
-    # update the balance on the front end
-    balance.amount += amount
-    balance.save()
-    send_to_ws_group(user.username, {
-        'message_type': 'balance',
-        'balance': str(balance.amount),
-        'currency': currency.code.lower()
-    })
+@pair_owner
+def send_book_snapshot(message):
+    """
+    Run when a market data socket asks for the book
+    reply with every price level as at the current sequence number
+    """
+    book = get_book(message.content['pair_id'])
+    message.reply_channel.send({'text': json.dumps(book_snapshot(book))})
 
 
-def check_trades(message):
+def match_order(message, reloaded=False):
     """
-    Run as background task whenever an order is placed
-    check the opposite type, top order for a match and trade if possible
-    message contains the order that was placed
+    place the order from the message on the book, sweep it across the opposite side
+    and settle the fills. the book is discarded if anything goes wrong.
+    reloaded is set when the book has just been loaded from the database to retry
     """
-    initiating_order = Order.objects.get(id=message.content['order_id'])
+    book = get_book(message.content['pair_id'])
+    # the reloaded book already holds the order if it is still resting
+    if reloaded and message.content['order_id'] not in book:
+        log.info('order {} is no longer open'.format(message.content['order_id']))
+        return []
+    # a message that waited for the lease may now be behind its cancellation
+    if message.content.get('waited') and not Order.objects.resting().filter(
+            id=message.content['order_id']
+    ).exists():
+        log.info('order {} is no longer open'.format(message.content['order_id']))
+        return []
+    # orders the book already holds were journalled when it was built
+    accepted = message.content['order_id'] not in book
+    initiating_order = book.place(BookOrder.from_message(message.content))
+    if initiating_order is None:
+        log.info(
+            'order {} has already left the book'.format(message.content['order_id'])
+        )
+        return []
     log.info(
         'received {} order {}. Notifying group'.format(
             initiating_order.order_type,
             initiating_order.id
         )
     )
-    group_name = 'ws-{}-{}'.format(
-        initiating_order.pair.base_currency.code.lower(),
-        initiating_order.pair.relative_currency.code.lower()
-    )
-    send_to_ws_group(group_name, {
+    group_name = get_pair_group('ws', book.pair)
+    pair_name = get_pair_name(book.pair)
+    # everything the front end hears about the pass goes out together at the end
+    notifier = Notifier()
+    notifier.order(group_name, {
         'message_type': 'order',
         'order_id': initiating_order.id,
+        'pair': pair_name,
         'amount': str(initiating_order.amount),
         'price': str(initiating_order.price),
         'order_type': initiating_order.order_type,
-        'state': initiating_order.state,
-    })
-    # fetch the top order of interest
-    # get highest bid or lowest ask
-    existing_order = Order.objects.exclude(
-        state='closed'
-    ).exclude(
-        state='cancelled'
-    ).exclude(
-        amount=0
-    ).filter(
-        order_type='bid' if initiating_order.order_type == 'ask' else 'ask',
-        pair=initiating_order.pair
-    ).order_by(
-        '-price' if initiating_order.order_type == 'ask' else 'price',
-    )[:1]
+        'state': 'open',
+    }, user_id=initiating_order.user_id)
 
-    try:
-        existing_order = existing_order[0]
-    except IndexError:
-        log.error(
-            'No {} orders on book to match'.format(
-                'bid' if initiating_order.order_type == 'ask' else 'ask'
-            )
-        )
-        return
+    placed_amount = initiating_order.amount
+    fills = match(book, initiating_order)
 
-    # given the order found, see if we can trade
-    log.info(
-        'checking {} {} {} on {} order'.format(
-            initiating_order.price,
-            '<=' if initiating_order.order_type == 'ask' else '>=',
-            existing_order.price,
-            initiating_order.order_type
-        )
-    )
-    if initiating_order.price <= existing_order.price \
-            if initiating_order.order_type == 'ask' \
-            else initiating_order.price >= existing_order.price:
-        trade = Trade(
-            initiating_order=initiating_order,
-            existing_order=existing_order,
-            amount=initiating_order.amount,
+    # journal what the book did before any of it is written to the database
+    records = [
+        [
+            TRADE,
+            fill.initiating_id,
+            fill.existing_id,
+            fill.existing_user_id,
+            str(fill.amount),
+            str(fill.price)
+        ]
+        for fill in fills
+    ]
+    if accepted:
+        records.insert(
+            0,
+            [
+                ACCEPTED,
+                initiating_order.id,
+                initiating_order.user_id,
+                initiating_order.order_type,
+                str(initiating_order.price),
+                str(placed_amount),
+                str(placed_amount),
+                True
+            ]
         )
-        log.info('trade initialised')
-        # check the amounts to determine partial or full trade
-        if initiating_order.amount > existing_order.amount:
-            # Trade is full trade
-            trade.partial = False
-            trade.save()
-            # given that we've traded, we need to update some balances and orders
-            update_balance(
-                user=initiating_order.user,
-                currency=(
-                    initiating_order.pair.base_currency
-                    if initiating_order.order_type == 'ask' else
-                    initiating_order.pair.relative_currency
-                ),
-                amount=(
-                    (existing_order.amount * existing_order.price)
-                    if initiating_order.order_type == 'ask' else
-                    existing_order.amount
-                ),
-                order_type=initiating_order.order_type,
-            )
-            update_order(
-                initiating_order,
-                (initiating_order.amount - existing_order.amount)
-            )
-            update_balance(
-                user=existing_order.user,
-                currency=(
-                    existing_order.pair.base_currency
-                    if existing_order.order_type == 'ask' else
-                    existing_order.pair.relative_currency
-                ),
-                amount=(
-                    (existing_order.amount * existing_order.price)
-                    if initiating_order.order_type == 'ask' else
-                    existing_order.amount
-                ),
-                order_type=existing_order.order_type,
-            )
-            update_order(existing_order, 0)
+    if records:
+        _, last_seq = book.journal.append(records)
 
-        if initiating_order.amount == existing_order.amount:
-            # Trade is full trade
-            trade.partial = False
-            trade.save()
-            # given that we've traded, we need to update some balances and orders
-            update_balance(
-                user=initiating_order.user,
-                currency=(
-                    initiating_order.pair.base_currency
-                    if initiating_order.order_type == 'ask' else
-                    initiating_order.pair.relative_currency
-                ),
-                amount=(
-                    (existing_order.amount * existing_order.price)
-                    if initiating_order.order_type == 'ask' else
-                    existing_order.amount
-                ),
-                order_type=initiating_order.order_type,
-            )
-            update_order(initiating_order, 0)
-            update_balance(
-                user=existing_order.user,
-                currency=(
-                    existing_order.pair.base_currency
-                    if existing_order.order_type == 'ask' else
-                    existing_order.pair.relative_currency
-                ),
-                amount=(
-                    (existing_order.amount * existing_order.price)
-                    if initiating_order.order_type == 'ask' else
-                    existing_order.amount
-                ),
-                order_type=existing_order.order_type,
-            )
-            update_order(existing_order, 0)
+    if not fills:
+        checkpoint(book)
+        publish_ticker(book)
+        publish_deltas(book)
+        notifier.flush()
+        log.info('no trades for order {}'.format(initiating_order.id))
+        return fills
 
-        if initiating_order.amount < existing_order.amount:
-            # Trade is partial trade
-            trade.partial = True
-            trade.save()
-            # given that we've traded, we need to update some balances and orders
-            update_balance(
-                user=existing_order.user,
-                currency=(
-                    existing_order.pair.base_currency
-                    if existing_order.order_type == 'ask' else
-                    existing_order.pair.relative_currency
-                ),
-                amount=(
-                    (initiating_order.amount * existing_order.price)
-                    if existing_order.order_type == 'ask' else
-                    initiating_order.amount
-                ),
-                order_type=existing_order.order_type,
-            )
-            update_order(
-                existing_order,
-                (existing_order.amount - initiating_order.amount)
-            )
-            update_balance(
-                user=initiating_order.user,
-                currency=(
-                    initiating_order.pair.base_currency
-                    if initiating_order.order_type == 'ask' else
-                    initiating_order.pair.relative_currency
-                ),
-                amount=(
-                    (initiating_order.amount * existing_order.price)
-                    if existing_order.order_type == 'ask' else
-                    initiating_order.amount
-                ),
-                order_type=initiating_order.order_type,
-            )
-            update_order(initiating_order, 0)
+    try:
+        trades, balances = settle(book.pair, initiating_order, fills)
+    except Exception:
+        # the book has already moved on so it can't be trusted. the order itself was
+        # placed so only its trades are voided, leaving it resting unmatched when
+        # the book is rebuilt from the journal
+        book.journal.void(last_seq - len(fills) + 1, last_seq)
+        discard_book(message.content['pair_id'])
+        raise
+    checkpoint(book)
+    record_recent_trades(book.pair_id, trades)
+    for fill, trade in zip(fills, trades):
+        book.ticker.add_trade(trade.time.timestamp(), fill.price, fill.amount)
+    publish_ticker(book, traded=True)
+    publish_deltas(book)
 
-        # update the orders to the group
-        send_to_ws_group(group_name, {
-            'message_type': 'order',
-            'order_id': initiating_order.id,
-            'state': initiating_order.state,
-            'amount': str(initiating_order.amount),
-            'price': str(existing_order.price)
+    # update the balances, orders and trades on the front end
+    currency_codes = {
+        book.pair.base_currency_id: book.pair.base_currency.code.lower(),
+        book.pair.relative_currency_id: book.pair.relative_currency.code.lower(),
+    }
+    for user_id, currency_id, amount in balances:
+        notifier.balance(user_id, {
+            'message_type': 'balance',
+            'channel': 'balances',
+            'balance': str(amount),
+            'currency': currency_codes[currency_id]
         })
-
-        send_to_ws_group(group_name, {
+    trades_group = get_pair_group('trades', book.pair)
+    for fill, trade in zip(fills, trades):
+        notifier.order(group_name, {
             'message_type': 'order',
-            'order_id': existing_order.id,
-            'state': existing_order.state,
-            'amount': str(existing_order.amount),
-            'price': str(existing_order.price)
-        })
-
-        # send the trade too
-        send_to_ws_group(group_name, {
+            'order_id': fill.existing_id,
+            'pair': pair_name,
+            'order_type': book.opposite(initiating_order.order_type),
+            'state': 'partial' if fill.existing_remaining > 0 else 'complete',
+            'amount': str(fill.existing_remaining),
+            'price': str(fill.price)
+        }, user_id=fill.existing_user_id)
+        trade_message = {
             'message_type': 'trade',
+            'channel': 'trades:{}'.format(pair_name),
+            'trade_id': trade.id,
             'trade_time': str(
                 datetime.datetime.strftime(
                     trade.time,
@@ -257,17 +204,72 @@ def check_trades(message):
             ),
             'trade_type': initiating_order.order_type,
             'amount': str(trade.amount),
-            'price': str(existing_order.price),
+            'price': str(fill.price),
             'initiating_id': str(initiating_order.id),
-            'existing_id': str(existing_order.id)
-        })
+            'existing_id': str(fill.existing_id)
+        }
+        notifier.add(group_name, trade_message)
+        notifier.add(trades_group, trade_message)
+    notifier.order(group_name, {
+        'message_type': 'order',
+        'order_id': initiating_order.id,
+        'pair': pair_name,
+        'order_type': initiating_order.order_type,
+        'state': 'partial' if initiating_order.amount > 0 else 'complete',
+        'amount': str(initiating_order.amount),
+        'price': str(initiating_order.price)
+    }, user_id=initiating_order.user_id)
+    notifier.flush()
+
+    log.info(
+        'trade check finished. order {} filled {} times'.format(
+            initiating_order.id,
+            len(fills)
+        )
+    )
+    return fills
+
+
+def _check_trades(message):
+    try:
+        return match_order(message)
+    except SettlementConflict as e:
+        # the database has changed underneath the book so start again from there
+        log.warning('{}. matching order {} again'.format(e, message.content['order_id']))
+        reload_book(message.content['pair_id'])
+        return match_order(message, reloaded=True)
+
+
+@pair_owner
+def check_trades(message):
+    """
+    Run as background task whenever an order is placed
+    sweep the order across the opposite side of the book, trading at each level
+    until it is filled or no longer crosses.
+    message contains the order that was placed
+    returns the list of fills
+    """
+    return _check_trades(message)
 
-        # if there are funds left in the initiating order, go again
-        if initiating_order.amount > 0:
-            order_data = {
-                'order_id': initiating_order.id
-            }
-            print(message.channel)
-            Channel('{}'.format(message.channel)).send(order_data)
 
-        log.info('trade check finished')
+@pair_owner
+def check_trades_batch(message):
+    """
+    Run as background task whenever several orders are placed at once
+    each order is matched in turn as if it had been placed alone. an order whose
+    trades fail to settle doesn't stop the rest, it is left resting on the book
+    without them
+    returns the list of fills
+    """
+    fills = []
+    for content in message.content['orders']:
+        order_message = Message(
+            dict(content, waited=message.content.get('waited', False)),
+            message.channel.name,
+            message.channel_layer
+        )
+        try:
+            fills.extend(_check_trades(order_message))
+        except Exception:
+            log.exception('unable to match order {}'.format(content['order_id']))
+    return fills
@@ -0,0 +1,65 @@
+import json
+from collections import OrderedDict
+
+from channels import Group
+
+
+def user_orders_group(user_id):
+    return 'user-{}-orders'.format(user_id)
+
+
+def user_balances_group(user_id):
+    return 'user-{}-balances'.format(user_id)
+
+
+class Notifier(object):
+    """
+    Collect the websocket messages for a match pass and send each group one frame.
+
+    Messages added with a key replace an earlier one with the same key in that group,
+    so an order that changes several times in a pass is only sent in its final state.
+    A group with more than one message gets
+        {"message_type": "batch", "messages": [...]}
+    and a group with a single message gets the message itself.
+    """
+
+    def __init__(self):
+        self.groups = OrderedDict()
+        self._count = 0
+
+    def add(self, group_name, data, key=None):
+        messages = self.groups.setdefault(group_name, OrderedDict())
+        if key is None:
+            self._count += 1
+            key = self._count
+        # move the latest version to the end so it is applied after what it follows
+        messages.pop(key, None)
+        messages[key] = data
+
+    def order(self, group_name, data, user_id=None):
+        """
+        an order update for the pair's group and, given the owner's id,
+        for sockets following that user's orders
+        """
+        self.add(group_name, data, key=('order', data['order_id']))
+        if user_id is not None:
+            self.add(
+                user_orders_group(user_id),
+                dict(data, channel='orders'),
+                key=('order', data['order_id'])
+            )
+
+    def balance(self, user_id, data):
+        """
+        a balance update for sockets following the user's balances
+        """
+        self.add(user_balances_group(user_id), data, key=('balance', data['currency']))
+
+    def flush(self):
+        for group_name, messages in self.groups.items():
+            if len(messages) == 1:
+                frame = next(iter(messages.values()))
+            else:
+                frame = {'message_type': 'batch', 'messages': list(messages.values())}
+            Group(group_name).send({'text': json.dumps(frame)})
+        self.groups.clear()
@@ -0,0 +1,77 @@
+import logging
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.dispatch import receiver
+from django.http.cookie import parse_cookie
+
+from sleight.utils import get_redis
+
+log = logging.getLogger(__name__)
+
+SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+
+
+def _session_cache_key(session_key):
+    return 'sleight:ws:session:{}:user_id'.format(session_key)
+
+
+def _header(value):
+    return value.decode('latin-1') if isinstance(value, bytes) else value
+
+
+def session_key_from_headers(headers):
+    """
+    the session key from the cookie header of a websocket.connect message, if any
+    """
+    for name, value in headers:
+        if _header(name).lower() == 'cookie':
+            return parse_cookie(_header(value)).get(settings.SESSION_COOKIE_NAME)
+    return None
+
+
+def resolve_user_id(headers):
+    """
+    Find the id of the user logged in to the session in the socket's cookies.
+    Answers are cached for settings.WS_SESSION_CACHE_SECONDS, including sessions with
+    nobody logged in, so a storm of reconnecting sockets doesn't reach the database.
+    Returns None for anonymous sockets and if the session can't be read
+    """
+    session_key = session_key_from_headers(headers)
+    if not session_key:
+        return None
+    redis = get_redis()
+    cache_key = _session_cache_key(session_key)
+    user_id = redis.get(cache_key)
+    if user_id is not None:
+        return int(user_id) if user_id else None
+
+    try:
+        session_user_id = SessionStore(session_key).get(SESSION_KEY)
+        user_id = User.objects.filter(
+            pk=session_user_id
+        ).values_list(
+            'id',
+            flat=True
+        ).first() if session_user_id else None
+    except Exception:
+        log.exception('unable to read session for websocket')
+        return None
+    redis.setex(
+        cache_key,
+        settings.WS_SESSION_CACHE_SECONDS,
+        user_id if user_id is not None else ''
+    )
+    return user_id
+
+
+@receiver(user_logged_out)
+def forget_session(sender, request, **kwargs):
+    """
+    stop sockets connecting as the user with a session they have logged out of
+    """
+    if request is not None and request.session.session_key:
+        get_redis().delete(_session_cache_key(request.session.session_key))
@@ -0,0 +1,133 @@
+import json
+import logging
+
+from sleight.consumers.notifier import user_balances_group, user_orders_group
+from sleight.consumers.sessions import resolve_user_id
+from sleight.consumers.websockets import MEMBERSHIP_SECONDS, join_groups, leave_group, \
+    request_book_snapshot, ws_disconnect
+from sleight.engine.market_data import market_data_group
+from sleight.engine.ticker import read_ticker
+from sleight.forms import StreamAuthForm
+from sleight.utils import ensure_valid, find_pair, get_pair_group, get_redis
+
+log = logging.getLogger(__name__)
+
+# channels that need the socket to be logged in, and the group each uses
+PRIVATE_CHANNELS = {
+    'orders': user_orders_group,
+    'balances': user_balances_group,
+}
+# channels followed per pair, as <channel>:<base>/<relative>
+PAIR_CHANNELS = {
+    'book': market_data_group,
+    'trades': lambda pair: get_pair_group('trades', pair),
+    'ticker': lambda pair: get_pair_group('ticker', pair),
+}
+
+
+def _user_key(reply_channel):
+    return 'sleight:ws:{}:user_id'.format(reply_channel.name)
+
+
+def _send(message, data):
+    message.reply_channel.send({'text': json.dumps(data)})
+
+
+def _set_user(message, user_id):
+    get_redis().setex(_user_key(message.reply_channel), MEMBERSHIP_SECONDS, user_id)
+
+
+def _get_user(message):
+    user_id = get_redis().get(_user_key(message.reply_channel))
+    return int(user_id) if user_id is not None else None
+
+
+def stream_connect(message):
+    """
+    Accept a socket on /stream. It follows nothing until it subscribes.
+    A socket whose session cookie is logged in can use the private channels straight
+    away, others can log in with an auth message
+    """
+    user_id = resolve_user_id(message.content.get('headers', []))
+    if user_id is not None:
+        _set_user(message, user_id)
+    message.reply_channel.send({'accept': True}, immediately=True)
+
+
+def stream_receive(message):
+    """
+    Handle the messages a /stream socket sends
+
+        {"action": "subscribe", "channel": "book:btc/usnbt"}
+        {"action": "unsubscribe", "channel": "book:btc/usnbt"}
+        {"action": "auth", "api_key": "...", "nonce": 1, "nonce_hash": "..."}
+
+    Channels are book:<pair>, trades:<pair>, ticker:<pair> and, once logged in,
+    orders and balances. Everything sent on a channel carries its name in 'channel'.
+    A book subscription starts with a snapshot and a ticker one with the current ticker
+    """
+    try:
+        data = json.loads(message['text'])
+    except (KeyError, TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        _send(message, {'message_type': 'error', 'message': 'messages must be JSON objects'})
+        return
+
+    if data.get('action') == 'auth':
+        form = StreamAuthForm(data)
+        if not form.is_valid():
+            _send(message, {'message_type': 'error', 'message': form.errors})
+            return
+        profile, error = ensure_valid(form.cleaned_data)
+        if not profile:
+            _send(message, {'message_type': 'error', 'message': error})
+            return
+        _set_user(message, profile.user.id)
+        _send(message, {'message_type': 'authenticated'})
+        return
+
+    if data.get('action') not in ('subscribe', 'unsubscribe'):
+        _send(message, {'message_type': 'error', 'message': 'unknown action'})
+        return
+    channel = '{}'.format(data.get('channel', ''))
+    pair = None
+    if channel in PRIVATE_CHANNELS:
+        user_id = _get_user(message)
+        if user_id is None:
+            _send(message, {
+                'message_type': 'error',
+                'channel': channel,
+                'message': 'log in to use {}'.format(channel)
+            })
+            return
+        group_name = PRIVATE_CHANNELS[channel](user_id)
+    else:
+        kind, _, pair_name = channel.partition(':')
+        base_currency, _, relative_currency = pair_name.partition('/')
+        if kind in PAIR_CHANNELS:
+            pair = find_pair(base_currency, relative_currency)
+        if pair is None:
+            _send(message, {
+                'message_type': 'error',
+                'channel': channel,
+                'message': 'unknown channel'
+            })
+            return
+        group_name = PAIR_CHANNELS[kind](pair)
+
+    if data['action'] == 'unsubscribe':
+        leave_group(message, group_name)
+        _send(message, {'message_type': 'unsubscribed', 'channel': channel})
+        return
+    join_groups(message, group_name)
+    _send(message, {'message_type': 'subscribed', 'channel': channel})
+    if pair is not None and kind == 'book':
+        request_book_snapshot(message, pair)
+    elif pair is not None and kind == 'ticker':
+        _send(message, dict(read_ticker(pair.id), message_type='ticker', channel=channel))
+
+
+def stream_disconnect(message):
+    get_redis().delete(_user_key(message.reply_channel))
+    ws_disconnect(message)
@@ -1,13 +1,72 @@
+import json
 import logging
 
-from channels import Group
-from django.contrib.auth.models import User
-from django.contrib.sessions.models import Session
+from channels import Channel, Group
 
-from sleight.models import CurrencyPair
+from sleight.consumers.notifier import user_balances_group
+from sleight.consumers.sessions import resolve_user_id
+from sleight.engine.market_data import market_data_group
+from sleight.utils import find_pair, get_matching_channel, get_pair_group, get_redis
 
 log = logging.getLogger(__name__)
 
+# the channel layer forgets group members after a day, so memberships can go too
+MEMBERSHIP_SECONDS = 86400
+
+
+def _membership_key(reply_channel):
+    return 'sleight:ws:{}:groups'.format(reply_channel.name)
+
+
+def join_groups(message, *group_names):
+    """
+    add the socket to the groups and remember them so it can leave them on disconnect
+    """
+    for group_name in group_names:
+        Group(group_name, channel_layer=message.channel_layer).add(message.reply_channel)
+    key = _membership_key(message.reply_channel)
+    pipe = get_redis().pipeline()
+    pipe.sadd(key, *group_names)
+    pipe.expire(key, MEMBERSHIP_SECONDS)
+    pipe.execute()
+
+
+def leave_groups(message):
+    """
+    take the socket out of every group it joined
+    """
+    key = _membership_key(message.reply_channel)
+    pipe = get_redis().pipeline()
+    pipe.smembers(key)
+    pipe.delete(key)
+    group_names, _ = pipe.execute()
+    for group_name in group_names:
+        Group(
+            group_name.decode('utf-8'),
+            channel_layer=message.channel_layer
+        ).discard(message.reply_channel)
+
+
+def leave_group(message, group_name):
+    """
+    take the socket out of one of the groups it joined
+    """
+    Group(group_name, channel_layer=message.channel_layer).discard(message.reply_channel)
+    get_redis().srem(_membership_key(message.reply_channel), group_name)
+
+
+def request_book_snapshot(message, pair):
+    """
+    ask the pair's matcher to send the book to the socket
+    """
+    Channel(get_matching_channel(pair)).send(
+        {
+            'action': 'snapshot',
+            'pair_id': pair.id,
+            'reply_channel': message.reply_channel.name,
+        }
+    )
+
 
 def ws_connect(message):
     # Get the prefix and requested currencies from the path
@@ -15,8 +74,8 @@ def ws_connect(message):
         prefix, base_currency, relative_currency = (
             message['path'].strip('/').split('/')
         )
-        # error if the socket hasn't requested an exchange
-        if prefix != 'exchange':
+        # error if the socket hasn't requested an exchange or a market data feed
+        if prefix not in ('exchange', 'book'):
             log.debug('invalid ws path=%s', message['path'])
             return
     except ValueError:
@@ -24,56 +83,54 @@ def ws_connect(message):
         return
 
     # check the requested pair
-    try:
-        CurrencyPair.objects.get(
-            base_currency__code__iexact=base_currency,
-            relative_currency__code__iexact=relative_currency
-        )
-    except CurrencyPair.DoesNotExist:
+    pair = find_pair(base_currency, relative_currency)
+    if pair is None:
         log.debug('invalid pair {}/{}'.format(base_currency, relative_currency))
         return
 
+    # market data sockets get sequenced book deltas after a snapshot
+    if prefix == 'book':
+        join_groups(message, market_data_group(pair))
+        message.reply_channel.send({'accept': True}, immediately=True)
+        request_book_snapshot(message, pair)
+        return
+
     # add the sockets reply channel to the exchange group
-    Group(
-        'ws-{}-{}'.format(base_currency.lower(), relative_currency.lower()),
-        channel_layer=message.channel_layer
-    ).add(message.reply_channel)
-
-    # also add the socket reply channel to a user group
-    # first, get the session id from the message headers
-    session_id = None
-    for header in message['headers']:
-        if header[0] == 'cookie':
-            data = header[1].split(';')
-            for datum in data:
-                session_id_check = datum.strip().split('=')
-                if session_id_check[0] == 'sessionid':
-                    session_id = session_id_check[1]
-    # if we got a session id, we add the reply channel to that users
-    if session_id:
-        session = Session.objects.get(session_key=session_id)
-        uid = session.get_decoded().get('_auth_user_id')
-        user = User.objects.get(pk=uid)
-        Group(
-            user.username,
-            channel_layer=message.channel_layer
-        ).add(message.reply_channel)
+    group_names = [get_pair_group('ws', pair)]
+
+    # also add the socket reply channel to the user's balances group
+    # if the session in its cookies is logged in
+    user_id = resolve_user_id(message.content.get('headers', []))
+    if user_id is not None:
+        group_names.append(user_balances_group(user_id))
+    join_groups(message, *group_names)
     message.reply_channel.send({'accept': True}, immediately=True)
 
 
+def ws_receive(message):
+    """
+    a market data socket that has missed a delta sends {"action": "snapshot"}
+    to get the whole book again
+    """
+    try:
+        prefix, base_currency, relative_currency = (
+            message['path'].strip('/').split('/')
+        )
+        data = json.loads(message['text'])
+    except (KeyError, TypeError, ValueError):
+        log.debug('invalid ws message on path=%s', message.get('path'))
+        return
+    if prefix != 'book' or not isinstance(data, dict) or data.get('action') != 'snapshot':
+        return
+    pair = find_pair(base_currency, relative_currency)
+    if pair is None:
+        return
+    request_book_snapshot(message, pair)
+
+
 def ws_disconnect(message):
-    # check every exchange channel and remove the reply channel
-    # (discard removes if the channel exists in a group and nothing otherwise)
-    for pair in CurrencyPair.objects.select_related(
-            'base_currency',
-            'relative_currency'
-    ).all():
-        Group(
-            'ws-{}-{}'.format(
-                pair.base_currency.code.lower(),
-                pair.relative_currency.code.lower()
-            )
-        ).discard(message.reply_channel)
+    # remove the reply channel from the groups it joined when it connected
+    leave_groups(message)
 
     message.reply_channel.send(
         {
@@ -0,0 +1,407 @@
+import heapq
+import logging
+import os
+from collections import OrderedDict
+from decimal import Decimal
+
+from sleight.engine.journal import ACCEPTED, CANCELLED, HEADER, TRADE, Journal, \
+    read_records, voided
+from sleight.engine.market_data import publish_snapshot
+from sleight.engine.recent_trades import load_recent_trades
+from sleight.engine.ticker import load_ticker, publish_ticker
+from sleight.models import CurrencyPair, Order, Trade
+from sleight.utils import get_pair
+
+log = logging.getLogger(__name__)
+
+# books held by this process, keyed by pair id
+_books = {}
+
+
+class BookOrder(object):
+    """
+    the part of an order the matching engine needs to keep in memory
+    """
+    __slots__ = ('id', 'user_id', 'order_type', 'price', 'amount')
+
+    def __init__(self, id, user_id, order_type, price, amount):
+        self.id = id
+        self.user_id = user_id
+        self.order_type = order_type
+        self.price = Decimal(price)
+        self.amount = Decimal(amount)
+
+    def __repr__(self):
+        return '<BookOrder {} {} {} @ {}>'.format(
+            self.id,
+            self.order_type,
+            self.amount,
+            self.price
+        )
+
+    @classmethod
+    def from_message(cls, content):
+        """
+        build the book entry from a check_trades message sent by PlaceOrder
+        """
+        return cls(
+            id=content['order_id'],
+            user_id=content['user_id'],
+            order_type=content['order_type'],
+            price=content['price'],
+            amount=content['amount'],
+        )
+
+
+class OrderBook(object):
+    """
+    Price-time priority order book for a single currency pair.
+
+    Each side maps price -> OrderedDict of resting orders in arrival order.
+    A heap of prices per side keeps the best level at the top so best bid/ask
+    is O(1). Levels that empty out stay in the heap and are dropped lazily once
+    they reach the top, which keeps insert and cancel at O(log n).
+    The amount resting on each side is kept as a running total and the levels touched
+    since the last market data publish are collected in changed.
+    """
+
+    def __init__(self, pair_id, pair=None):
+        self.pair_id = pair_id
+        self.pair = pair
+        self.levels = {'bid': {}, 'ask': {}}
+        self._heaps = {'bid': [], 'ask': []}
+        self._heaped = {'bid': set(), 'ask': set()}
+        self._orders = {}
+        self.volume = {'bid': Decimal(0), 'ask': Decimal(0)}
+        self.changed = set()
+        # ids read from the database when the book was built
+        self._loaded = set()
+        self.journal = None
+        self.ticker = None
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders
+
+    @staticmethod
+    def opposite(order_type):
+        return 'bid' if order_type == 'ask' else 'ask'
+
+    @staticmethod
+    def _heap_key(order_type, price):
+        # bids are stored negated so the highest bid sits at the top of the heap
+        return -price if order_type == 'bid' else price
+
+    def orders(self):
+        """
+        every resting order, oldest first within each price level
+        """
+        for levels in self.levels.values():
+            for level in levels.values():
+                for order in level.values():
+                    yield order
+
+    def get(self, order_id):
+        return self._orders.get(order_id)
+
+    def add(self, order):
+        """
+        rest an order at the back of its price level
+        """
+        levels = self.levels[order.order_type]
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = OrderedDict()
+            if order.price not in self._heaped[order.order_type]:
+                self._heaped[order.order_type].add(order.price)
+                heapq.heappush(
+                    self._heaps[order.order_type],
+                    self._heap_key(order.order_type, order.price)
+                )
+        level[order.id] = order
+        self._orders[order.id] = order
+        self.volume[order.order_type] += order.amount
+        self.changed.add((order.order_type, order.price))
+        return order
+
+    def place(self, order):
+        """
+        add a newly placed order.
+        the order may already have been read from the database when the book was
+        built, and might even have traded since, so only add it if it is unseen.
+        returns the resting order or None if it is no longer on the book
+        """
+        if order.id in self._loaded:
+            self._loaded.discard(order.id)
+            return self.get(order.id)
+        return self.add(order)
+
+    def remove(self, order_id):
+        """
+        take an order off the book. returns the order or None if it wasn't resting
+        """
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        levels = self.levels[order.order_type]
+        level = levels[order.price]
+        del level[order.id]
+        if not level:
+            del levels[order.price]
+        self.volume[order.order_type] -= order.amount
+        self.changed.add((order.order_type, order.price))
+        return order
+
+    def fill(self, order_id, amount):
+        """
+        reduce a resting order by the traded amount, removing it once it is empty
+        """
+        order = self._orders[order_id]
+        order.amount -= amount
+        self.volume[order.order_type] -= amount
+        self.changed.add((order.order_type, order.price))
+        if order.amount <= 0:
+            self.remove(order_id)
+        return order
+
+    def best_price(self, order_type):
+        """
+        highest bid or lowest ask, None if that side is empty
+        """
+        heap = self._heaps[order_type]
+        levels = self.levels[order_type]
+        while heap:
+            price = -heap[0] if order_type == 'bid' else heap[0]
+            if price in levels:
+                return price
+            # the level emptied out since it was pushed
+            heapq.heappop(heap)
+            self._heaped[order_type].discard(price)
+        return None
+
+    def best_order(self, order_type):
+        """
+        the oldest order at the best price on the given side
+        """
+        price = self.best_price(order_type)
+        if price is None:
+            return None
+        return next(iter(self.levels[order_type][price].values()))
+
+
+def _get_pair(pair_id):
+    pair = get_pair(pair_id)
+    if pair is None:
+        raise CurrencyPair.DoesNotExist('pair {} not found'.format(pair_id))
+    return pair
+
+
+def load_book(pair_id):
+    """
+    rebuild the book for a pair from the resting orders in the database
+    and start a new journal from it
+    """
+    book = OrderBook(pair_id, pair=_get_pair(pair_id))
+    orders = Order.objects.resting().exclude(
+        amount=0
+    ).filter(
+        pair_id=pair_id
+    ).order_by(
+        'id'
+    ).values_list(
+        'id', 'user_id', 'order_type', 'price', 'amount', 'original_amount'
+    )
+    imported = []
+    for order_id, user_id, order_type, price, amount, original_amount in orders:
+        book.add(BookOrder(order_id, user_id, order_type, price, amount))
+        book._loaded.add(order_id)
+        imported.append(
+            [
+                ACCEPTED,
+                order_id,
+                user_id,
+                order_type,
+                str(price),
+                str(amount),
+                str(original_amount),
+                False
+            ]
+        )
+    book.journal = Journal(pair_id)
+    book.journal.start(imported)
+    log.info('loaded {} orders into book for pair {}'.format(len(book), pair_id))
+    return book
+
+
+def replay(book, records, skip=None):
+    """
+    apply journal records to a book, skipping any that were voided
+    or whose sequence numbers are in skip
+    """
+    if skip is None:
+        skip = voided(records)
+    for record in records:
+        if record[0] in skip:
+            continue
+        if record[1] == ACCEPTED:
+            book.add(BookOrder(*record[3:8]))
+            book._loaded.add(record[3])
+        elif record[1] == TRADE:
+            amount = Decimal(record[6])
+            book.fill(record[4], amount)
+            book.fill(record[3], amount)
+        elif record[1] == CANCELLED:
+            book.remove(record[3])
+
+
+def unsettled_trades(records, skip):
+    """
+    Runs of [first_seq, last_seq] of the trade records that never reached the database.
+    The process can die after a match pass is journalled and before it is settled.
+    A pass settles in one transaction so either all of its trades were written or
+    none of them were
+    """
+    trades = [record for record in records if record[1] == TRADE and record[0] not in skip]
+    if not trades:
+        return []
+    settled = set(
+        Trade.objects.filter(
+            initiating_order_id__in={record[3] for record in trades}
+        ).values_list(
+            'initiating_order_id',
+            'existing_order_id'
+        )
+    )
+    runs = []
+    for record in trades:
+        if (record[3], record[4]) in settled:
+            continue
+        if runs and runs[-1][1] == record[0] - 1:
+            runs[-1][1] = record[0]
+        else:
+            runs.append([record[0], record[0]])
+    return runs
+
+
+def restore_book(pair_id):
+    """
+    Rebuild the book from its latest snapshot and the journal records after it.
+    Returns None if this worker doesn't hold the latest journal for the pair
+    """
+    journal = Journal(pair_id)
+    if not os.path.exists(journal.path):
+        return None
+    book = OrderBook(pair_id, pair=_get_pair(pair_id))
+    journal_id = None
+    seq = 0
+    offset = 0
+    snapshot = journal.read_snapshot()
+    if snapshot is not None:
+        journal_id = snapshot['journal_id']
+        seq = snapshot['seq']
+        offset = snapshot['offset']
+        for order in snapshot['orders']:
+            book.add(BookOrder(*order))
+            book._loaded.add(order[0])
+
+    records = []
+    for record, offset in read_records(journal.path, offset):
+        records.append(record)
+    if records and records[0][1] == HEADER:
+        journal_id = records.pop(0)[3]
+    if records:
+        seq = records[-1][0]
+    if journal_id is None or not journal.is_current(journal_id, seq):
+        log.info('journal for pair {} is not the latest'.format(pair_id))
+        return None
+
+    journal.resume(journal_id, seq, offset)
+    journal.since_snapshot = len(records)
+    # trades left unsettled by a crash are voided as if settling them had failed,
+    # leaving their orders as they were before the pass
+    skip = voided(records)
+    for first_seq, last_seq in unsettled_trades(records, skip):
+        log.warning(
+            'voiding unsettled trades {} to {} for pair {}'.format(first_seq, last_seq, pair_id)
+        )
+        journal.void(first_seq, last_seq)
+        skip.update(range(first_seq, last_seq + 1))
+    replay(book, records, skip)
+    book.journal = journal
+    log.info(
+        'restored {} orders into book for pair {} replaying {} journal records'.format(
+            len(book),
+            pair_id,
+            len(records)
+        )
+    )
+    return book
+
+
+def checkpoint(book):
+    """
+    snapshot the book if enough has been journalled since the last one
+    """
+    if book.journal.snapshot_due():
+        book.journal.write_snapshot(
+            [
+                [order.id, order.user_id, order.order_type, str(order.price), str(order.amount)]
+                for order in book.orders()
+            ]
+        )
+
+
+def get_book(pair_id):
+    """
+    return this process' book for the pair, restoring it from the journal
+    or loading it from the database on first use
+    """
+    book = _books.get(pair_id)
+    if book is None:
+        # an empty book is falsy, so test for None
+        book = restore_book(pair_id)
+        if book is None:
+            book = load_book(pair_id)
+        _books[pair_id] = book
+        book.ticker = load_ticker(pair_id)
+        load_recent_trades(pair_id)
+        publish_ticker(book, traded=True)
+        publish_snapshot(book)
+    return book
+
+
+def discard_book(pair_id):
+    """
+    forget the book for a pair so the next use rebuilds it.
+    used when the book may have moved ahead of what was written
+    """
+    book = _books.pop(pair_id, None)
+    if book is not None and book.journal is not None:
+        book.journal.close()
+
+
+def discard_stale_book(pair_id):
+    """
+    Forget the book for a pair if something has been journalled for it since this
+    process last did, as another worker has moved it on. A worker that takes back a
+    pair nobody else has touched keeps its book
+    """
+    book = _books.get(pair_id)
+    if book is not None and not book.journal.is_current(book.journal.journal_id, book.journal.seq):
+        discard_book(pair_id)
+
+
+def reload_book(pair_id):
+    """
+    replace the book with one loaded from the database, starting a fresh journal
+    """
+    discard_book(pair_id)
+    book = _books[pair_id] = load_book(pair_id)
+    book.ticker = load_ticker(pair_id)
+    load_recent_trades(pair_id)
+    publish_ticker(book, traded=True)
+    publish_snapshot(book)
+    return book
+
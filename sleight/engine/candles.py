@@ -0,0 +1,98 @@
+import datetime
+from collections import OrderedDict
+
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from sleight.models import Candle
+
+# candle resolutions and their width in seconds
+RESOLUTIONS = OrderedDict([
+    ('1m', 60),
+    ('5m', 300),
+    ('1h', 3600),
+    ('1d', 86400),
+])
+
+
+def bucket_start(moment, resolution):
+    """
+    the start of the candle of the given resolution that moment falls in
+    """
+    seconds = RESOLUTIONS[resolution]
+    timestamp = int(moment.timestamp())
+    return datetime.datetime.fromtimestamp(timestamp - timestamp % seconds, tz=timezone.utc)
+
+
+class CandleBuilder(object):
+    """
+    roll (time, price, amount) trades, in time order, into a candle per resolution
+    and bucket
+    """
+
+    def __init__(self, pair_id):
+        self.pair_id = pair_id
+        self.candles = OrderedDict()
+
+    def add_trade(self, moment, price, amount):
+        for resolution in RESOLUTIONS:
+            start = bucket_start(moment, resolution)
+            candle = self.candles.get((resolution, start))
+            if candle is None:
+                self.candles[(resolution, start)] = Candle(
+                    pair_id=self.pair_id,
+                    resolution=resolution,
+                    start=start,
+                    open=price,
+                    high=price,
+                    low=price,
+                    close=price,
+                    volume=amount,
+                    base_volume=amount * price,
+                    trades=1
+                )
+                continue
+            candle.high = max(candle.high, price)
+            candle.low = min(candle.low, price)
+            candle.close = price
+            candle.volume += amount
+            candle.base_volume += amount * price
+            candle.trades += 1
+
+    def pop_before(self, moment):
+        """
+        take the candles that ended before moment, they can't receive any more trades
+        """
+        closed = [
+            key for key in self.candles
+            if key[1] + datetime.timedelta(seconds=RESOLUTIONS[key[0]]) <= moment
+        ]
+        return [self.candles.pop(key) for key in closed]
+
+
+def record_trades(pair_id, trades):
+    """
+    Fold the (time, price, amount) trades from a match pass into the pair's candles.
+    A pass rarely spans more than one bucket so this is about one update per
+    resolution. Call it inside the settlement transaction
+    """
+    builder = CandleBuilder(pair_id)
+    for moment, price, amount in trades:
+        builder.add_trade(moment, price, amount)
+    for candle in builder.candles.values():
+        updated = Candle.objects.filter(
+            pair_id=pair_id,
+            resolution=candle.resolution,
+            start=candle.start
+        ).update(
+            # not Greatest and Least, sqlite binds decimals as text and ranks any text
+            # above a number. comparing with the column converts them first
+            high=Case(When(high__lt=candle.high, then=Value(candle.high)), default=F('high')),
+            low=Case(When(low__gt=candle.low, then=Value(candle.low)), default=F('low')),
+            close=candle.close,
+            volume=F('volume') + candle.volume,
+            base_volume=F('base_volume') + candle.base_volume,
+            trades=F('trades') + candle.trades
+        )
+        if not updated:
+            candle.save()
@@ -0,0 +1,214 @@
+import logging
+import os
+import struct
+import time
+import uuid
+
+import msgpack
+from django.conf import settings
+
+from sleight.utils import get_redis
+
+log = logging.getLogger(__name__)
+
+HEADER = 'journal'
+ACCEPTED = 'accepted'
+TRADE = 'trade'
+CANCELLED = 'cancelled'
+VOID = 'void'
+
+_length = struct.Struct('>I')
+
+
+def _pack(record):
+    data = msgpack.packb(record, use_bin_type=True)
+    return _length.pack(len(data)) + data
+
+
+def read_records(path, offset=0):
+    """
+    yield (record, end offset) from a journal file, stopping at a torn final record
+    """
+    with open(path, 'rb') as journal_file:
+        journal_file.seek(offset)
+        while True:
+            prefix = journal_file.read(_length.size)
+            if len(prefix) < _length.size:
+                return
+            length = _length.unpack(prefix)[0]
+            data = journal_file.read(length)
+            if len(data) < length:
+                log.warning('ignoring torn record at {} in {}'.format(offset, path))
+                return
+            offset += _length.size + len(data)
+            yield msgpack.unpackb(data, encoding='utf-8'), offset
+
+
+def voided(records):
+    """
+    the sequence numbers cancelled out by void records
+    """
+    seqs = set()
+    for record in records:
+        if record[1] == VOID:
+            seqs.update(range(record[3], record[4] + 1))
+    return seqs
+
+
+class Journal(object):
+    """
+    Append-only journal of everything the matching engine does to a pair's book.
+
+    Each pair has a <pair_id>.journal file in settings.JOURNAL_DIR holding length
+    prefixed msgpack records, written before the results reach the database:
+
+        [0, 'journal', time, journal_id, pair_id]
+        [seq, 'accepted', time, order_id, user_id, order_type, price, amount,
+            original_amount, placed]
+        [seq, 'trade', time, initiating_id, existing_id, existing_user_id, amount, price]
+        [seq, 'cancelled', time, order_id]
+        [seq, 'void', time, first_seq, last_seq]
+
+    'accepted' records with placed False are resting orders imported from the database
+    when the journal was started. A 'void' follows records whose settlement failed,
+    or is added when the book is restored for trades a crash left unsettled.
+    Prices and amounts are stored as strings so Decimals survive the round trip.
+
+    Every settings.JOURNAL_SNAPSHOT_EVENTS records the book is written to
+    <pair_id>.snapshot so a restart only replays the records after it.
+    The journal id and last sequence number are also kept in redis so a worker can tell
+    whether its copy of the journal is the latest one for the pair.
+    """
+
+    def __init__(self, pair_id):
+        self.pair_id = pair_id
+        self.path = os.path.join(settings.JOURNAL_DIR, '{}.journal'.format(pair_id))
+        self.snapshot_path = os.path.join(
+            settings.JOURNAL_DIR,
+            '{}.snapshot'.format(pair_id)
+        )
+        self.journal_id = None
+        self.seq = 0
+        self.since_snapshot = 0
+        self._file = None
+
+    @property
+    def _redis_key(self):
+        return 'sleight:journal:{}'.format(self.pair_id)
+
+    def start(self, imported):
+        """
+        Begin a new journal for a book loaded from the database.
+        The previous journal and snapshot are kept alongside as <path>.previous,
+        replacing the generation before them so the directory doesn't grow.
+        imported is a list of accepted records (without seq) for the resting orders
+        """
+        if not os.path.isdir(settings.JOURNAL_DIR):
+            os.makedirs(settings.JOURNAL_DIR)
+        for path in (self.path, self.snapshot_path):
+            previous_path = '{}.previous'.format(path)
+            if os.path.exists(path):
+                os.replace(path, previous_path)
+            elif os.path.exists(previous_path):
+                # don't leave a snapshot of an older journal next to the previous one
+                os.remove(previous_path)
+        self.journal_id = uuid.uuid4().hex
+        self.seq = 0
+        self._file = open(self.path, 'ab')
+        self._write([[0, HEADER, time.time(), self.journal_id, self.pair_id]])
+        if imported:
+            self.append(imported)
+        log.info(
+            'started journal {} for pair {} with {} resting orders'.format(
+                self.journal_id,
+                self.pair_id,
+                len(imported)
+            )
+        )
+
+    def resume(self, journal_id, seq, offset):
+        """
+        carry on appending to an existing journal after it has been replayed
+        """
+        self.journal_id = journal_id
+        self.seq = seq
+        self._file = open(self.path, 'ab')
+        # drop anything torn off the end by a crash
+        self._file.truncate(offset)
+
+    def is_current(self, journal_id, seq):
+        """
+        whether the journal read from disk is the latest written for the pair
+        """
+        return get_redis().get(self._redis_key) == '{}:{}'.format(
+            journal_id,
+            seq
+        ).encode('utf-8')
+
+    def _write(self, records):
+        self._file.write(b''.join(_pack(record) for record in records))
+        self._file.flush()
+        if settings.JOURNAL_FSYNC:
+            os.fsync(self._file.fileno())
+        get_redis().set(self._redis_key, '{}:{}'.format(self.journal_id, self.seq))
+
+    def append(self, records):
+        """
+        Number and durably write records given as [type, ...] without seq or time.
+        Returns the first and last sequence numbers used
+        """
+        now = time.time()
+        first_seq = self.seq + 1
+        numbered = []
+        for record in records:
+            self.seq += 1
+            numbered.append([self.seq, record[0], now] + list(record[1:]))
+        self._write(numbered)
+        self.since_snapshot += len(numbered)
+        return first_seq, self.seq
+
+    def void(self, first_seq, last_seq):
+        """
+        mark records whose effects never reached the database
+        """
+        self.append([[VOID, first_seq, last_seq]])
+
+    def snapshot_due(self):
+        return self.since_snapshot >= settings.JOURNAL_SNAPSHOT_EVENTS
+
+    def write_snapshot(self, orders):
+        """
+        write the resting orders as at the current sequence number.
+        the file is replaced atomically so a crash leaves the previous snapshot
+        """
+        snapshot = {
+            'journal_id': self.journal_id,
+            'seq': self.seq,
+            'offset': self._file.tell(),
+            'orders': orders,
+        }
+        temp_path = '{}.tmp'.format(self.snapshot_path)
+        with open(temp_path, 'wb') as snapshot_file:
+            snapshot_file.write(msgpack.packb(snapshot, use_bin_type=True))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.rename(temp_path, self.snapshot_path)
+        self.since_snapshot = 0
+        log.info(
+            'wrote snapshot of {} orders for pair {} at {}'.format(
+                len(orders),
+                self.pair_id,
+                self.seq
+            )
+        )
+
+    def read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path, 'rb') as snapshot_file:
+            return msgpack.unpackb(snapshot_file.read(), encoding='utf-8')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,128 @@
+import functools
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from channels import Channel
+from channels.signals import worker_ready
+from django.conf import settings
+from django.db import DatabaseError
+from django.dispatch import receiver
+
+from sleight.engine.book import discard_stale_book, get_book
+from sleight.utils import get_matching_channel, get_pairs, get_redis
+
+log = logging.getLogger(__name__)
+
+WORKER_ID = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+LEASE_RENEWED = 1
+LEASE_ACQUIRED = 2
+
+# how long a worker waiting for a pair's lease first sleeps, doubling up to the most
+WAIT_SECONDS = 0.05
+MAX_WAIT_SECONDS = 1
+
+# renew the lease if we hold it, otherwise take it only if nobody else does
+_CLAIM = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('set', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 2
+end
+return 0
+"""
+_claim_script = None
+
+# threads of a multi-threaded worker share the books, so they queue per pair too
+_pair_locks = defaultdict(threading.Lock)
+
+
+def claim_pair(pair_id):
+    """
+    Take or renew this worker's lease on matching a pair.
+    Returns LEASE_RENEWED if the lease was already ours, LEASE_ACQUIRED if it has
+    just become ours and 0 if another worker holds it
+    """
+    global _claim_script
+    if _claim_script is None:
+        _claim_script = get_redis().register_script(_CLAIM)
+    return _claim_script(
+        keys=['sleight:lease:pair:{}'.format(pair_id)],
+        args=[WORKER_ID, settings.PAIR_LEASE_SECONDS * 1000]
+    )
+
+
+def pair_owner(consumer):
+    """
+    Decorator for consumers that touch a pair's book.
+    Only the worker holding the pair's lease runs the consumer. Each pair's channel
+    should have a single worker consuming it, so another worker only holds the lease
+    while it lapses after a restart. Until then the message is held, backing off
+    between claims, rather than sent back to the end of the channel where it would
+    be matched after orders placed later. If the lease is still held once it could
+    have lapsed, another worker is consuming the channel too and the message is sent
+    back for it. A message that had to wait is marked so the consumer can check it
+    hasn't been overtaken.
+    A worker that takes over a pair throws its copy of the book away if another worker
+    has moved the book on since.
+    """
+    @functools.wraps(consumer)
+    def inner(message, *args, **kwargs):
+        pair_id = message.content['pair_id']
+        with _pair_locks[pair_id]:
+            lease = claim_pair(pair_id)
+            if not lease:
+                log.warning(
+                    '{} does not own pair {}. waiting for the lease'.format(
+                        WORKER_ID,
+                        pair_id
+                    )
+                )
+                give_up = time.time() + settings.PAIR_LEASE_SECONDS
+                wait = WAIT_SECONDS
+                while not lease:
+                    if time.time() >= give_up:
+                        log.warning(
+                            '{} gave up waiting for pair {}. sending the message back'.format(
+                                WORKER_ID,
+                                pair_id
+                            )
+                        )
+                        Channel(message.channel.name).send(dict(message.content, waited=True))
+                        return None
+                    time.sleep(wait)
+                    wait = min(wait * 2, MAX_WAIT_SECONDS)
+                    lease = claim_pair(pair_id)
+                message.content['waited'] = True
+            if lease == LEASE_ACQUIRED:
+                log.info('{} now owns pair {}'.format(WORKER_ID, pair_id))
+                discard_stale_book(pair_id)
+            return consumer(message, *args, **kwargs)
+    return inner
+
+
+@receiver(worker_ready)
+def load_books(sender, **kwargs):
+    """
+    Build the books this worker matches as it starts so the first order doesn't pay
+    for it. Only pairs whose channel the worker consumes and whose lease it can take
+    are built, under that lease, so other workers never touch a pair's journal
+    """
+    try:
+        pairs = list(get_pairs().values())
+    except DatabaseError:
+        log.warning('unable to load order books. have migrations been run?')
+        return
+    for pair in pairs:
+        if not sender.apply_channel_filters([get_matching_channel(pair)]):
+            continue
+        with _pair_locks[pair.id]:
+            if claim_pair(pair.id):
+                get_book(pair.id)
@@ -0,0 +1,87 @@
+import json
+from decimal import Decimal
+
+from channels import Group
+
+from sleight.utils import format_decimal, get_pair_group, get_pair_name, get_redis
+
+
+def market_data_group(pair):
+    return get_pair_group('md', pair)
+
+
+def _seq_key(pair_id):
+    return 'sleight:md:{}:seq'.format(pair_id)
+
+
+def _level(book, order_type, price):
+    level = book.levels[order_type].get(price)
+    if not level:
+        return {
+            'side': order_type,
+            'price': format_decimal(price),
+            'amount': format_decimal(Decimal(0)),
+            'orders': 0
+        }
+    return {
+        'side': order_type,
+        'price': format_decimal(price),
+        'amount': format_decimal(sum(order.amount for order in level.values())),
+        'orders': len(level)
+    }
+
+
+def book_snapshot(book):
+    """
+    Every price level on the book, best first, as at the current sequence number.
+    Deltas with a higher sequence number apply on top of it
+    """
+    seq = get_redis().get(_seq_key(book.pair_id))
+    book.changed.clear()
+    return {
+        'message_type': 'book_snapshot',
+        'channel': 'book:{}'.format(get_pair_name(book.pair)),
+        'seq': int(seq) if seq is not None else 0,
+        'bids': [
+            _level(book, 'bid', price)
+            for price in sorted(book.levels['bid'], reverse=True)
+        ],
+        'asks': [
+            _level(book, 'ask', price)
+            for price in sorted(book.levels['ask'])
+        ],
+    }
+
+
+def publish_snapshot(book):
+    """
+    send the whole book to the pair's market data group.
+    used when the book is rebuilt as it may not match what the deltas described
+    """
+    Group(market_data_group(book.pair)).send({'text': json.dumps(book_snapshot(book))})
+
+
+def publish_deltas(book):
+    """
+    Send the price levels changed since the last publish under the next sequence number.
+    Levels carry their new total amount and order count rather than the change so a
+    delta can be applied twice, and a level that emptied out is sent with no orders.
+    A client that sees a sequence number more than one past its last should ask for a
+    new snapshot
+    """
+    if not book.changed:
+        return
+    seq = get_redis().incr(_seq_key(book.pair_id))
+    levels = [
+        _level(book, order_type, price)
+        for order_type, price in sorted(book.changed)
+    ]
+    book.changed.clear()
+    Group(market_data_group(book.pair)).send({
+        'text': json.dumps({
+            'message_type': 'book_delta',
+            'channel': 'book:{}'.format(get_pair_name(book.pair)),
+            'seq': seq,
+            'levels': levels
+        })
+    })
@@ -0,0 +1,55 @@
+from collections import namedtuple
+
+Fill = namedtuple(
+    'Fill',
+    [
+        'initiating_id',
+        'existing_id',
+        'existing_user_id',
+        'amount',
+        'price',
+        'partial',
+        'initiating_remaining',
+        'existing_remaining',
+    ]
+)
+
+
+def crosses(initiating_order, existing_order):
+    """
+    an ask trades with bids at or above its price, a bid with asks at or below it
+    """
+    if initiating_order.order_type == 'ask':
+        return initiating_order.price <= existing_order.price
+    return initiating_order.price >= existing_order.price
+
+
+def match(book, initiating_order):
+    """
+    Sweep the initiating order across the opposite side of the book until it is
+    filled or the best opposite price no longer crosses.
+    Trades happen at the price of the resting order.
+    The book is updated as fills happen. The list of fills is returned
+    """
+    fills = []
+    opposite = book.opposite(initiating_order.order_type)
+    while initiating_order.amount > 0:
+        existing_order = book.best_order(opposite)
+        if existing_order is None or not crosses(initiating_order, existing_order):
+            break
+        amount = min(initiating_order.amount, existing_order.amount)
+        book.fill(existing_order.id, amount)
+        book.fill(initiating_order.id, amount)
+        fills.append(
+            Fill(
+                initiating_id=initiating_order.id,
+                existing_id=existing_order.id,
+                existing_user_id=existing_order.user_id,
+                amount=amount,
+                price=existing_order.price,
+                partial=existing_order.amount > 0,
+                initiating_remaining=initiating_order.amount,
+                existing_remaining=existing_order.amount,
+            )
+        )
+    return fills
@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+
+from sleight.models import Trade
+from sleight.utils import format_decimal, get_redis
+
+
+def _recent_trades_key(pair_id):
+    return 'sleight:trades:{}'.format(pair_id)
+
+
+def _entry(trade):
+    return json.dumps({
+        'id': trade.id,
+        'time': trade.time.timestamp(),
+        'price': format_decimal(trade.price),
+        'amount': format_decimal(trade.amount),
+        'taker_side': trade.taker_side,
+        'initiating_order_id': trade.initiating_order_id,
+        'existing_order_id': trade.existing_order_id,
+    })
+
+
+def load_recent_trades(pair_id):
+    """
+    replace the pair's recent trades in redis with the latest from the database.
+    the matcher does this as it loads a book so the list starts out complete
+    """
+    trades = Trade.objects.filter(
+        pair_id=pair_id
+    ).order_by(
+        '-time',
+        '-id'
+    ).only(
+        'id',
+        'time',
+        'price',
+        'amount',
+        'taker_side',
+        'initiating_order_id',
+        'existing_order_id'
+    )[:settings.RECENT_TRADES]
+    key = _recent_trades_key(pair_id)
+    pipe = get_redis().pipeline()
+    pipe.delete(key)
+    entries = [_entry(trade) for trade in trades]
+    if entries:
+        pipe.rpush(key, *entries)
+    pipe.execute()
+
+
+def record_recent_trades(pair_id, trades):
+    """
+    Add the trades from a match pass, oldest first, to the front of the pair's list
+    and trim it so only the latest settings.RECENT_TRADES are kept
+    """
+    key = _recent_trades_key(pair_id)
+    pipe = get_redis().pipeline()
+    pipe.lpush(key, *[_entry(trade) for trade in trades])
+    pipe.ltrim(key, 0, settings.RECENT_TRADES - 1)
+    pipe.execute()
+
+
+def read_recent_trades(pair_id, limit=None):
+    """
+    the pair's most recent trades, newest first
+    """
+    entries = get_redis().lrange(
+        _recent_trades_key(pair_id),
+        0,
+        (limit or settings.RECENT_TRADES) - 1
+    )
+    return [json.loads(entry.decode('utf-8')) for entry in entries]
@@ -0,0 +1,149 @@
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from sleight.engine.candles import record_trades
+from sleight.models import Balance, Order, Trade
+
+log = logging.getLogger(__name__)
+
+
+class SettlementConflict(Exception):
+    """
+    an order changed in the database after the book matched it,
+    usually because it was cancelled while the match was in flight
+    """
+
+
+def balance_deltas(pair, initiating_order, fills):
+    """
+    Net what each (user_id, currency_id) gains from a list of fills.
+    ask/sell orders get amount * price of the base currency
+    bid/buy orders get amount of the relative currency
+    """
+    deltas = defaultdict(Decimal)
+    for fill in fills:
+        if initiating_order.order_type == 'ask':
+            ask_user_id, bid_user_id = initiating_order.user_id, fill.existing_user_id
+        else:
+            ask_user_id, bid_user_id = fill.existing_user_id, initiating_order.user_id
+            # the bid reserved funds at its own price but traded at the resting price
+            deltas[(bid_user_id, pair.base_currency_id)] += (
+                (initiating_order.price - fill.price) * fill.amount
+            )
+        deltas[(ask_user_id, pair.base_currency_id)] += fill.amount * fill.price
+        deltas[(bid_user_id, pair.relative_currency_id)] += fill.amount
+    return deltas
+
+
+def move_balance(user_id, currency_id, delta):
+    """
+    Add delta to a balance with an F() expression, creating the balance if the user
+    has none in the currency. Another worker may create it first, in which case the
+    new balance is updated instead
+    """
+    balance = Balance.objects.filter(user_id=user_id, currency_id=currency_id)
+    if balance.update(amount=F('amount') + delta):
+        return
+    try:
+        with transaction.atomic():
+            Balance.objects.create(user_id=user_id, currency_id=currency_id, amount=delta)
+    except IntegrityError:
+        balance.update(amount=F('amount') + delta)
+
+
+def _update_resting(order_ids, **values):
+    """
+    update orders the book believed were resting and make sure they still were
+    """
+    updated = Order.objects.resting().filter(
+        id__in=order_ids
+    ).update(
+        **values
+    )
+    if updated != len(order_ids):
+        raise SettlementConflict(
+            'orders {} are no longer resting'.format(', '.join(str(i) for i in order_ids))
+        )
+
+
+def settle(pair, initiating_order, fills):
+    """
+    Write the fills from one match pass in a single transaction.
+    Trades are bulk inserted where the database returns their ids and rolled into the
+    pair's candles, the orders involved take at most three updates and each user's
+    balance in each currency is moved once by its net change with an F() expression
+    so concurrent workers can't lose each other's updates.
+    Returns the trades and a list of (user_id, currency_id, amount) for the
+    balances that changed
+    """
+    deltas = balance_deltas(pair, initiating_order, fills)
+    with transaction.atomic():
+        trades = [
+            Trade(
+                initiating_order_id=initiating_order.id,
+                existing_order_id=fill.existing_id,
+                amount=fill.amount,
+                partial=fill.partial,
+                pair_id=pair.id,
+                price=fill.price,
+                taker_side=initiating_order.order_type,
+                initiating_user_id=initiating_order.user_id,
+                existing_user_id=fill.existing_user_id,
+            )
+            for fill in fills
+        ]
+        if connection.features.can_return_ids_from_bulk_insert:
+            Trade.objects.bulk_create(trades)
+        else:
+            # the ids are sent to the websockets and kept with the recent trades
+            for trade in trades:
+                trade.save()
+        record_trades(
+            pair.id,
+            [(trade.time, fill.price, fill.amount) for fill, trade in zip(fills, trades)]
+        )
+
+        # every resting order but the last was used up. the last may have some left
+        complete_ids = [fill.existing_id for fill in fills if fill.existing_remaining <= 0]
+        if complete_ids:
+            _update_resting(complete_ids, amount=0, state='complete')
+        if fills[-1].existing_remaining > 0:
+            _update_resting(
+                [fills[-1].existing_id],
+                amount=fills[-1].existing_remaining,
+                state='partial'
+            )
+        remaining = fills[-1].initiating_remaining
+        _update_resting(
+            [initiating_order.id],
+            amount=remaining,
+            state='partial' if remaining > 0 else 'complete'
+        )
+
+        for (user_id, currency_id), delta in deltas.items():
+            if not delta:
+                continue
+            move_balance(user_id, currency_id, delta)
+
+        balances = [
+            balance
+            for balance in Balance.objects.filter(
+                user_id__in={user_id for user_id, _ in deltas},
+                currency_id__in={currency_id for _, currency_id in deltas},
+            ).values_list(
+                'user_id', 'currency_id', 'amount'
+            )
+            if (balance[0], balance[1]) in deltas
+        ]
+    log.info(
+        'settled {} fills for order {} with {} balance updates'.format(
+            len(fills),
+            initiating_order.id,
+            len(deltas)
+        )
+    )
+    return trades, balances
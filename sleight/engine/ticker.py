@@ -0,0 +1,184 @@
+import datetime
+import json
+import time
+from collections import deque
+from decimal import Decimal
+
+from channels import Group
+from django.utils import timezone
+
+from sleight.models import Trade
+from sleight.utils import bump_book_version, format_decimal, get_pair_group, get_pair_name, \
+    get_redis
+
+# trades are summed into buckets this many seconds wide
+BUCKET_SECONDS = 60
+WINDOW_SECONDS = 86400
+
+
+def _summary_key(pair_id):
+    return 'sleight:ticker:{}'.format(pair_id)
+
+
+def _buckets_key(pair_id):
+    return 'sleight:ticker:{}:buckets'.format(pair_id)
+
+
+class Ticker(object):
+    """
+    Rolling 24 hour trade statistics for a pair, updated as trades settle.
+
+    Trades are summed into [start, high, low, base_volume, relative_volume] buckets
+    one minute wide, so the window never holds more than 1440 of them however
+    many trades there were. The volumes are running totals that buckets are taken
+    off as they leave the window.
+    """
+
+    def __init__(self, pair_id):
+        self.pair_id = pair_id
+        self.last_price = None
+        self.buckets = deque()
+        self.base_volume = Decimal(0)
+        self.relative_volume = Decimal(0)
+
+    def add_trade(self, timestamp, price, amount):
+        start = int(timestamp) - int(timestamp) % BUCKET_SECONDS
+        self.last_price = price
+        self.base_volume += amount * price
+        self.relative_volume += amount
+        # trades settle in time order, anything earlier joins the latest bucket
+        if self.buckets and self.buckets[-1][0] >= start:
+            bucket = self.buckets[-1]
+            bucket[1] = max(bucket[1], price)
+            bucket[2] = min(bucket[2], price)
+            bucket[3] += amount * price
+            bucket[4] += amount
+        else:
+            self.buckets.append([start, price, price, amount * price, amount])
+
+    def expire(self, now):
+        """
+        drop the buckets that have left the window
+        """
+        while self.buckets and self.buckets[0][0] <= now - WINDOW_SECONDS:
+            bucket = self.buckets.popleft()
+            self.base_volume -= bucket[3]
+            self.relative_volume -= bucket[4]
+
+    def expires(self):
+        """
+        when the oldest bucket leaves the window and the summary goes stale
+        """
+        if not self.buckets:
+            return None
+        return self.buckets[0][0] + WINDOW_SECONDS
+
+
+def load_ticker(pair_id):
+    """
+    build a pair's ticker from the trades of the last 24 hours
+    """
+    ticker = Ticker(pair_id)
+    since = timezone.now() - datetime.timedelta(seconds=WINDOW_SECONDS)
+    trades = Trade.objects.filter(
+        pair_id=pair_id,
+        time__gt=since
+    ).order_by(
+        'time',
+        'id'
+    ).values_list(
+        'time',
+        'price',
+        'amount'
+    )
+    for trade_time, price, amount in trades:
+        ticker.add_trade(trade_time.timestamp(), price, amount)
+    if ticker.last_price is None:
+        ticker.last_price = Trade.objects.filter(
+            pair_id=pair_id
+        ).order_by(
+            '-time',
+            '-id'
+        ).values_list(
+            'price',
+            flat=True
+        ).first()
+    return ticker
+
+
+def publish_ticker(book, traded=False):
+    """
+    Write the ticker for a book to redis for the web workers to serve, bumping the
+    book version with it so cached snapshots of the book are refreshed, and send it
+    to sockets following the pair's ticker.
+    The buckets only change when there has been a trade so they are only written then
+    """
+    ticker = book.ticker
+    ticker.expire(time.time())
+    summary = {
+        'last_trade_price': format_decimal(ticker.last_price),
+        'lowest_ask_price': format_decimal(book.best_price('ask')),
+        'highest_bid_price': format_decimal(book.best_price('bid')),
+        'bid_volume': format_decimal(book.volume['bid']),
+        'ask_volume': format_decimal(book.volume['ask']),
+        'base_volume': format_decimal(ticker.base_volume),
+        'relative_volume': format_decimal(ticker.relative_volume),
+        '24_hour_high': format_decimal(max((b[1] for b in ticker.buckets), default=Decimal(0))),
+        '24_hour_low': format_decimal(min((b[2] for b in ticker.buckets), default=Decimal(0))),
+        'expires': ticker.expires(),
+    }
+    pipe = get_redis().pipeline()
+    pipe.set(_summary_key(book.pair_id), json.dumps(summary))
+    if traded:
+        pipe.set(
+            _buckets_key(book.pair_id),
+            json.dumps([[format_decimal(value) for value in bucket] for bucket in ticker.buckets])
+        )
+    bump_book_version(book.pair, pipe)
+    pipe.execute()
+    del summary['expires']
+    summary.update({
+        'message_type': 'ticker',
+        'channel': 'ticker:{}'.format(get_pair_name(book.pair)),
+    })
+    Group(get_pair_group('ticker', book.pair)).send({'text': json.dumps(summary)})
+
+
+def read_ticker(pair_id):
+    """
+    The published ticker for a pair.
+    A quiet pair's summary goes stale as its trades age out of the window, in which
+    case the 24 hour figures are worked out again from the buckets
+    """
+    redis = get_redis()
+    summary = redis.get(_summary_key(pair_id))
+    if summary is None:
+        # no matcher has loaded the pair yet
+        zero = format_decimal(Decimal(0))
+        return {
+            'last_trade_price': None,
+            'lowest_ask_price': None,
+            'highest_bid_price': None,
+            'bid_volume': zero,
+            'ask_volume': zero,
+            'base_volume': zero,
+            'relative_volume': zero,
+            '24_hour_high': zero,
+            '24_hour_low': zero,
+        }
+    summary = json.loads(summary.decode('utf-8'))
+    expires = summary.pop('expires')
+    now = time.time()
+    if expires is not None and expires <= now:
+        buckets = [
+            [bucket[0]] + [Decimal(value) for value in bucket[1:]]
+            for bucket in json.loads(redis.get(_buckets_key(pair_id)).decode('utf-8'))
+            if bucket[0] > now - WINDOW_SECONDS
+        ]
+        summary.update({
+            'base_volume': format_decimal(sum((b[3] for b in buckets), Decimal(0))),
+            'relative_volume': format_decimal(sum((b[4] for b in buckets), Decimal(0))),
+            '24_hour_high': format_decimal(max((b[1] for b in buckets), default=Decimal(0))),
+            '24_hour_low': format_decimal(min((b[2] for b in buckets), default=Decimal(0))),
+        })
+    return summary
@@ -1,6 +1,16 @@
+import json
+
 from django import forms
+from django.conf import settings
+
+from .engine.candles import RESOLUTIONS
 from .utils import get_all_pairs
 
+# the most orders or trades returned at once
+MAX_PAGE = 1000
+# the most orders placed at once
+MAX_BATCH = 100
+
 
 class BaseForm(forms.Form):
     nonce = forms.IntegerField(
@@ -22,7 +32,10 @@ class GetBalanceForm(BaseForm):
     pass
 
 
-class PlaceOrderForm(BaseForm):
+class OrderForm(forms.Form):
+    """
+    the details of an order to place
+    """
     order_type = forms.ChoiceField(
         widget=forms.Select(
             attrs={'class': 'form-control'}
@@ -57,13 +70,132 @@ class PlaceOrderForm(BaseForm):
         decimal_places=10,
     )
 
+    def __init__(self, *args, **kwargs):
+        super(OrderForm, self).__init__(*args, **kwargs)
+        self.fields['pair'].choices = get_all_pairs()
+
+
+class PlaceOrderForm(BaseForm, OrderForm):
     def __init__(self, *args, **kwargs):
         self.request = kwargs.pop('request', None)
         super(PlaceOrderForm, self).__init__(*args, **kwargs)
-        self.fields['pair'].choices = get_all_pairs()
 
 
-class GetOrdersForm(BaseForm):
+class PlaceOrdersForm(BaseForm):
+    """
+    orders is a JSON list of up to 100 orders, each with the fields of PlaceOrderForm
+    """
+    orders = forms.CharField()
+
+    def clean_orders(self):
+        try:
+            orders = json.loads(self.cleaned_data['orders'])
+        except ValueError:
+            raise forms.ValidationError('orders must be a JSON list')
+        if not isinstance(orders, list) or not orders:
+            raise forms.ValidationError('orders must be a JSON list')
+        if len(orders) > MAX_BATCH:
+            raise forms.ValidationError(
+                'no more than {} orders can be placed at once'.format(MAX_BATCH)
+            )
+        cleaned = []
+        errors = []
+        for index, order in enumerate(orders):
+            form = OrderForm(order if isinstance(order, dict) else {})
+            if not form.is_valid():
+                errors.extend(
+                    'order {}: {}: {}'.format(index, field, ' '.join(field_errors))
+                    for field, field_errors in form.errors.items()
+                )
+                continue
+            # the sizes that PlaceOrder turns away
+            for field in ('amount', 'price'):
+                if form.cleaned_data[field] <= 0:
+                    errors.append(
+                        'order {}: {} must be a non zero positive number'.format(index, field)
+                    )
+            cleaned.append(form.cleaned_data)
+        if errors:
+            raise forms.ValidationError(errors)
+        return cleaned
+
+
+class HistoryForm(BaseForm):
+    """
+    a user's history, oldest first, after since_id.
+    pair and the start and end unix timestamps narrow it down
+    """
+    since_id = forms.IntegerField(
+        required=False,
+        min_value=0,
+    )
+    pair = forms.ChoiceField(
+        required=False,
+        choices=[],
+        error_messages={
+            'invalid_choice': '%(value)s is not a valid currency pair. '
+        }
+    )
+    start = forms.IntegerField(
+        required=False,
+        min_value=0,
+    )
+    end = forms.IntegerField(
+        required=False,
+        min_value=0,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(HistoryForm, self).__init__(*args, **kwargs)
+        self.fields['pair'].choices = [('', '')] + get_all_pairs()
+
+
+class PageForm(HistoryForm):
+    """
+    a page of a user's history of up to limit rows
+    """
+    limit = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=MAX_PAGE,
+    )
+
+
+class ExportForm(HistoryForm):
+    format = forms.ChoiceField(
+        required=False,
+        choices=[('ndjson', 'NDJSON'), ('csv', 'CSV')],
+        error_messages={
+            'invalid_choice': '%(value)s is not a valid format. Choose from ndjson or csv'
+        }
+    )
+
+
+class OrderStateForm(forms.Form):
+    state = forms.ChoiceField(
+        required=False,
+        choices=[
+            ('open', 'Open'),
+            ('partial', 'Partial'),
+            ('complete', 'Complete'),
+            ('cancelled', 'Cancelled')
+        ],
+        error_messages={
+            'invalid_choice': '%(value)s is not a valid state. '
+                              'Choose from open, partial, complete or cancelled'
+        }
+    )
+
+
+class GetOrdersForm(PageForm, OrderStateForm):
+    pass
+
+
+class ExportOrdersForm(ExportForm, OrderStateForm):
+    pass
+
+
+class ExportTradesForm(ExportForm):
     pass
 
 
@@ -71,5 +203,110 @@ class CancelOrderForm(BaseForm):
     order_id = forms.IntegerField()
 
 
-class GetTradesForm(BaseForm):
+class OrderIdsForm(BaseForm):
+    """
+    order_id can be given more than once or as a comma separated list
+    """
+    order_id = forms.CharField()
+
+    def clean_order_id(self):
+        values = (
+            self.data.getlist('order_id')
+            if hasattr(self.data, 'getlist') else
+            [self.cleaned_data['order_id']]
+        )
+        try:
+            order_ids = [
+                int(order_id)
+                for value in values
+                for order_id in '{}'.format(value).split(',')
+                if order_id.strip()
+            ]
+        except ValueError:
+            raise forms.ValidationError('order_id must be a list of whole numbers')
+        if not order_ids:
+            raise forms.ValidationError('This field is required.')
+        if len(order_ids) > MAX_PAGE:
+            raise forms.ValidationError(
+                'no more than {} orders can be given at once'.format(MAX_PAGE)
+            )
+        return order_ids
+
+
+class GetOrderForm(OrderIdsForm):
+    pass
+
+
+class CancelOrdersForm(OrderIdsForm):
+    pass
+
+
+class CancelAllForm(BaseForm):
+    pair = forms.ChoiceField(
+        choices=[],
+        error_messages={
+            'invalid_choice': '%(value)s is not a valid currency pair. '
+        }
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(CancelAllForm, self).__init__(*args, **kwargs)
+        self.fields['pair'].choices = get_all_pairs()
+
+
+class GetTradesForm(PageForm):
+    pass
+
+
+class GetCandlesForm(forms.Form):
+    resolution = forms.ChoiceField(
+        choices=[(resolution, resolution) for resolution in RESOLUTIONS],
+        required=False,
+        error_messages={
+            'invalid_choice': '%(value)s is not a valid resolution. '
+                              'Choose from {}'.format(', '.join(RESOLUTIONS))
+        }
+    )
+    start = forms.IntegerField(
+        required=False,
+        min_value=0,
+    )
+    end = forms.IntegerField(
+        required=False,
+        min_value=0,
+    )
+
+
+class GetRecentTradesForm(forms.Form):
+    limit = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=settings.RECENT_TRADES,
+    )
+
+
+class GetOrderBookForm(forms.Form):
+    depth = forms.IntegerField(
+        required=False,
+        min_value=1,
+    )
+    aggregate = forms.BooleanField(
+        required=False,
+    )
+
+
+class DepthChartForm(forms.Form):
+    min_price = forms.DecimalField(
+        required=False,
+        max_digits=20,
+        decimal_places=10,
+    )
+    max_price = forms.DecimalField(
+        required=False,
+        max_digits=20,
+        decimal_places=10,
+    )
+
+
+class StreamAuthForm(BaseForm):
     pass
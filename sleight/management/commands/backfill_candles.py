@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from sleight.engine.candles import CandleBuilder
+from sleight.models import Candle, CurrencyPair, Trade
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the candles of every pair, or of the pair given, from the trade history. '
+        'Existing candles for the pair are replaced so run it while the matchers are '
+        'stopped or trades settled during the rebuild may be counted twice'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_currency', nargs='?')
+        parser.add_argument('relative_currency', nargs='?')
+
+    def handle(self, *args, **options):
+        pairs = CurrencyPair.objects.all()
+        if options['base_currency']:
+            pairs = pairs.filter(
+                base_currency__code__iexact=options['base_currency'],
+                relative_currency__code__iexact=options['relative_currency']
+            )
+            if not pairs:
+                raise CommandError('pair not found')
+        for pair in pairs:
+            self.backfill(pair)
+
+    def backfill(self, pair):
+        trades = Trade.objects.filter(
+            pair=pair
+        ).order_by(
+            'time',
+            'id'
+        ).values_list(
+            'time',
+            'price',
+            'amount'
+        )
+        builder = CandleBuilder(pair.id)
+        batch = []
+        created = 0
+        with transaction.atomic():
+            Candle.objects.filter(pair=pair).delete()
+            for trade_time, price, amount in trades.iterator():
+                # candles that have ended are finished with
+                batch.extend(builder.pop_before(trade_time))
+                builder.add_trade(trade_time, price, amount)
+                if len(batch) >= BATCH_SIZE:
+                    Candle.objects.bulk_create(batch)
+                    created += len(batch)
+                    batch = []
+            batch.extend(builder.candles.values())
+            Candle.objects.bulk_create(batch)
+            created += len(batch)
+        self.stdout.write('built {} candles for {}'.format(created, pair))
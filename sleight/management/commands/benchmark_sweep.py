@@ -0,0 +1,169 @@
+import timeit
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from sleight.engine.book import BookOrder, OrderBook
+from sleight.engine.matching import match
+from sleight.engine.settlement import settle
+from sleight.models import Balance, Currency, CurrencyPair, Order
+
+
+def build_book(levels, orders_per_level, user_id=1):
+    """
+    an ask side with the given number of price levels starting at 1
+    """
+    book = OrderBook(pair_id=0)
+    order_id = 0
+    for level in range(levels):
+        for _ in range(orders_per_level):
+            order_id += 1
+            book.add(
+                BookOrder(
+                    id=order_id,
+                    user_id=user_id,
+                    order_type='ask',
+                    price=Decimal(1) + Decimal(level) / 100,
+                    amount=Decimal(1),
+                )
+            )
+    return book, order_id
+
+
+def create_fixture(bid, swept):
+    """
+    write the pair, users, balances and the orders a sweep will fill to the database
+    so the sweep can be settled. returns the pair
+    """
+    base = Currency.objects.create(name='Benchmark Base', code='BENCHB')
+    relative = Currency.objects.create(name='Benchmark Relative', code='BENCHR')
+    pair = CurrencyPair.objects.create(base_currency=base, relative_currency=relative)
+    users = [
+        User.objects.create(id=user_id, username='benchmark-{}'.format(user_id))
+        for user_id in {order.user_id for order in [bid] + swept}
+    ]
+    Balance.objects.bulk_create(
+        Balance(user=user, currency=currency, amount=Decimal(10 ** 9))
+        for user in users
+        for currency in (base, relative)
+    )
+    Order.objects.bulk_create(
+        Order(
+            id=order.id,
+            user_id=order.user_id,
+            pair=pair,
+            order_type=order.order_type,
+            price=order.price,
+            amount=order.amount,
+            original_amount=order.amount,
+            state='open',
+        )
+        for order in [bid] + swept
+    )
+    return pair
+
+
+class Command(BaseCommand):
+    help = (
+        'Time sweeping a bid through increasing numbers of ask levels in one pass, '
+        'both matching it on the in memory book and settling the fills in a test '
+        'database that is created for the run and destroyed after it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--depths',
+            default='1,10,50,200,1000',
+            help='comma separated numbers of levels to sweep',
+        )
+        parser.add_argument(
+            '--orders-per-level',
+            type=int,
+            default=1,
+        )
+        parser.add_argument(
+            '--book-levels',
+            type=int,
+            default=5000,
+            help='levels resting on the book before each sweep',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=20,
+        )
+        parser.add_argument(
+            '--match-only',
+            action='store_true',
+            default=False,
+            help='only time matching, without a test database',
+        )
+
+    def handle(self, *args, **options):
+        if options['match_only']:
+            self.run(options, settling=False)
+            return
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options, settling=True)
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+
+    def run(self, options, settling):
+        orders_per_level = options['orders_per_level']
+        self.stdout.write(
+            '{:>8} {:>8} {:>12} {:>12} {:>14}'.format(
+                'levels', 'fills', 'match (ms)', 'settle (ms)', 'per level (us)'
+            )
+        )
+        for depth in [int(depth) for depth in options['depths'].split(',')]:
+            best_match = None
+            best_settle = None
+            for _ in range(options['repeat']):
+                book, last_id = build_book(
+                    max(depth, options['book_levels']),
+                    orders_per_level
+                )
+                bid = book.add(
+                    BookOrder(
+                        id=last_id + 1,
+                        user_id=2,
+                        order_type='bid',
+                        price=Decimal(1) + Decimal(depth - 1) / 100,
+                        amount=Decimal(depth * orders_per_level),
+                    )
+                )
+                # the orders the sweep fills, as they were before it
+                swept = [
+                    BookOrder(order.id, order.user_id, order.order_type, order.price, 1)
+                    for order in book.orders()
+                    if order.order_type == 'ask' and order.price <= bid.price
+                ]
+                placed = BookOrder(bid.id, bid.user_id, bid.order_type, bid.price, bid.amount)
+                start = timeit.default_timer()
+                fills = match(book, bid)
+                elapsed = timeit.default_timer() - start
+                best_match = elapsed if best_match is None else min(best_match, elapsed)
+                if not settling:
+                    continue
+                # each settlement is rolled back so the next starts from the same rows
+                with transaction.atomic():
+                    pair = create_fixture(placed, swept)
+                    start = timeit.default_timer()
+                    settle(pair, bid, fills)
+                    elapsed = timeit.default_timer() - start
+                    transaction.set_rollback(True)
+                best_settle = elapsed if best_settle is None else min(best_settle, elapsed)
+            total = best_match + (best_settle or 0)
+            self.stdout.write(
+                '{:>8} {:>8} {:>12.3f} {:>12} {:>14.2f}'.format(
+                    depth,
+                    len(fills),
+                    best_match * 1000,
+                    '{:.3f}'.format(best_settle * 1000) if settling else '-',
+                    total * 1000000 / depth,
+                )
+            )
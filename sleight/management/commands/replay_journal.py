@@ -0,0 +1,192 @@
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from sleight.engine.book import BookOrder
+from sleight.engine.journal import ACCEPTED, CANCELLED, TRADE, Journal, read_records, voided
+from sleight.engine.matching import Fill
+from sleight.engine.settlement import balance_deltas, move_balance
+from sleight.models import CurrencyPair, Order, Trade
+
+
+def _timestamp(seconds):
+    return datetime.datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the orders and trades of a pair from its matching engine journal. '
+        'Orders placed while the journal was running are recreated with their trades, '
+        'orders it imported from the database have their amount and state brought up '
+        'to date. With --balances each balance is also moved by the net effect of the '
+        'journal, so only use it on balances as they were when the journal started'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_currency')
+        parser.add_argument('relative_currency')
+        parser.add_argument(
+            '--journal',
+            help='journal file to replay. defaults to the pair\'s current journal',
+        )
+        parser.add_argument(
+            '--balances',
+            action='store_true',
+            default=False,
+            help='apply the balance changes recorded by the journal',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            pair = CurrencyPair.objects.get(
+                base_currency__code__iexact=options['base_currency'],
+                relative_currency__code__iexact=options['relative_currency']
+            )
+        except CurrencyPair.DoesNotExist:
+            raise CommandError('pair not found')
+        path = options['journal'] or Journal(pair.id).path
+
+        # voids refer back to earlier records so find them first
+        skip = voided(record for record, _ in read_records(path))
+
+        orders = {}
+        original_amounts = {}
+        placed = {}
+        cancelled = set()
+        trades = []
+        deltas = defaultdict(Decimal)
+        for record, _ in read_records(path):
+            if record[0] in skip:
+                continue
+            if record[1] == ACCEPTED:
+                order_id, user_id, order_type, price, amount, original_amount, is_placed = (
+                    record[3:10]
+                )
+                order = orders[order_id] = BookOrder(
+                    order_id,
+                    user_id,
+                    order_type,
+                    price,
+                    amount
+                )
+                original_amounts[order_id] = Decimal(original_amount)
+                if is_placed:
+                    placed[order_id] = _timestamp(record[2])
+                    # the order's funds were reserved when it was placed
+                    if order_type == 'ask':
+                        deltas[(user_id, pair.relative_currency_id)] -= order.amount
+                    else:
+                        deltas[(user_id, pair.base_currency_id)] -= order.amount * order.price
+            elif record[1] == TRADE:
+                initiating_order = orders[record[3]]
+                existing_order = orders[record[4]]
+                amount = Decimal(record[6])
+                initiating_order.amount -= amount
+                existing_order.amount -= amount
+                fill = Fill(
+                    initiating_id=initiating_order.id,
+                    existing_id=existing_order.id,
+                    existing_user_id=existing_order.user_id,
+                    amount=amount,
+                    price=Decimal(record[7]),
+                    partial=existing_order.amount > 0,
+                    initiating_remaining=initiating_order.amount,
+                    existing_remaining=existing_order.amount,
+                )
+                trades.append((fill, _timestamp(record[2])))
+                for key, delta in balance_deltas(pair, initiating_order, [fill]).items():
+                    deltas[key] += delta
+            elif record[1] == CANCELLED:
+                order = orders[record[3]]
+                # cancelling returns whatever was left of the order
+                if order.order_type == 'ask':
+                    deltas[(order.user_id, pair.relative_currency_id)] += order.amount
+                else:
+                    deltas[(order.user_id, pair.base_currency_id)] += order.amount * order.price
+                cancelled.add(order.id)
+
+        def state(order):
+            if order.id in cancelled:
+                return 'cancelled'
+            if order.amount <= 0:
+                return 'complete'
+            if order.amount == original_amounts[order.id]:
+                return 'open'
+            return 'partial'
+
+        # times come from the journal rather than being set as the rows are saved
+        time_fields = [model._meta.get_field('time') for model in (Order, Trade)]
+        for field in time_fields:
+            field.auto_now_add = False
+        try:
+            with transaction.atomic():
+                Order.objects.filter(id__in=placed).delete()
+                Order.objects.bulk_create(
+                    [
+                        Order(
+                            id=order.id,
+                            user_id=order.user_id,
+                            pair=pair,
+                            original_amount=original_amounts[order.id],
+                            amount=order.amount,
+                            price=order.price,
+                            order_type=order.order_type,
+                            state=state(order),
+                            time=placed[order.id],
+                        )
+                        for order in orders.values()
+                        if order.id in placed
+                    ]
+                )
+                for order in orders.values():
+                    if order.id not in placed:
+                        Order.objects.filter(
+                            id=order.id
+                        ).update(
+                            amount=order.amount,
+                            state=state(order)
+                        )
+                # an order only takes liquidity in the pass it was matched in, so every
+                # trade it initiated is in the journal. drop the ones between orders
+                # that were imported rather than placed before writing them again
+                Trade.objects.filter(
+                    pair=pair,
+                    initiating_order_id__in={fill.initiating_id for fill, _ in trades}
+                ).delete()
+                Trade.objects.bulk_create(
+                    [
+                        Trade(
+                            initiating_order_id=fill.initiating_id,
+                            existing_order_id=fill.existing_id,
+                            amount=fill.amount,
+                            partial=fill.partial,
+                            pair_id=pair.id,
+                            price=fill.price,
+                            taker_side=orders[fill.initiating_id].order_type,
+                            initiating_user_id=orders[fill.initiating_id].user_id,
+                            existing_user_id=fill.existing_user_id,
+                            time=time,
+                        )
+                        for fill, time in trades
+                    ]
+                )
+                if options['balances']:
+                    for (user_id, currency_id), delta in deltas.items():
+                        move_balance(user_id, currency_id, delta)
+        finally:
+            for field in time_fields:
+                field.auto_now_add = True
+
+        self.stdout.write(
+            'replayed {} orders ({} placed) and {} trades for {}{}'.format(
+                len(orders),
+                len(placed),
+                len(trades),
+                pair,
+                ' with {} balance changes'.format(len(deltas)) if options['balances'] else ''
+            )
+        )
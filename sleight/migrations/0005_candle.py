@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 07:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleight', '0004_auto_20160901_2043'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Candle',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1 Minute'), ('5m', '5 Minutes'), ('1h', '1 Hour'), ('1d', '1 Day')], max_length=2)),
+                ('start', models.DateTimeField()),
+                ('open', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('high', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('low', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('close', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('volume', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('base_volume', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('trades', models.IntegerField()),
+                ('pair', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candle', to='sleight.CurrencyPair')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='candle',
+            unique_together=set([('pair', 'resolution', 'start')]),
+        ),
+    ]
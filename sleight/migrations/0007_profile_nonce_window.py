@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 08:08
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleight', '0006_order_book_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='nonce_bitmap',
+            field=models.BigIntegerField(default=9223372036854775807),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='nonce_window',
+            field=models.PositiveSmallIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(63)]),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 08:16
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+RESTING_INDEX = 'sleight_order_resting_idx'
+# the databases that can index part of a table
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+def create_resting_index(apps, schema_editor):
+    """
+    index the book on the orders still resting. elsewhere the whole table is
+    indexed, replacing the index made in 0006 either way
+    """
+    sql = 'CREATE INDEX {} ON sleight_order (pair_id, order_type, price, id)'.format(
+        RESTING_INDEX
+    )
+    if schema_editor.connection.vendor in PARTIAL_INDEX_VENDORS:
+        sql += " WHERE state IN ('open', 'partial')"
+    schema_editor.execute(sql)
+
+
+def drop_resting_index(apps, schema_editor):
+    schema_editor.execute(
+        schema_editor.sql_delete_index % {
+            'table': schema_editor.quote_name('sleight_order'),
+            'name': schema_editor.quote_name(RESTING_INDEX),
+        }
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleight', '0008_order_user_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_resting_index, drop_resting_index),
+        # every order state update had to keep this up to date as well
+        migrations.RemoveIndex(
+            model_name='order',
+            name='sleight_ord_pair_id_036c66_idx',
+        ),
+    ]
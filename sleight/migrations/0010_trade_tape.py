@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 08:17
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sleight', '0009_order_resting_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trade',
+            name='existing_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='existing_trades', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='initiating_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='initiated_trades', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='pair',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trade', to='sleight.CurrencyPair'),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='price',
+            field=models.DecimalField(decimal_places=10, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='trade',
+            name='taker_side',
+            field=models.CharField(choices=[('bid', 'Bid'), ('ask', 'Ask')], max_length=3, null=True),
+        ),
+    ]
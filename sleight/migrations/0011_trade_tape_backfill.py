@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 08:17
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def backfill_trades(apps, schema_editor):
+    """
+    copy the pair, price, taker side and users onto the existing trades from their
+    orders. each batch is its own transaction so the table isn't locked throughout,
+    and only trades without a pair are filled so a failed run can be picked up again
+    """
+    Order = apps.get_model('sleight', 'Order')
+    Trade = apps.get_model('sleight', 'Trade')
+
+    def from_order(side, field):
+        return Subquery(
+            Order.objects.filter(pk=OuterRef(side)).values(field)[:1]
+        )
+
+    last_id = 0
+    while True:
+        trade_ids = list(
+            Trade.objects.filter(
+                id__gt=last_id,
+                pair__isnull=True
+            ).order_by(
+                'id'
+            ).values_list(
+                'id',
+                flat=True
+            )[:BATCH_SIZE]
+        )
+        if not trade_ids:
+            break
+        with transaction.atomic():
+            Trade.objects.filter(
+                id__in=trade_ids
+            ).update(
+                pair_id=from_order('existing_order_id', 'pair_id'),
+                price=from_order('existing_order_id', 'price'),
+                taker_side=from_order('initiating_order_id', 'order_type'),
+                initiating_user_id=from_order('initiating_order_id', 'user_id'),
+                existing_user_id=from_order('existing_order_id', 'user_id'),
+            )
+        last_id = trade_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # the backfill commits as it goes
+    atomic = False
+
+    dependencies = [
+        ('sleight', '0010_trade_tape'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_trades, migrations.RunPython.noop),
+    ]
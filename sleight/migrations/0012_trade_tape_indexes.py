@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 08:17
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sleight', '0011_trade_tape_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trade',
+            name='existing_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='existing_trades', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='initiating_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='initiated_trades', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='pair',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trade', to='sleight.CurrencyPair'),
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='price',
+            field=models.DecimalField(decimal_places=10, max_digits=20),
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='taker_side',
+            field=models.CharField(choices=[('bid', 'Bid'), ('ask', 'Ask')], max_length=3),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['pair', 'time', 'id', 'price', 'amount'], name='sleight_tra_pair_id_9b4e0e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['initiating_user', 'id'], name='sleight_tra_initiat_3bbef3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['existing_user', 'id'], name='sleight_tra_existin_8f212f_idx'),
+        ),
+    ]
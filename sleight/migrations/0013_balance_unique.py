@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11 on 2026-10-18 09:02
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_balances(apps, schema_editor):
+    """
+    fold any balances a user has more than once in a currency into the first of them
+    """
+    Balance = apps.get_model('sleight', 'Balance')
+    duplicates = Balance.objects.values(
+        'user_id',
+        'currency_id'
+    ).annotate(
+        rows=Count('id'),
+        total=Sum('amount')
+    ).filter(
+        rows__gt=1
+    )
+    for duplicate in duplicates:
+        balances = Balance.objects.filter(
+            user_id=duplicate['user_id'],
+            currency_id=duplicate['currency_id']
+        ).order_by(
+            'id'
+        )
+        first_id = balances.values_list('id', flat=True).first()
+        balances.filter(id=first_id).update(amount=duplicate['total'])
+        balances.exclude(id=first_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('sleight', '0012_trade_tape_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_balances, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='balance',
+            unique_together=set([('user', 'currency')]),
+        ),
+    ]
@@ -3,8 +3,14 @@ from __future__ import unicode_literals
 import uuid
 
 from django.contrib.auth.models import User
+from django.core.validators import MaxValueValidator
 from django.db import models
 
+# the nonce bitmap records the 63 nonces below the highest one used.
+# every bit is set to start with, treating them all as used
+NONCE_BITS = 63
+NONCE_BITMAP_FULL = (1 << NONCE_BITS) - 1
+
 
 class Profile(models.Model):
     user = models.OneToOneField(
@@ -18,6 +24,16 @@ class Profile(models.Model):
         default=uuid.uuid4,
     )
     nonce = models.BigIntegerField()
+    # with a window, nonces less than nonce_window below the highest one used
+    # are accepted once each, in any order. bit n of the bitmap is set once
+    # nonce - n has been used
+    nonce_window = models.PositiveSmallIntegerField(
+        default=0,
+        validators=[MaxValueValidator(NONCE_BITS)],
+    )
+    nonce_bitmap = models.BigIntegerField(
+        default=NONCE_BITMAP_FULL,
+    )
 
     def __str__(self):
         return self.user.email
@@ -58,6 +74,20 @@ class CurrencyPair(models.Model):
         unique_together = ('base_currency', 'relative_currency')
 
 
+# orders in these states are on the book
+RESTING_STATES = ('open', 'partial')
+
+
+class OrderQuerySet(models.QuerySet):
+    def resting(self):
+        """
+        the orders still on the book. where the database supports it this is read
+        from a partial index of only those orders, so it stays small however many
+        orders have finished
+        """
+        return self.filter(state__in=RESTING_STATES)
+
+
 class Order(models.Model):
     user = models.ForeignKey(
         User,
@@ -97,9 +127,20 @@ class Order(models.Model):
         auto_now_add=True,
     )
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return '{}'.format(self.id)
 
+    class Meta(object):
+        # the top of each side of a pair's book is read from the index
+        # sleight_order_resting_idx on pair, order_type, price and id, made in
+        # migration 0009. it only covers resting orders where the database allows
+        indexes = [
+            # users page through their orders, and the trades that filled them, by id
+            models.Index(fields=['user', 'id']),
+        ]
+
 
 class Trade(models.Model):
     initiating_order = models.ForeignKey(
@@ -120,10 +161,46 @@ class Trade(models.Model):
         decimal_places=10,
     )
     partial = models.BooleanField()
+    # copied from the orders as the trade is made so the tape can be read without them
+    pair = models.ForeignKey(
+        CurrencyPair,
+        related_name='trade',
+        on_delete=models.CASCADE
+    )
+    # the price of the existing order
+    price = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    # the order type of the initiating order
+    taker_side = models.CharField(
+        choices=[('bid', 'Bid'), ('ask', 'Ask')],
+        max_length=3,
+    )
+    initiating_user = models.ForeignKey(
+        User,
+        related_name='initiated_trades',
+        on_delete=models.CASCADE
+    )
+    existing_user = models.ForeignKey(
+        User,
+        related_name='existing_trades',
+        on_delete=models.CASCADE
+    )
 
     def __str__(self):
         return '{}'.format(self.time)
 
+    class Meta(object):
+        indexes = [
+            # the ticker and candles read a pair's trades over a time range from this
+            # alone, and the latest trades from its end
+            models.Index(fields=['pair', 'time', 'id', 'price', 'amount']),
+            # users page through the trades on each side of their orders by id
+            models.Index(fields=['initiating_user', 'id']),
+            models.Index(fields=['existing_user', 'id']),
+        ]
+
 
 class Balance(models.Model):
     user = models.ForeignKey(
@@ -142,3 +219,59 @@ class Balance(models.Model):
 
     def __str__(self):
         return '{} {}'.format(self.currency, self.amount)
+
+    class Meta(object):
+        unique_together = ('user', 'currency')
+
+
+class Candle(models.Model):
+    """
+    open, high, low and close prices with the volume traded on a pair over one
+    bucket of the given resolution, starting at start
+    """
+    pair = models.ForeignKey(
+        CurrencyPair,
+        related_name='candle',
+        on_delete=models.CASCADE
+    )
+    resolution = models.CharField(
+        choices=[
+            ('1m', '1 Minute'),
+            ('5m', '5 Minutes'),
+            ('1h', '1 Hour'),
+            ('1d', '1 Day')
+        ],
+        max_length=2
+    )
+    start = models.DateTimeField()
+    open = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    high = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    low = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    close = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    volume = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    base_volume = models.DecimalField(
+        max_digits=20,
+        decimal_places=10,
+    )
+    trades = models.IntegerField()
+
+    def __str__(self):
+        return '{} {} {}'.format(self.pair, self.resolution, self.start)
+
+    class Meta(object):
+        unique_together = ('pair', 'resolution', 'start')
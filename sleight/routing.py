@@ -1,18 +1,50 @@
+import logging
+
 from channels import route
-from sleight.consumers.check_trades import check_trades
-from sleight.consumers.websockets import ws_connect, ws_disconnect
+from django.db import DatabaseError
+from redis import RedisError
+
+from sleight.consumers.check_trades import check_trades, check_trades_batch, remove_order, \
+    remove_orders, send_book_snapshot
+from sleight.consumers.stream import stream_connect, stream_disconnect, stream_receive
+from sleight.consumers.websockets import ws_connect, ws_disconnect, ws_receive
+from sleight.utils import get_matching_channels
+
+log = logging.getLogger(__name__)
+
+
+def matching_routes():
+    """
+    Each currency pair has its own check_trades channel so pairs are matched in
+    parallel. The pairs are read as routing is imported, so workers have to be
+    restarted to start listening for a new pair, and a process started while the
+    database or redis is down routes none of them until it is restarted
+    """
+    try:
+        channels = get_matching_channels()
+    except (DatabaseError, RedisError):
+        log.exception('unable to route the matching channels. restart once the pairs load')
+        return []
+    routes = []
+    for channel in channels:
+        routes.append(route(channel, remove_order, action=r'^cancel$'))
+        routes.append(route(channel, remove_orders, action=r'^cancel_batch$'))
+        routes.append(route(channel, check_trades_batch, action=r'^place_batch$'))
+        routes.append(route(channel, send_book_snapshot, action=r'^snapshot$'))
+        routes.append(route(channel, check_trades))
+    return routes
+
 
 channel_routing = [
+    # a single socket can follow any number of pairs on /stream
+    route('websocket.connect', stream_connect, path=r'^/stream/?$'),
+    route('websocket.receive', stream_receive, path=r'^/stream/?$'),
+    route('websocket.disconnect', stream_disconnect, path=r'^/stream/?$'),
     # set up web sockets for updating the front end
     route('websocket.connect', ws_connect),
+    route('websocket.receive', ws_receive),
     route('websocket.disconnect', ws_disconnect),
-
-    # set a channel per pair to check for trades as orders are added
-    route('check_trades', check_trades),
-    route('btc-cnnbt', check_trades),
-    route('btc-eunbt', check_trades),
-    route('usd-usnbt', check_trades),
-    route('cny-cnnbt', check_trades),
-    route('cnnbt-cny', check_trades),
-    route('eur-eunbt', check_trades),
 ]
+
+# set a channel per pair to check for trades as orders are added
+channel_routing += matching_routes()
@@ -41,7 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'sleight',
+    'sleight.apps.SleightConfig',
     'channels',
     'corsheaders',
     'graphos',
@@ -140,17 +140,50 @@ AWS_S3_REGION_NAME = env.get('AWS_S3_REGION_NAME')
 
 APPEND_SLASH = False
 
+REDIS_URL = env.get('REDIS_URL', 'redis://localhost:6379')
+# the tests flush this database so keep it apart from the one in use
+TEST_REDIS_URL = env.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "asgi_redis.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [env.get('REDIS_URL', 'redis://localhost:6379')],
+            "hosts": [REDIS_URL],
             "prefix": "sleight:",
         },
         "ROUTING": "sleight.routing.channel_routing",
     },
 }
 
+# Matching engine
+# a worker owns a pair's book for this long after the last order it matched
+PAIR_LEASE_SECONDS = 30
+# every change to a book is journalled here before it reaches the database
+JOURNAL_DIR = env.get('JOURNAL_DIR', os.path.join(BASE_DIR, 'journal'))
+# snapshot a book after this many journal records
+JOURNAL_SNAPSHOT_EVENTS = 1000
+JOURNAL_FSYNC = True
+# how many of each pair's latest trades are kept in redis for the exchange and api
+RECENT_TRADES = 150
+
+# Currency pairs
+# how often a process checks whether the pairs have changed
+PAIRS_CHECK_SECONDS = 1
+
+# Public API
+# cached responses are kept for this long after the version they were made at
+BOOK_CACHE_SECONDS = 60
+
+# Private API
+# api keys are looked up from the database at most this often
+API_KEY_CACHE_SECONDS = 300
+# how many times to try recording a nonce inside a key's window before giving up
+NONCE_ATTEMPTS = 5
+
+# Websockets
+# how long the user a session belongs to is remembered for connecting sockets
+WS_SESSION_CACHE_SECONDS = 300
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -6,6 +6,17 @@ $(function() {
 
     order_sock.onmessage = function (message) {
         var data = JSON.parse(message.data);
+        // the updates from one trade check arrive together as a batch
+        if (data.message_type == 'batch') {
+            $.each(data.messages, function (i, batched) {
+                handle_message(batched);
+            });
+        } else {
+            handle_message(data);
+        }
+    };
+
+    function handle_message(data) {
         // we receive both orders and trades.
         // check the message type to see which we have
         if (data.message_type == 'order') {
@@ -26,6 +37,9 @@ $(function() {
                     total_field.text((parseFloat(data.amount).toFixed(4) * parseFloat(data.price).toFixed(4)).toFixed(4));
                     total_field.fadeOut(100).fadeIn(100);
                 }
+            } else if (data.amount == 0 || data.state == 'complete' || data.state == 'cancelled') {
+                // the order was finished with before we heard about it
+                return;
             } else {
                 // order doesn't exist
                 var table_rows = $('#' + data.order_type + '_orders tbody tr');
@@ -94,5 +108,5 @@ $(function() {
             balance_span.text(parseFloat(data.balance).toFixed(4));
             balance_span.fadeOut(100).fadeIn(100).fadeOut(100).fadeIn(100);
         }
-    };
+    }
 });
@@ -0,0 +1,185 @@
+import hashlib
+import hmac
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.asgi import channel_layers
+from channels.message import Message
+from channels.test import ChannelTestCase
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.operations import AddIndex
+from django.db.models import F
+from django.test import TransactionTestCase, override_settings
+
+from sleight import utils
+from sleight.engine import book, lease
+from sleight.models import Balance, Currency, CurrencyPair, Order, Profile, Trade
+from sleight.utils import get_matching_channel
+from sleight.views.private_api import matching_message
+
+
+def forget_process_state():
+    """
+    drop what the process keeps between messages: books, pairs and the redis client
+    """
+    for pair_id in list(book._books):
+        book.discard_book(pair_id)
+    utils._redis = None
+    utils._pairs = None
+    lease._claim_script = None
+
+
+class EngineTestCase(ChannelTestCase):
+    """
+    A pair to trade on with the matching engine using a redis database of its own,
+    flushed around each test, a new journal directory and the in memory channel layer
+    """
+
+    def setUp(self):
+        journal_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, journal_dir)
+        override = override_settings(
+            REDIS_URL=settings.TEST_REDIS_URL,
+            JOURNAL_DIR=journal_dir,
+            JOURNAL_FSYNC=False,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(forget_process_state)
+        forget_process_state()
+        self.redis = utils.get_redis()
+        self.redis.flushdb()
+        self.addCleanup(self.redis.flushdb)
+
+        self.base = Currency.objects.create(name='Bitcoin', code='BTC')
+        self.relative = Currency.objects.create(name='NuBits', code='USNBT')
+        self.pair = CurrencyPair.objects.create(
+            base_currency=self.base,
+            relative_currency=self.relative
+        )
+        # saving the pair only bumps the version once the test transaction commits
+        utils._pairs = None
+        self.alice = self.create_user('alice')
+        self.bob = self.create_user('bob')
+
+    def create_user(self, username, base=1000, relative=1000):
+        user = User.objects.create(username=username, email='{}@example.com'.format(username))
+        Profile.objects.create(user=user, nonce=0)
+        Balance.objects.create(user=user, currency=self.base, amount=Decimal(base))
+        Balance.objects.create(user=user, currency=self.relative, amount=Decimal(relative))
+        return user
+
+    def balance(self, user, currency):
+        return Balance.objects.get(user=user, currency=currency).amount
+
+    def create_order(self, user, order_type, price, amount):
+        """
+        an open order as PlaceOrder leaves it, with its funds reserved
+        """
+        price = Decimal(price)
+        amount = Decimal(amount)
+        Balance.objects.filter(
+            user=user,
+            currency=self.relative if order_type == 'ask' else self.base
+        ).update(
+            amount=F('amount') - (amount if order_type == 'ask' else amount * price)
+        )
+        return Order.objects.create(
+            user=user,
+            pair=self.pair,
+            order_type=order_type,
+            price=price,
+            amount=amount,
+            original_amount=amount,
+            state='open',
+        )
+
+    def create_trade(self, initiating_order, existing_order, amount, price, time=None):
+        """
+        a trade between two orders, made at time if given
+        """
+        trade = Trade.objects.create(
+            initiating_order=initiating_order,
+            existing_order=existing_order,
+            amount=Decimal(amount),
+            partial=False,
+            pair=self.pair,
+            price=Decimal(price),
+            taker_side=initiating_order.order_type,
+            initiating_user=initiating_order.user,
+            existing_user=existing_order.user,
+        )
+        if time is not None:
+            # time is set as the trade is saved
+            Trade.objects.filter(id=trade.id).update(time=time)
+            trade.time = time
+        return trade
+
+    def api_post(self, path, user, **data):
+        """
+        post to the private api as the user, signing the next nonce with their secret
+        """
+        profile = Profile.objects.get(user=user)
+        nonce = profile.nonce + 1
+        return self.client.post(path, dict(
+            data,
+            api_key=profile.api_key,
+            nonce=nonce,
+            nonce_hash=hmac.new(
+                '{}'.format(profile.api_secret).encode('utf-8'),
+                '{}'.format(nonce).encode('utf-8'),
+                hashlib.sha256
+            ).hexdigest()
+        ))
+
+    def message(self, content):
+        return Message(
+            content,
+            get_matching_channel(self.pair),
+            channel_layers[DEFAULT_CHANNEL_LAYER]
+        )
+
+    def place_message(self, order):
+        return self.message(matching_message(order, self.pair, order.user))
+
+
+def _add_index_state_forwards(self, app_label, state):
+    # Django 1.11.0 appends to an indexes list that cloned model states share, so
+    # unapplying AddIndex on SQLite creates the same index twice. copy it instead
+    model_state = state.models[app_label, self.model_name_lower]
+    model_state.options[self.option_name] = (
+        list(model_state.options[self.option_name]) + [self.index]
+    )
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    Starts with the app's migrations rolled back to migrate_from, with the models as
+    they were then in self.apps, and applies them all again afterwards
+    """
+    migrate_from = None
+
+    def setUp(self):
+        self.addCleanup(self.migrate, None)
+        self.apps = self.migrate(self.migrate_from)
+
+    def migrate(self, name):
+        """
+        migrate the app to the named migration, or every app to its latest,
+        and return the models as they are at that point
+        """
+        with mock.patch.object(AddIndex, 'state_forwards', _add_index_state_forwards):
+            executor = MigrationExecutor(connection)
+            if name is None:
+                targets = executor.loader.graph.leaf_nodes()
+            else:
+                targets = [('sleight', name)]
+            executor.migrate(targets)
+            executor.loader.build_graph()
+            return executor.loader.project_state(targets).apps
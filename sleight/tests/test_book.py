@@ -0,0 +1,120 @@
+from decimal import Decimal
+
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.asgi import channel_layers
+from channels.signals import worker_ready
+from channels.worker import Worker
+from django.test import SimpleTestCase
+
+from sleight.engine import book
+from sleight.engine.book import BookOrder, OrderBook
+from sleight.engine.matching import match
+from sleight.tests.base import EngineTestCase
+
+
+class OrderBookTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.book = OrderBook(pair_id=1)
+
+    def add(self, order_id, order_type, price, amount, user_id=1):
+        return self.book.add(BookOrder(order_id, user_id, order_type, price, amount))
+
+    def test_match_fills_in_price_time_priority(self):
+        self.add(1, 'ask', '2', '1')
+        self.add(2, 'ask', '1', '1')
+        self.add(3, 'ask', '1', '1')
+        bid = self.add(4, 'bid', '2', '2.5', user_id=2)
+        fills = match(self.book, bid)
+        self.assertEqual([fill.existing_id for fill in fills], [2, 3, 1])
+        self.assertEqual([fill.amount for fill in fills], [1, 1, Decimal('0.5')])
+        self.assertEqual([fill.partial for fill in fills], [False, False, True])
+        self.assertEqual(fills[-1].initiating_remaining, 0)
+        self.assertEqual(fills[-1].existing_remaining, Decimal('0.5'))
+        self.assertNotIn(4, self.book)
+        self.assertEqual(self.book.best_order('ask').id, 1)
+        self.assertEqual(self.book.volume, {'bid': 0, 'ask': Decimal('0.5')})
+
+    def test_match_trades_at_the_resting_price(self):
+        self.add(1, 'bid', '3', '1')
+        ask = self.add(2, 'ask', '2', '1', user_id=2)
+        fills = match(self.book, ask)
+        self.assertEqual(len(fills), 1)
+        self.assertEqual(fills[0].price, 3)
+        self.assertEqual(fills[0].existing_user_id, 1)
+
+    def test_match_stops_when_the_price_no_longer_crosses(self):
+        self.add(1, 'ask', '1', '1')
+        self.add(2, 'ask', '2', '1')
+        bid = self.add(3, 'bid', '1', '3', user_id=2)
+        fills = match(self.book, bid)
+        self.assertEqual([fill.existing_id for fill in fills], [1])
+        self.assertEqual(fills[0].initiating_remaining, 2)
+        self.assertEqual(self.book.best_price('bid'), 1)
+        self.assertEqual(self.book.best_price('ask'), 2)
+
+    def test_match_without_opposite_orders(self):
+        bid = self.add(1, 'bid', '1', '1')
+        self.assertEqual(match(self.book, bid), [])
+        self.assertIn(1, self.book)
+
+    def test_cancelled_levels_are_dropped_lazily(self):
+        self.add(1, 'ask', '1', '1')
+        self.add(2, 'ask', '2', '1')
+        self.add(3, 'bid', '0.5', '1')
+        self.book.remove(1)
+        # the emptied level stays in the heap until it reaches the top
+        self.assertIn(Decimal(1), self.book._heaps['ask'])
+        self.assertEqual(self.book.best_price('ask'), 2)
+        self.assertNotIn(Decimal(1), self.book._heaps['ask'])
+        self.assertEqual(self.book.volume['ask'], 1)
+
+        bid = self.add(4, 'bid', '2', '1', user_id=2)
+        fills = match(self.book, bid)
+        self.assertEqual([fill.existing_id for fill in fills], [2])
+        self.assertIsNone(self.book.best_price('ask'))
+        self.assertEqual(self.book.best_price('bid'), Decimal('0.5'))
+
+    def test_level_emptied_and_refilled_before_it_is_dropped(self):
+        self.add(1, 'bid', '2', '1')
+        self.add(2, 'bid', '1', '1')
+        self.book.remove(1)
+        self.add(3, 'bid', '2', '1')
+        # the price is still in the heap so it isn't pushed twice
+        self.assertEqual(self.book._heaps['bid'].count(Decimal(-2)), 1)
+        self.assertEqual(self.book.best_order('bid').id, 3)
+
+    def test_remove_missing_order(self):
+        self.assertIsNone(self.book.remove(1))
+
+    def test_place_skips_orders_already_loaded(self):
+        self.add(1, 'ask', '1', '1')
+        self.book._loaded.add(1)
+        self.book.fill(1, Decimal(1))
+        self.assertIsNone(self.book.place(BookOrder(1, 1, 'ask', '1', '1')))
+        self.assertNotIn(1, self.book)
+        self.assertEqual(self.book.place(BookOrder(2, 1, 'ask', '1', '1')).id, 2)
+
+
+class LoadBooksTestCase(EngineTestCase):
+
+    def start_worker(self, **filters):
+        worker = Worker(channel_layers[DEFAULT_CHANNEL_LAYER], **filters)
+        worker_ready.send(sender=worker)
+
+    def test_matcher_builds_its_books_under_the_lease(self):
+        self.create_order(self.alice, 'ask', '2', '1')
+        self.start_worker(only_channels=['check_trades.*'])
+        self.assertEqual(len(book._books[self.pair.id]), 1)
+        self.assertIsNotNone(self.redis.get('sleight:lease:pair:{}'.format(self.pair.id)))
+
+    def test_other_workers_leave_the_books_alone(self):
+        self.start_worker(exclude_channels=['check_trades.*'])
+        self.assertEqual(book._books, {})
+        self.assertIsNone(self.redis.get('sleight:journal:{}'.format(self.pair.id)))
+        self.assertIsNone(self.redis.get('sleight:lease:pair:{}'.format(self.pair.id)))
+
+    def test_pairs_leased_elsewhere_are_left_alone(self):
+        self.redis.set('sleight:lease:pair:{}'.format(self.pair.id), 'another-worker')
+        self.start_worker(only_channels=['check_trades.*'])
+        self.assertEqual(book._books, {})
@@ -0,0 +1,176 @@
+import datetime
+import json
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from sleight.consumers.check_trades import check_trades
+from sleight.engine.candles import CandleBuilder, bucket_start, record_trades
+from sleight.models import Candle
+from sleight.tests.base import EngineTestCase
+
+# the start of a day
+START = datetime.datetime(2017, 7, 14, tzinfo=timezone.utc)
+
+
+def at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+class CandleBuilderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.builder = CandleBuilder(1)
+
+    def test_bucket_start(self):
+        self.assertEqual(bucket_start(at(3725), '1m'), at(3720))
+        self.assertEqual(bucket_start(at(3725), '5m'), at(3600))
+        self.assertEqual(bucket_start(at(3725), '1h'), at(3600))
+        self.assertEqual(bucket_start(at(3725), '1d'), START)
+
+    def test_trades_are_rolled_into_each_resolution(self):
+        self.builder.add_trade(at(10), Decimal(2), Decimal(1))
+        self.builder.add_trade(at(20), Decimal(4), Decimal(2))
+        self.builder.add_trade(at(70), Decimal(3), Decimal(1))
+        self.assertEqual(
+            [(key[0], key[1]) for key in self.builder.candles],
+            [('1m', at(0)), ('5m', at(0)), ('1h', at(0)), ('1d', START), ('1m', at(60))]
+        )
+        candle = self.builder.candles[('1m', at(0))]
+        self.assertEqual(
+            (candle.open, candle.high, candle.low, candle.close),
+            (2, 4, 2, 4)
+        )
+        self.assertEqual((candle.volume, candle.base_volume, candle.trades), (3, 10, 2))
+        candle = self.builder.candles[('5m', at(0))]
+        self.assertEqual(
+            (candle.open, candle.high, candle.low, candle.close),
+            (2, 4, 2, 3)
+        )
+        self.assertEqual((candle.volume, candle.base_volume, candle.trades), (4, 13, 3))
+
+    def test_pop_before_takes_only_the_candles_that_have_ended(self):
+        self.builder.add_trade(at(10), Decimal(2), Decimal(1))
+        self.builder.add_trade(at(70), Decimal(3), Decimal(1))
+        self.assertEqual(self.builder.pop_before(at(59)), [])
+        self.assertEqual(
+            [(candle.resolution, candle.start) for candle in self.builder.pop_before(at(60))],
+            [('1m', at(0))]
+        )
+        self.assertEqual(
+            [key[0] for key in self.builder.candles],
+            ['5m', '1h', '1d', '1m']
+        )
+
+
+class CandlesTestCase(EngineTestCase):
+    maxDiff = None
+
+    def candles(self, resolution):
+        return list(
+            Candle.objects.filter(
+                pair=self.pair,
+                resolution=resolution
+            ).order_by(
+                'start'
+            ).values_list(
+                'start', 'open', 'high', 'low', 'close', 'volume', 'base_volume', 'trades'
+            )
+        )
+
+    def test_record_trades_merges_into_the_stored_candles(self):
+        record_trades(self.pair.id, [(at(10), Decimal(3), Decimal(1))])
+        record_trades(
+            self.pair.id,
+            [(at(20), Decimal(5), Decimal(1)), (at(30), Decimal(1), Decimal(2))]
+        )
+        record_trades(self.pair.id, [(at(70), Decimal(2), Decimal(1))])
+        self.assertEqual(
+            self.candles('1m'),
+            [(at(0), 3, 5, 1, 1, 4, 10, 3), (at(60), 2, 2, 2, 2, 1, 2, 1)]
+        )
+        self.assertEqual(self.candles('1d'), [(START, 3, 5, 1, 2, 5, 12, 4)])
+
+    def test_settlement_records_the_trades(self):
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '2', '1')))
+        check_trades(self.place_message(self.create_order(self.bob, 'bid', '3', '1.5')))
+        candle = Candle.objects.get(pair=self.pair, resolution='1h')
+        self.assertEqual(
+            (candle.open, candle.close, candle.volume, candle.base_volume, candle.trades),
+            (2, 2, 1, 2, 1)
+        )
+
+    def test_backfill_candles_rebuilds_them_from_the_trades(self):
+        ask = self.create_order(self.alice, 'ask', '1', '10')
+        bid = self.create_order(self.bob, 'bid', '5', '10')
+        for seconds, price in ((3610, '4'), (10, '2'), (20, '3'), (7200, '1')):
+            self.create_trade(bid, ask, '1', price, at(seconds))
+        # a candle the rebuild replaces
+        record_trades(self.pair.id, [(at(0), Decimal(9), Decimal(9))])
+
+        out = StringIO()
+        call_command('backfill_candles', 'BTC', 'usnbt', stdout=out)
+        self.assertEqual(out.getvalue(), 'built 10 candles for {}\n'.format(self.pair))
+        self.assertEqual(
+            self.candles('1h'),
+            [
+                (at(0), 2, 3, 2, 3, 2, 5, 2),
+                (at(3600), 4, 4, 4, 4, 1, 4, 1),
+                (at(7200), 1, 1, 1, 1, 1, 1, 1),
+            ]
+        )
+        self.assertEqual(self.candles('1d'), [(START, 2, 4, 1, 1, 4, 10, 4)])
+
+    def test_backfill_candles_of_an_unknown_pair(self):
+        with self.assertRaisesMessage(CommandError, 'pair not found'):
+            call_command('backfill_candles', 'btc', 'ppc', stdout=StringIO())
+
+    def test_get_candles(self):
+        record_trades(
+            self.pair.id,
+            [
+                (at(10), Decimal(3), Decimal(1)),
+                (at(70), Decimal(2), Decimal(1)),
+                (at(130), Decimal(1), Decimal(1)),
+            ]
+        )
+        response = self.client.get(
+            '/get_candles/btc/usnbt',
+            {'resolution': '1m', 'start': int(at(60).timestamp()), 'end': int(at(180).timestamp())}
+        )
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8')),
+            {
+                'success': True,
+                'message': {
+                    'candles': [
+                        {
+                            'time': int(at(seconds).timestamp()),
+                            'open': price,
+                            'high': price,
+                            'low': price,
+                            'close': price,
+                            'volume': '1.0000000000',
+                            'base_volume': price,
+                            'trades': 1,
+                        }
+                        for seconds, price in ((60, '2.0000000000'), (120, '1.0000000000'))
+                    ]
+                }
+            }
+        )
+
+    def test_get_candles_of_an_unknown_pair_or_resolution(self):
+        response = self.client.get('/get_candles/btc/ppc')
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8')),
+            {'success': False, 'message': {'pair': ['pair not found']}}
+        )
+        response = self.client.get('/get_candles/btc/usnbt', {'resolution': '2m'})
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertFalse(content['success'])
+        self.assertIn('resolution', content['message'])
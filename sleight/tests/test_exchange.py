@@ -0,0 +1,58 @@
+import json
+from decimal import Decimal
+
+from django.test import override_settings
+
+from sleight.models import Order
+from sleight.tests.base import EngineTestCase
+from sleight.views.exchange import depth_chart
+
+
+class DepthChartTestCase(EngineTestCase):
+
+    def setUp(self):
+        super(DepthChartTestCase, self).setUp()
+        self.create_order(self.bob, 'bid', '1', '2')
+        self.create_order(self.bob, 'bid', '2', '1')
+        self.create_order(self.alice, 'bid', '2', '0.5')
+        self.create_order(self.alice, 'ask', '3', '1')
+        self.create_order(self.alice, 'ask', '4', '2')
+        cancelled = self.create_order(self.alice, 'ask', '3', '5')
+        Order.objects.filter(id=cancelled.id).update(state='cancelled')
+
+    def test_depth_adds_up_from_the_best_price(self):
+        self.assertEqual(
+            depth_chart(self.pair),
+            [
+                [1.0, None, 3.5],
+                [2.0, None, 1.5],
+                [3.0, 1.0, None],
+                [4.0, 3.0, None],
+            ]
+        )
+
+    def test_clipped_chart_counts_the_orders_outside_it(self):
+        self.assertEqual(
+            depth_chart(self.pair, Decimal('1.5'), Decimal(3)),
+            [[2.0, None, 1.5], [3.0, 1.0, None]]
+        )
+        self.assertEqual(depth_chart(self.pair, Decimal('3.5')), [[4.0, 3.0, None]])
+        self.assertEqual(depth_chart(self.pair, max_price=Decimal('1.5')), [[1.0, None, 3.5]])
+
+    # static files are served from s3 otherwise
+    @override_settings(
+        STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'
+    )
+    def test_graph(self):
+        response = self.client.get('/graph/btc/usnbt', {'min_price': '2', 'max_price': '3'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.context['orders']),
+            [[2.0, None, 1.5], [3.0, 1.0, None]]
+        )
+        response = self.client.get('/graph/btc/usnbt', {'min_price': 'low'})
+        self.assertIn(
+            'min_price',
+            json.loads(response.content.decode('utf-8'))['message']
+        )
+        self.assertEqual(self.client.get('/graph/btc/ppc').status_code, 404)
@@ -0,0 +1,261 @@
+import os
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import override_settings
+
+from sleight.consumers.check_trades import check_trades, match_order, remove_order
+from sleight.engine import book
+from sleight.engine.book import get_book
+from sleight.engine.journal import ACCEPTED, CANCELLED, HEADER, TRADE, VOID, Journal, \
+    read_records, voided
+from sleight.models import Balance, Order, Trade
+from sleight.tests.base import EngineTestCase, forget_process_state
+
+
+class Killed(BaseException):
+    """
+    stands in for the process dying, so none of the consumer's handlers run
+    """
+
+
+class JournalTestCase(EngineTestCase):
+
+    def test_append(self):
+        journal = Journal(self.pair.id)
+        journal.start([[ACCEPTED, 1, self.alice.id, 'ask', '2', '1', '1', False]])
+        self.assertEqual(journal.append([[CANCELLED, 1], [CANCELLED, 2]]), (2, 3))
+        journal.void(3, 3)
+        journal.close()
+        records = [record for record, _ in read_records(journal.path)]
+        self.assertEqual(
+            [(record[0], record[1]) for record in records],
+            [(0, HEADER), (1, ACCEPTED), (2, CANCELLED), (3, CANCELLED), (4, VOID)]
+        )
+        self.assertEqual(records[0][3], journal.journal_id)
+        self.assertEqual(records[1][3:], [1, self.alice.id, 'ask', '2', '1', '1', False])
+        self.assertEqual(voided(records), {3})
+        self.assertTrue(journal.is_current(journal.journal_id, 4))
+        self.assertFalse(journal.is_current(journal.journal_id, 3))
+
+    def test_torn_record_is_ignored_and_truncated(self):
+        journal = Journal(self.pair.id)
+        journal.start([])
+        journal.append([[CANCELLED, 1]])
+        offset = journal._file.tell()
+        journal._file.write(b'\x00\x00\x00\x10torn')
+        journal.close()
+        records = list(read_records(journal.path))
+        self.assertEqual(records[-1][1], offset)
+        journal.resume(journal.journal_id, 1, offset)
+        journal.append([[CANCELLED, 2]])
+        journal.close()
+        self.assertEqual(
+            [record[3] for record, _ in read_records(journal.path)][1:],
+            [1, 2]
+        )
+
+    @override_settings(JOURNAL_SNAPSHOT_EVENTS=2)
+    def test_snapshot(self):
+        journal = Journal(self.pair.id)
+        journal.start([])
+        self.assertIsNone(journal.read_snapshot())
+        journal.append([[CANCELLED, 1]])
+        self.assertFalse(journal.snapshot_due())
+        journal.append([[CANCELLED, 2]])
+        self.assertTrue(journal.snapshot_due())
+        journal.write_snapshot([[3, self.alice.id, 'ask', '2', '1']])
+        self.assertFalse(journal.snapshot_due())
+        self.assertEqual(
+            journal.read_snapshot(),
+            {
+                'journal_id': journal.journal_id,
+                'seq': 2,
+                'offset': os.path.getsize(journal.path),
+                'orders': [[3, self.alice.id, 'ask', '2', '1']],
+            }
+        )
+        journal.close()
+
+    def test_start_keeps_only_the_previous_generation(self):
+        for generation in range(3):
+            journal = Journal(self.pair.id)
+            journal.start([])
+            journal.write_snapshot([])
+            journal.close()
+        self.assertEqual(
+            sorted(os.listdir(settings.JOURNAL_DIR)),
+            [
+                name.format(self.pair.id)
+                for name in (
+                    '{}.journal',
+                    '{}.journal.previous',
+                    '{}.snapshot',
+                    '{}.snapshot.previous',
+                )
+            ]
+        )
+
+    def test_start_drops_a_snapshot_older_than_the_previous_journal(self):
+        journal = Journal(self.pair.id)
+        journal.start([])
+        journal.write_snapshot([])
+        journal.close()
+        for generation in range(2):
+            journal = Journal(self.pair.id)
+            journal.start([])
+            journal.close()
+        self.assertEqual(
+            sorted(os.listdir(settings.JOURNAL_DIR)),
+            [name.format(self.pair.id) for name in ('{}.journal', '{}.journal.previous')]
+        )
+
+
+class RestoreBookTestCase(EngineTestCase):
+
+    def journal_records(self):
+        return [record for record, _ in read_records(Journal(self.pair.id).path)]
+
+    def book_orders(self):
+        return sorted(
+            (order.id, order.order_type, order.price, order.amount)
+            for order in book._books[self.pair.id].orders()
+        )
+
+    @override_settings(JOURNAL_SNAPSHOT_EVENTS=3)
+    def test_restore_from_the_snapshot_and_the_records_after_it(self):
+        for price in ('2', '2.5', '3', '3.5'):
+            check_trades(self.place_message(self.create_order(self.alice, 'ask', price, '1')))
+        cancelled = Order.objects.get(price=Decimal('3.5'))
+        remove_order(self.message({
+            'action': 'cancel',
+            'order_id': cancelled.id,
+            'pair_id': self.pair.id,
+        }))
+        check_trades(self.place_message(self.create_order(self.bob, 'bid', '2.5', '1.5')))
+        self.assertIsNotNone(Journal(self.pair.id).read_snapshot())
+        orders = self.book_orders()
+
+        forget_process_state()
+        with self.assertLogs('sleight.engine.book', 'INFO') as logs:
+            get_book(self.pair.id)
+        self.assertIn('restored', logs.output[0])
+        self.assertEqual(self.book_orders(), orders)
+        asks = dict(Order.objects.filter(order_type='ask').values_list('price', 'id'))
+        self.assertEqual(
+            [(order[0], order[3]) for order in orders],
+            [(asks[Decimal('2.5')], Decimal('0.5')), (asks[Decimal(3)], Decimal(1))]
+        )
+
+    def test_journal_that_is_not_the_latest_is_not_restored(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(ask))
+        self.redis.set('sleight:journal:{}'.format(self.pair.id), 'elsewhere:1')
+
+        forget_process_state()
+        pair_book = get_book(self.pair.id)
+        self.assertEqual(pair_book.get(ask.id).amount, 1)
+        self.assertTrue(os.path.exists('{}.previous'.format(Journal(self.pair.id).path)))
+        self.assertEqual(self.journal_records()[1][1:4:2], [ACCEPTED, ask.id])
+
+    def test_trades_a_crash_left_unsettled_are_voided(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        match_order(self.place_message(ask))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        with mock.patch('sleight.consumers.check_trades.settle', side_effect=Killed):
+            with self.assertRaises(Killed):
+                match_order(self.place_message(bid))
+        trade_seq = self.journal_records()[-1][0]
+        self.assertEqual(self.journal_records()[-1][1], TRADE)
+
+        forget_process_state()
+        book = get_book(self.pair.id)
+        self.assertEqual(book.get(ask.id).amount, 1)
+        self.assertEqual(book.get(bid.id).amount, 1)
+        void = self.journal_records()[-1]
+        self.assertEqual((void[1], void[3], void[4]), (VOID, trade_seq, trade_seq))
+        self.assertFalse(Trade.objects.exists())
+        self.assertEqual(Order.objects.get(id=ask.id).state, 'open')
+
+        # the void is journalled so the next restore doesn't need to find it again
+        forget_process_state()
+        with mock.patch('sleight.engine.book.unsettled_trades', return_value=[]):
+            book = get_book(self.pair.id)
+        self.assertEqual(book.get(ask.id).amount, 1)
+        self.assertEqual(book.get(bid.id).amount, 1)
+
+    def test_settled_trades_are_replayed(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1.5')
+        match_order(self.place_message(ask))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        match_order(self.place_message(bid))
+
+        forget_process_state()
+        book = get_book(self.pair.id)
+        self.assertEqual(book.get(ask.id).amount, 0.5)
+        self.assertNotIn(bid.id, book)
+        self.assertNotIn(VOID, [record[1] for record in self.journal_records()])
+
+
+class ReplayJournalTestCase(EngineTestCase):
+
+    def replay(self, *args):
+        out = StringIO()
+        call_command('replay_journal', 'btc', 'usnbt', *args, stdout=out)
+        return out.getvalue()
+
+    def test_replay_rebuilds_lost_orders_trades_and_balances(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(ask))
+        started = list(Balance.objects.values_list('user_id', 'currency_id', 'amount'))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        check_trades(self.place_message(bid))
+
+        # the database is restored from a backup taken as the journal started
+        Trade.objects.all().delete()
+        Order.objects.filter(id=bid.id).delete()
+        Order.objects.filter(id=ask.id).update(amount=1, state='open')
+        for user_id, currency_id, amount in started:
+            Balance.objects.filter(user_id=user_id, currency_id=currency_id).update(amount=amount)
+
+        self.assertIn('replayed 2 orders (1 placed) and 1 trades', self.replay('--balances'))
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'state')),
+            {ask.id: 'complete', bid.id: 'complete'}
+        )
+        trade = Trade.objects.get()
+        self.assertEqual(
+            (trade.initiating_order_id, trade.existing_order_id, trade.price, trade.taker_side),
+            (bid.id, ask.id, 2, 'bid')
+        )
+        self.assertEqual(self.balance(self.alice, self.base), 1002)
+        self.assertEqual(self.balance(self.alice, self.relative), 999)
+        self.assertEqual(self.balance(self.bob, self.base), 998)
+        self.assertEqual(self.balance(self.bob, self.relative), 1001)
+
+    def test_replay_does_not_duplicate_trades(self):
+        ask = self.create_order(self.alice, 'ask', '2', '2')
+        check_trades(self.place_message(ask))
+        check_trades(self.place_message(self.create_order(self.bob, 'bid', '3', '1')))
+        check_trades(self.place_message(self.create_order(self.bob, 'bid', '3', '1')))
+        self.replay()
+        self.replay()
+        self.assertEqual(Trade.objects.count(), 2)
+        self.assertEqual(Order.objects.get(id=ask.id).state, 'complete')
+
+    def test_replay_skips_voided_trades(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(ask))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        with mock.patch('sleight.consumers.check_trades.settle', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                match_order(self.place_message(bid))
+        self.replay()
+        self.assertFalse(Trade.objects.exists())
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'state')),
+            {ask.id: 'open', bid.id: 'open'}
+        )
@@ -0,0 +1,60 @@
+from unittest import mock
+
+from django.test import override_settings
+
+from sleight.consumers.check_trades import check_trades
+from sleight.engine import book
+from sleight.engine.lease import LEASE_ACQUIRED, LEASE_RENEWED, WORKER_ID, claim_pair
+from sleight.tests.base import EngineTestCase
+from sleight.utils import get_matching_channel
+
+
+class PairLeaseTestCase(EngineTestCase):
+
+    def lease_key(self):
+        return 'sleight:lease:pair:{}'.format(self.pair.id)
+
+    def test_claim_pair(self):
+        self.assertEqual(claim_pair(self.pair.id), LEASE_ACQUIRED)
+        self.assertEqual(claim_pair(self.pair.id), LEASE_RENEWED)
+        self.redis.set(self.lease_key(), 'another-worker')
+        self.assertEqual(claim_pair(self.pair.id), 0)
+
+    def test_book_is_kept_when_the_lease_is_taken_back(self):
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '2', '1')))
+        pair_book = book._books[self.pair.id]
+        # the lease lapses while the pair is quiet
+        self.redis.delete(self.lease_key())
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '3', '1')))
+        self.assertIs(book._books[self.pair.id], pair_book)
+        self.assertEqual(len(pair_book), 2)
+
+    def test_book_is_discarded_when_another_worker_moved_it_on(self):
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '2', '1')))
+        pair_book = book._books[self.pair.id]
+        self.redis.delete(self.lease_key())
+        self.redis.set('sleight:journal:{}'.format(self.pair.id), 'elsewhere:1')
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '3', '1')))
+        self.assertIsNot(book._books[self.pair.id], pair_book)
+        self.assertEqual(len(book._books[self.pair.id]), 2)
+
+    @mock.patch('sleight.engine.lease.WAIT_SECONDS', 0.01)
+    def test_message_is_held_until_the_lease_lapses(self):
+        self.redis.set(self.lease_key(), 'another-worker', px=200)
+        message = self.place_message(self.create_order(self.alice, 'ask', '2', '1'))
+        check_trades(message)
+        self.assertTrue(message.content['waited'])
+        self.assertEqual(self.redis.get(self.lease_key()), WORKER_ID.encode('utf-8'))
+        self.assertEqual(len(book._books[self.pair.id]), 1)
+
+    @override_settings(PAIR_LEASE_SECONDS=1)
+    @mock.patch('sleight.engine.lease.MAX_WAIT_SECONDS', 0.1)
+    def test_message_is_sent_back_if_the_lease_is_never_released(self):
+        self.redis.set(self.lease_key(), 'another-worker')
+        order = self.create_order(self.alice, 'ask', '2', '1')
+        self.assertIsNone(check_trades(self.place_message(order)))
+        self.assertNotIn(self.pair.id, book._books)
+        message = self.get_next_message(get_matching_channel(self.pair), require=True)
+        self.assertEqual(message.content['order_id'], order.id)
+        self.assertTrue(message.content['waited'])
+
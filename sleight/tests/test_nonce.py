@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+
+from sleight.models import Profile
+from sleight.utils import use_nonce
+
+
+class UseNonceTestCase(TestCase):
+
+    def setUp(self):
+        user = User.objects.create(username='nonce', email='nonce@example.com')
+        self.profile = Profile.objects.create(user=user, nonce=0)
+
+    def use(self, nonce, window):
+        return use_nonce(self.profile.id, window, nonce)
+
+    def test_without_a_window_nonces_must_increase(self):
+        self.assertIsNone(self.use(5, 0))
+        self.assertEqual(self.use(5, 0), 'nonce needs to be greater than 5')
+        self.assertEqual(self.use(3, 0), 'nonce needs to be greater than 5')
+        self.assertIsNone(self.use(6, 0))
+
+    def test_window_accepts_each_nonce_once(self):
+        self.assertIsNone(self.use(10, 5))
+        self.assertIsNone(self.use(8, 5))
+        self.assertEqual(self.use(8, 5), 'nonce 8 has already been used')
+        self.assertEqual(self.use(10, 5), 'nonce 10 has already been used')
+        self.assertIsNone(self.use(6, 5))
+        self.assertEqual(self.use(5, 5), 'nonce needs to be greater than 5')
+
+    def test_window_moves_up_with_the_highest_nonce(self):
+        self.assertIsNone(self.use(10, 5))
+        self.assertIsNone(self.use(8, 5))
+        self.assertIsNone(self.use(12, 5))
+        # nonces used before the window moved are still marked
+        self.assertEqual(self.use(8, 5), 'nonce 8 has already been used')
+        self.assertEqual(self.use(10, 5), 'nonce 10 has already been used')
+        self.assertIsNone(self.use(9, 5))
+        self.assertEqual(self.use(7, 5), 'nonce needs to be greater than 7')
+
+    def test_skipping_past_the_window_clears_it(self):
+        self.assertIsNone(self.use(10, 5))
+        self.assertIsNone(self.use(1000, 5))
+        self.assertIsNone(self.use(999, 5))
+        self.assertEqual(self.use(1000, 5), 'nonce 1000 has already been used')
+
+    def test_starting_without_a_window_marks_lower_nonces_used(self):
+        self.assertIsNone(self.use(10, 0))
+        self.assertEqual(self.use(9, 5), 'nonce 9 has already been used')
+        self.assertIsNone(self.use(11, 5))
+        self.assertEqual(self.use(11, 5), 'nonce 11 has already been used')
+
+    def test_nonce_used_by_another_request_meanwhile_is_kept(self):
+        self.assertIsNone(self.use(10, 5))
+        update = QuerySet.update
+        updates = []
+
+        def update_after_another_request(queryset, **kwargs):
+            updates.append(kwargs)
+            if len(updates) == 1:
+                # another request uses 11 between reading the window and saving it
+                update(Profile.objects.filter(pk=self.profile.id), nonce=11, nonce_bitmap=3)
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(
+                QuerySet,
+                'update',
+                autospec=True,
+                side_effect=update_after_another_request
+        ):
+            self.assertIsNone(self.use(8, 5))
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.use(11, 5), 'nonce 11 has already been used')
+        self.assertEqual(self.use(10, 5), 'nonce 10 has already been used')
+        self.assertEqual(self.use(8, 5), 'nonce 8 has already been used')
+
+    @override_settings(NONCE_ATTEMPTS=2)
+    def test_gives_up_when_other_requests_keep_getting_in_first(self):
+        self.assertIsNone(self.use(10, 5))
+        with mock.patch.object(QuerySet, 'update', return_value=0) as update:
+            self.assertEqual(
+                self.use(8, 5),
+                'too many requests at once for nonce 8, try again'
+            )
+        self.assertEqual(update.call_count, 2)
+        self.assertIsNone(self.use(8, 5))
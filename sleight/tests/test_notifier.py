@@ -0,0 +1,84 @@
+import json
+from unittest import mock
+
+from channels import Group
+from django.test import SimpleTestCase
+
+from sleight.consumers.check_trades import check_trades
+from sleight.consumers.notifier import Notifier, user_balances_group
+from sleight.tests.base import EngineTestCase
+
+
+class NotifierTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.notifier = Notifier()
+
+    def test_order_updates_are_conflated(self):
+        self.notifier.order('pair-1', {'order_id': 1, 'state': 'open'}, user_id=3)
+        self.notifier.order('pair-1', {'order_id': 2, 'state': 'open'})
+        self.notifier.order('pair-1', {'order_id': 1, 'state': 'complete'}, user_id=3)
+        self.assertEqual(
+            list(self.notifier.groups['pair-1'].values()),
+            [{'order_id': 2, 'state': 'open'}, {'order_id': 1, 'state': 'complete'}]
+        )
+        self.assertEqual(
+            list(self.notifier.groups['user-3-orders'].values()),
+            [{'order_id': 1, 'state': 'complete', 'channel': 'orders'}]
+        )
+
+    def test_balance_updates_are_conflated_per_currency(self):
+        self.notifier.balance(3, {'currency': 'BTC', 'amount': '1'})
+        self.notifier.balance(3, {'currency': 'LTC', 'amount': '5'})
+        self.notifier.balance(3, {'currency': 'BTC', 'amount': '2'})
+        self.assertEqual(
+            list(self.notifier.groups['user-3-balances'].values()),
+            [{'currency': 'LTC', 'amount': '5'}, {'currency': 'BTC', 'amount': '2'}]
+        )
+
+    def test_unkeyed_messages_are_all_kept(self):
+        self.notifier.add('pair-1', {'trade': 1})
+        self.notifier.add('pair-1', {'trade': 1})
+        self.assertEqual(len(self.notifier.groups['pair-1']), 2)
+
+    @mock.patch('sleight.consumers.notifier.Group')
+    def test_flush_sends_one_frame_per_group(self, group):
+        self.notifier.add('pair-1', {'trade': 1})
+        self.notifier.add('pair-1', {'trade': 2})
+        self.notifier.balance(3, {'currency': 'BTC', 'amount': '1'})
+        self.notifier.flush()
+        frames = {
+            call[0][0]: json.loads(send[0][0]['text'])
+            for call, send in zip(group.call_args_list, group.return_value.send.call_args_list)
+        }
+        self.assertEqual(
+            frames,
+            {
+                'pair-1': {
+                    'message_type': 'batch',
+                    'messages': [{'trade': 1}, {'trade': 2}],
+                },
+                'user-3-balances': {'currency': 'BTC', 'amount': '1'},
+            }
+        )
+        self.assertEqual(self.notifier.groups, {})
+
+
+class MatchPassNotificationTestCase(EngineTestCase):
+
+    def test_each_group_gets_one_frame_for_the_pass(self):
+        Group(user_balances_group(self.alice.id)).add('test.alice')
+        Group(user_balances_group(self.bob.id)).add('test.bob')
+        check_trades(self.place_message(self.create_order(self.alice, 'ask', '2', '1')))
+        check_trades(self.place_message(self.create_order(self.bob, 'bid', '3', '1')))
+
+        frame = json.loads(self.get_next_message('test.bob', require=True).content['text'])
+        self.assertEqual(frame['message_type'], 'batch')
+        self.assertEqual(
+            sorted((message['currency'], message['balance']) for message in frame['messages']),
+            [('btc', '998.0000000000'), ('usnbt', '1001.0000000000')]
+        )
+        self.assertIsNone(self.get_next_message('test.bob'))
+        frame = json.loads(self.get_next_message('test.alice', require=True).content['text'])
+        self.assertEqual((frame['currency'], frame['balance']), ('btc', '1002.0000000000'))
+        self.assertIsNone(self.get_next_message('test.alice'))
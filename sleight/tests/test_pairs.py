@@ -0,0 +1,52 @@
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import override_settings
+from redis import ConnectionError
+
+from sleight import utils
+from sleight.models import Currency, CurrencyPair
+from sleight.routing import matching_routes
+from sleight.tests.base import EngineTestCase
+
+
+class PairRegistryTestCase(EngineTestCase):
+
+    def test_version_is_checked_at_most_once_a_period(self):
+        with mock.patch.object(self.redis, 'get', wraps=self.redis.get) as get:
+            self.assertEqual(utils.find_pair('BTC', 'usnbt'), self.pair)
+            self.assertEqual(utils.get_pair(self.pair.id), self.pair)
+            self.assertEqual(utils.get_pair_names(), {self.pair.id: 'btc/usnbt'})
+        self.assertEqual(get.call_count, 1)
+
+    @override_settings(PAIRS_CHECK_SECONDS=0)
+    def test_pairs_are_reloaded_when_the_version_changes(self):
+        self.assertEqual(len(utils.get_pairs()), 1)
+        pair = CurrencyPair.objects.create(
+            base_currency=self.base,
+            relative_currency=Currency.objects.create(name='Peercoin', code='PPC')
+        )
+        self.assertIsNone(utils.find_pair('btc', 'ppc'))
+        self.redis.incr(utils.PAIRS_VERSION_KEY)
+        self.assertEqual(utils.find_pair('btc', 'ppc'), pair)
+
+    def test_saving_a_pair_reloads_this_process_straight_away(self):
+        utils.get_pairs()
+        pair = CurrencyPair.objects.create(
+            base_currency=self.base,
+            relative_currency=Currency.objects.create(name='Peercoin', code='PPC')
+        )
+        utils._bump_pairs_version()
+        self.assertEqual(utils.find_pair('btc', 'ppc'), pair)
+
+    def test_matching_routes(self):
+        self.assertEqual(
+            [route.channels for route in matching_routes()],
+            [['check_trades.btc-usnbt']] * 5
+        )
+
+    def test_matching_routes_without_the_database_or_redis(self):
+        for error in (DatabaseError, ConnectionError):
+            with mock.patch('sleight.routing.get_matching_channels', side_effect=error):
+                with self.assertLogs('sleight.routing', 'ERROR'):
+                    self.assertEqual(matching_routes(), [])
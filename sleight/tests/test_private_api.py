@@ -0,0 +1,365 @@
+import csv
+import io
+import json
+
+from sleight.consumers.check_trades import check_trades_batch, remove_orders
+from sleight.engine import book
+from sleight.engine.book import get_book
+from sleight.models import Order
+from sleight.tests.base import EngineTestCase
+from sleight.utils import get_matching_channel
+
+
+class PrivateApiTestCase(EngineTestCase):
+
+    def call(self, path, user, **data):
+        """
+        the message of a successful private api call
+        """
+        content = json.loads(self.api_post(path, user, **data).content.decode('utf-8'))
+        self.assertTrue(content['success'], content['message'])
+        return content['message']
+
+
+class GetOrdersTestCase(PrivateApiTestCase):
+
+    def test_orders_are_paged_oldest_first(self):
+        orders = [self.create_order(self.alice, 'ask', price, '1') for price in '234']
+        self.create_order(self.bob, 'ask', '2', '1')
+        page = self.call('/get_orders', self.alice, limit=2)
+        self.assertEqual([order['id'] for order in page['orders']], [orders[0].id, orders[1].id])
+        self.assertEqual(page['next_since_id'], orders[1].id)
+        self.assertEqual(
+            page['orders'][0],
+            {
+                'id': orders[0].id,
+                'state': 'open',
+                'amount': 1.0,
+                'original_amount': 1.0,
+                'price': 2.0,
+                'order_type': 'ask',
+                'pair': 'btc/usnbt',
+                'time': orders[0].time.timestamp(),
+            }
+        )
+        page = self.call('/get_orders', self.alice, limit=2, since_id=page['next_since_id'])
+        self.assertEqual([order['id'] for order in page['orders']], [orders[2].id])
+        self.assertIsNone(page['next_since_id'])
+
+    def test_orders_are_filtered(self):
+        open_order = self.create_order(self.alice, 'ask', '2', '1')
+        cancelled = self.create_order(self.alice, 'ask', '3', '1')
+        cancelled.state = 'cancelled'
+        cancelled.save()
+        page = self.call('/get_orders', self.alice, state='open', pair='btc/usnbt')
+        self.assertEqual([order['id'] for order in page['orders']], [open_order.id])
+        page = self.call(
+            '/get_orders',
+            self.alice,
+            start=int(cancelled.time.timestamp()) + 1
+        )
+        self.assertEqual(page['orders'], [])
+
+
+class GetTradesTestCase(PrivateApiTestCase):
+
+    def trades(self, user, **data):
+        return [
+            (trade['id'], trade['order_id'], trade['order_type'], trade['role'])
+            for trade in self.call('/get_trades', user, **data)['trades']
+        ]
+
+    def test_each_side_sees_its_own_order_and_role(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        trade = self.create_trade(bid, ask, '1', '2')
+        self.assertEqual(self.trades(self.alice), [(trade.id, ask.id, 'ask', 'maker')])
+        self.assertEqual(self.trades(self.bob), [(trade.id, bid.id, 'bid', 'taker')])
+        listed = self.call('/get_trades', self.bob)['trades'][0]
+        self.assertEqual(
+            (listed['initiating_order'], listed['existing_order'], listed['price']),
+            (bid.id, ask.id, 2.0)
+        )
+
+    def test_trade_between_the_users_own_orders_is_kept_on_one_page(self):
+        ask = self.create_order(self.alice, 'ask', '2', '2')
+        own_bid = self.create_order(self.alice, 'bid', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '2', '1')
+        own_trade = self.create_trade(own_bid, ask, '1', '2')
+        trade = self.create_trade(bid, ask, '1', '2')
+
+        page = self.call('/get_trades', self.alice, limit=1)
+        self.assertEqual(
+            [(listed['id'], listed['role']) for listed in page['trades']],
+            [(own_trade.id, 'maker'), (own_trade.id, 'taker')]
+        )
+        self.assertEqual(page['next_since_id'], own_trade.id)
+        page = self.call('/get_trades', self.alice, limit=1, since_id=own_trade.id)
+        self.assertEqual(
+            [(listed['id'], listed['role']) for listed in page['trades']],
+            [(trade.id, 'maker')]
+        )
+        self.assertEqual(page['next_since_id'], trade.id)
+        page = self.call('/get_trades', self.alice, limit=1, since_id=trade.id)
+        self.assertEqual(page, {'trades': [], 'next_since_id': None})
+
+    def test_trades_are_filtered_by_pair(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        self.create_trade(bid, ask, '1', '2')
+        self.assertEqual(len(self.trades(self.alice, pair='btc/usnbt')), 1)
+        response = self.api_post('/get_trades', self.alice, pair='btc/ppc')
+        self.assertIn('pair', json.loads(response.content.decode('utf-8'))['message'])
+
+
+class GetOrderTestCase(PrivateApiTestCase):
+
+    def test_orders_are_returned_with_their_fills(self):
+        ask = self.create_order(self.alice, 'ask', '2', '3')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        own_bid = self.create_order(self.alice, 'bid', '2', '1')
+        trade = self.create_trade(bid, ask, '1', '2')
+        own_trade = self.create_trade(own_bid, ask, '1', '2')
+
+        message = self.call('/get_order', self.alice, order_id=[ask.id, own_bid.id])
+        self.assertEqual(message['not_found'], [])
+        orders = {order['id']: order for order in message['orders']}
+        self.assertEqual(
+            [(fill['trade_id'], fill['role']) for fill in orders[ask.id]['fills']],
+            [(trade.id, 'maker'), (own_trade.id, 'maker')]
+        )
+        self.assertEqual(
+            orders[own_bid.id]['fills'],
+            [
+                {
+                    'trade_id': own_trade.id,
+                    'amount': 1.0,
+                    'price': 2.0,
+                    'time': own_trade.time.timestamp(),
+                    'role': 'taker',
+                }
+            ]
+        )
+        self.assertEqual(orders[own_bid.id]['order_type'], 'bid')
+
+    def test_other_users_orders_are_not_found(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '1', '1')
+        message = self.call(
+            '/get_order',
+            self.alice,
+            order_id='{},{},{}'.format(bid.id, ask.id, bid.id + 100)
+        )
+        self.assertEqual([order['id'] for order in message['orders']], [ask.id])
+        self.assertEqual(message['orders'][0]['fills'], [])
+        self.assertEqual(message['not_found'], [bid.id, bid.id + 100])
+        message = self.call('/get_order', self.alice, order_id=bid.id)
+        self.assertEqual(message, {'orders': [], 'not_found': [bid.id]})
+
+    def test_order_ids_must_be_numbers(self):
+        response = self.api_post('/get_order', self.alice, order_id='1,two')
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8')),
+            {
+                'success': False,
+                'message': {'order_id': ['order_id must be a list of whole numbers']},
+            }
+        )
+
+
+class BatchTestCase(PrivateApiTestCase):
+
+    def place_orders(self, user, *orders):
+        return self.api_post(
+            '/place_orders',
+            user,
+            orders=json.dumps([
+                {'order_type': order_type, 'pair': 'btc/usnbt', 'amount': amount, 'price': price}
+                for order_type, price, amount in orders
+            ])
+        )
+
+    def matching_message(self):
+        return self.get_next_message(get_matching_channel(self.pair), require=True)
+
+    def test_place_orders(self):
+        response = self.place_orders(
+            self.alice,
+            ('ask', '3', '1'),
+            ('ask', '4', '2'),
+            ('bid', '1', '5')
+        )
+        order_ids = json.loads(response.content.decode('utf-8'))['message']['order_ids']
+        self.assertEqual(
+            list(Order.objects.order_by('id').values_list('id', 'order_type', 'state')),
+            [
+                (order_ids[0], 'ask', 'open'),
+                (order_ids[1], 'ask', 'open'),
+                (order_ids[2], 'bid', 'open'),
+            ]
+        )
+        self.assertEqual(self.balance(self.alice, self.relative), 997)
+        self.assertEqual(self.balance(self.alice, self.base), 995)
+
+        # the matching engine gets them all in one message
+        message = self.matching_message()
+        self.assertEqual(message.content['action'], 'place_batch')
+        self.assertEqual(
+            [order['order_id'] for order in message.content['orders']],
+            order_ids
+        )
+        self.assertIsNone(self.get_next_message(get_matching_channel(self.pair)))
+        check_trades_batch(message)
+        self.assertEqual(len(book._books[self.pair.id]), 3)
+
+        self.place_orders(self.bob, ('bid', '3.5', '1.5'))
+        fills = check_trades_batch(self.matching_message())
+        self.assertEqual([fill.existing_id for fill in fills], [order_ids[0]])
+        self.assertEqual(Order.objects.get(id=order_ids[0]).state, 'complete')
+
+    def test_orders_are_all_placed_or_none_are(self):
+        content = json.loads(
+            self.place_orders(
+                self.alice,
+                ('ask', '3', '600'),
+                ('bid', '1', '5'),
+                ('ask', '4', '600')
+            ).content.decode('utf-8')
+        )
+        self.assertFalse(content['success'])
+        self.assertIn('insufficient balance', content['message'][0]['balance'])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.balance(self.alice, self.relative), 1000)
+        self.assertEqual(self.balance(self.alice, self.base), 1000)
+        self.assertIsNone(self.get_next_message(get_matching_channel(self.pair)))
+
+    def test_invalid_orders_are_listed(self):
+        content = json.loads(
+            self.place_orders(
+                self.alice,
+                ('ask', '3', '1'),
+                ('ask', '0', '1')
+            ).content.decode('utf-8')
+        )
+        self.assertEqual(
+            content['message'],
+            {'orders': ['order 1: price must be a non zero positive number']}
+        )
+        self.assertFalse(Order.objects.exists())
+
+    def test_cancel_orders(self):
+        asks = [self.create_order(self.alice, 'ask', price, '1') for price in ('2', '3')]
+        bid = self.create_order(self.alice, 'bid', '1', '2')
+        others = self.create_order(self.bob, 'ask', '2', '1')
+        complete = self.create_order(self.alice, 'ask', '5', '1')
+        Order.objects.filter(id=complete.id).update(state='complete', amount=0)
+        get_book(self.pair.id)
+
+        order_ids = [asks[0].id, bid.id, others.id, complete.id]
+        message = self.call('/cancel_orders', self.alice, order_id=order_ids)
+        self.assertEqual(message['orders_cancelled'], [asks[0].id, bid.id])
+        self.assertEqual(message['not_found'], [others.id, complete.id])
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'state')),
+            {
+                asks[0].id: 'cancelled',
+                asks[1].id: 'open',
+                bid.id: 'cancelled',
+                others.id: 'open',
+                complete.id: 'complete',
+            }
+        )
+        # what the complete order held back went to its trades
+        self.assertEqual(self.balance(self.alice, self.relative), 998)
+        self.assertEqual(self.balance(self.alice, self.base), 1000)
+
+        message = self.matching_message()
+        self.assertEqual(message.content['action'], 'cancel_batch')
+        self.assertEqual(message.content['order_ids'], [asks[0].id, bid.id])
+        remove_orders(message)
+        self.assertEqual(
+            sorted(order.id for order in book._books[self.pair.id].orders()),
+            [asks[1].id, others.id]
+        )
+
+    def test_cancel_all(self):
+        asks = [self.create_order(self.alice, 'ask', price, '1') for price in ('2', '3')]
+        others = self.create_order(self.bob, 'ask', '2', '1')
+        message = self.call('/cancel_all', self.alice, pair='btc/usnbt')
+        self.assertEqual(message['orders_cancelled'], [order.id for order in asks])
+        self.assertEqual(Order.objects.get(id=others.id).state, 'open')
+        self.assertEqual(self.balance(self.alice, self.relative), 1000)
+        self.assertEqual(self.call('/cancel_all', self.alice, pair='btc/usnbt'), {
+            'orders_cancelled': [],
+        })
+
+
+class ExportTestCase(EngineTestCase):
+
+    def export(self, path, user, **data):
+        response = self.api_post(path, user, **data)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_orders_as_ndjson(self):
+        orders = [self.create_order(self.alice, 'ask', price, '1') for price in ('2', '3')]
+        self.create_order(self.bob, 'ask', '2', '1')
+        response, content = self.export('/export_orders', self.alice)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="orders.ndjson"'
+        )
+        lines = content.splitlines()
+        self.assertEqual(
+            [json.loads(line)['id'] for line in lines],
+            [order.id for order in orders]
+        )
+        self.assertEqual(json.loads(lines[1])['price'], 3.0)
+        self.assertTrue(content.endswith('\n'))
+
+    def test_export_trades_as_csv(self):
+        ask = self.create_order(self.alice, 'ask', '2', '2')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        own_bid = self.create_order(self.alice, 'bid', '2', '1')
+        trade = self.create_trade(bid, ask, '1', '2')
+        own_trade = self.create_trade(own_bid, ask, '1', '2')
+        response, content = self.export('/export_trades', self.alice, format='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename="trades.csv"'
+        )
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            [(int(row['id']), int(row['order_id']), row['role']) for row in rows],
+            [
+                (trade.id, ask.id, 'maker'),
+                (own_trade.id, ask.id, 'maker'),
+                (own_trade.id, own_bid.id, 'taker'),
+            ]
+        )
+        self.assertEqual(
+            list(rows[0]),
+            [
+                'id', 'order_id', 'order_type', 'role', 'initiating_order', 'existing_order',
+                'pair', 'time', 'amount', 'price', 'partial'
+            ]
+        )
+
+    def test_export_is_filtered(self):
+        self.create_order(self.alice, 'ask', '2', '1')
+        cancelled = self.create_order(self.alice, 'ask', '3', '1')
+        Order.objects.filter(id=cancelled.id).update(state='cancelled')
+        _, content = self.export('/export_orders', self.alice, state='cancelled')
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [cancelled.id])
+
+    def test_export_of_nothing_is_empty(self):
+        self.assertEqual(self.export('/export_orders', self.alice, format='csv')[1], '')
+        self.assertEqual(self.export('/export_trades', self.alice)[1], '')
+
+    def test_invalid_format(self):
+        response = self.api_post('/export_orders', self.alice, format='xml')
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertFalse(content['success'])
+        self.assertIn('format', content['message'])
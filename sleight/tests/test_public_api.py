@@ -0,0 +1,65 @@
+import json
+from unittest import mock
+
+from sleight.tests.base import EngineTestCase
+from sleight.utils import bump_book_version
+
+
+class VersionedTestCase(EngineTestCase):
+
+    def get(self, url, etag=None, **params):
+        if etag is None:
+            return self.client.get(url, params)
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+
+    def bid_orders(self, response):
+        return json.loads(response.content.decode('utf-8'))['message']['bid_orders']
+
+    def test_unchanged_book_is_not_modified(self):
+        response = self.get('/get_order_book/btc/usnbt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"0"')
+        response = self.get('/get_order_book/btc/usnbt', '"0"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], '"0"')
+
+        bump_book_version(self.pair)
+        response = self.get('/get_order_book/btc/usnbt', '"0"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"1"')
+
+    def test_response_is_cached_until_the_book_changes(self):
+        self.assertEqual(self.bid_orders(self.get('/get_order_book/btc/usnbt')), [])
+        bid = self.create_order(self.bob, 'bid', '2', '1')
+        with self.assertNumQueries(0):
+            response = self.get('/get_order_book/BTC/usnbt')
+        self.assertEqual(self.bid_orders(response), [])
+
+        bump_book_version(self.pair)
+        orders = self.bid_orders(self.get('/get_order_book/btc/usnbt'))
+        self.assertEqual([order['order_id'] for order in orders], [bid.id])
+
+    def test_query_strings_are_cached_apart(self):
+        self.create_order(self.bob, 'bid', '2', '1')
+        self.get('/get_order_book/btc/usnbt')
+        response = self.get('/get_order_book/btc/usnbt', aggregate='true')
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8'))['message']['bid_levels'],
+            [{'price': '2.0000000000', 'amount': '1.0000000000', 'orders': 1}]
+        )
+
+    def test_errors_are_not_cached(self):
+        self.get('/get_order_book/btc/usnbt', depth='none')
+        self.get('/get_order_book/btc/ppc')
+        self.assertEqual(self.redis.keys('sleight:cache:*'), [])
+
+    def test_ticker_version_moves_on_each_minute(self):
+        with mock.patch('sleight.views.public_api.time.time', return_value=1500000000):
+            response = self.get('/get_ticker/btc/usnbt')
+            self.assertEqual(response['ETag'], '"0.25000000"')
+            response = self.get('/get_ticker/btc/usnbt', '"0.25000000"')
+            self.assertEqual(response.status_code, 304)
+        with mock.patch('sleight.views.public_api.time.time', return_value=1500000060):
+            response = self.get('/get_ticker/btc/usnbt', '"0.25000000"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"0.25000001"')
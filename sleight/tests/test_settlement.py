@@ -0,0 +1,236 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.db import IntegrityError
+from django.db.models import QuerySet
+from django.test import SimpleTestCase
+
+from sleight.consumers.check_trades import check_trades, match_order
+from sleight.engine import book
+from sleight.engine.book import BookOrder, OrderBook
+from sleight.engine.matching import Fill, match
+from sleight.engine.settlement import SettlementConflict, balance_deltas, move_balance, settle
+from sleight.models import Balance, CurrencyPair, Order, Trade
+from sleight.tests.base import EngineTestCase, MigrationTestCase
+
+
+class BalanceDeltasTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.pair = CurrencyPair(id=1, base_currency_id=10, relative_currency_id=20)
+
+    def fill(self, existing_user_id, amount, price):
+        return Fill(
+            initiating_id=1,
+            existing_id=2,
+            existing_user_id=existing_user_id,
+            amount=Decimal(amount),
+            price=Decimal(price),
+            partial=False,
+            initiating_remaining=Decimal(0),
+            existing_remaining=Decimal(0),
+        )
+
+    def test_ask_fills(self):
+        ask = BookOrder(1, 1, 'ask', '2', '3')
+        deltas = balance_deltas(self.pair, ask, [self.fill(2, '1', '3'), self.fill(3, '2', '2')])
+        self.assertEqual(
+            deltas,
+            {
+                (1, 10): Decimal(7),
+                (2, 20): Decimal(1),
+                (3, 20): Decimal(2),
+            }
+        )
+
+    def test_bid_filled_at_a_better_price_is_refunded(self):
+        bid = BookOrder(1, 1, 'bid', '3', '3')
+        deltas = balance_deltas(self.pair, bid, [self.fill(2, '1', '2'), self.fill(3, '2', '3')])
+        self.assertEqual(
+            deltas,
+            {
+                (1, 10): Decimal(1),
+                (1, 20): Decimal(3),
+                (2, 10): Decimal(2),
+                (3, 10): Decimal(6),
+            }
+        )
+
+    def test_bid_trading_with_its_own_ask(self):
+        bid = BookOrder(1, 1, 'bid', '2', '1')
+        deltas = balance_deltas(self.pair, bid, [self.fill(1, '1', '1.5')])
+        self.assertEqual(deltas, {(1, 10): Decimal(2), (1, 20): Decimal(1)})
+
+
+class SettleTestCase(EngineTestCase):
+
+    def match(self, resting, order):
+        """
+        match the order against the resting orders on a book of their own
+        """
+        pair_book = OrderBook(self.pair.id, pair=self.pair)
+        for existing in resting:
+            pair_book.add(
+                BookOrder(
+                    existing.id,
+                    existing.user_id,
+                    existing.order_type,
+                    existing.price,
+                    existing.amount
+                )
+            )
+        initiating_order = pair_book.add(
+            BookOrder(order.id, order.user_id, order.order_type, order.price, order.amount)
+        )
+        return initiating_order, match(pair_book, initiating_order)
+
+    def test_settle(self):
+        first = self.create_order(self.alice, 'ask', '2', '1')
+        second = self.create_order(self.alice, 'ask', '2.5', '2')
+        bid = self.create_order(self.bob, 'bid', '3', '2')
+        trades, balances = settle(self.pair, *self.match([first, second], bid))
+
+        self.assertEqual(
+            [(trade.existing_order_id, trade.amount, trade.price) for trade in trades],
+            [(first.id, 1, 2), (second.id, 1, Decimal('2.5'))]
+        )
+        self.assertTrue(all(trade.id for trade in trades))
+        self.assertEqual(Trade.objects.filter(taker_side='bid', pair=self.pair).count(), 2)
+        self.assertEqual(
+            dict(Order.objects.values_list('id', 'state')),
+            {first.id: 'complete', second.id: 'partial', bid.id: 'complete'}
+        )
+        self.assertEqual(Order.objects.get(id=second.id).amount, 1)
+        # the bid reserved 6 and paid 4.5, so 1.5 comes back
+        self.assertEqual(
+            sorted(balances),
+            sorted([
+                (self.alice.id, self.base.id, Decimal('1004.5')),
+                (self.bob.id, self.base.id, Decimal('995.5')),
+                (self.bob.id, self.relative.id, Decimal('1002')),
+            ])
+        )
+        self.assertEqual(self.balance(self.alice, self.relative), 997)
+
+    def test_settle_conflict_writes_nothing(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        initiating_order, fills = self.match([ask], bid)
+        # cancelled after the book matched it
+        Order.objects.filter(id=ask.id).update(state='cancelled')
+        with self.assertRaises(SettlementConflict):
+            settle(self.pair, initiating_order, fills)
+        self.assertFalse(Trade.objects.exists())
+        self.assertEqual(Order.objects.get(id=bid.id).state, 'open')
+        self.assertEqual(self.balance(self.alice, self.base), 1000)
+        self.assertEqual(self.balance(self.bob, self.relative), 1000)
+
+    def test_conflict_reloads_the_book_and_matches_again(self):
+        cancelled = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(cancelled))
+        ask = self.create_order(self.alice, 'ask', '2.5', '1')
+        check_trades(self.place_message(ask))
+        # cancelled without the book hearing about it yet
+        Order.objects.filter(id=cancelled.id).update(state='cancelled')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        fills = check_trades(self.place_message(bid))
+
+        self.assertEqual([fill.existing_id for fill in fills], [ask.id])
+        self.assertEqual(
+            list(Trade.objects.values_list('existing_order_id', 'initiating_order_id')),
+            [(ask.id, bid.id)]
+        )
+        self.assertNotIn(cancelled.id, book._books[self.pair.id])
+
+    def test_order_cancelled_before_it_matched_is_not_retried(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(ask))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        Order.objects.filter(id=bid.id).update(state='cancelled')
+        self.assertEqual(check_trades(self.place_message(bid)), [])
+        self.assertFalse(Trade.objects.exists())
+        self.assertEqual(book._books[self.pair.id].get(ask.id).amount, 1)
+        self.assertNotIn(bid.id, book._books[self.pair.id])
+
+    def test_failed_settlement_leaves_the_order_resting(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        check_trades(self.place_message(ask))
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        with mock.patch('sleight.consumers.check_trades.settle', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                match_order(self.place_message(bid))
+        self.assertNotIn(self.pair.id, book._books)
+        pair_book = book.get_book(self.pair.id)
+        self.assertEqual(pair_book.get(ask.id).amount, 1)
+        self.assertEqual(pair_book.get(bid.id).amount, 1)
+
+
+class MoveBalanceTestCase(EngineTestCase):
+
+    def test_existing_balance_is_moved(self):
+        move_balance(self.alice.id, self.base.id, Decimal('-2.5'))
+        self.assertEqual(self.balance(self.alice, self.base), Decimal('997.5'))
+
+    def test_missing_balance_is_created(self):
+        carol = self.create_user('carol')
+        Balance.objects.filter(user=carol, currency=self.base).delete()
+        move_balance(carol.id, self.base.id, Decimal(3))
+        self.assertEqual(self.balance(carol, self.base), 3)
+
+    def test_balance_created_by_another_worker_is_moved(self):
+        carol = self.create_user('carol')
+        Balance.objects.filter(user=carol, currency=self.base).delete()
+        update = QuerySet.update
+        updates = []
+
+        def update_before_another_worker(queryset, **kwargs):
+            updates.append(kwargs)
+            if len(updates) == 1:
+                # there is nothing to update until the other worker creates it
+                Balance.objects.create(user=carol, currency=self.base, amount=Decimal(5))
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(
+                QuerySet,
+                'update',
+                autospec=True,
+                side_effect=update_before_another_worker
+        ):
+            move_balance(carol.id, self.base.id, Decimal(3))
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(self.balance(carol, self.base), 8)
+
+    def test_balances_are_unique(self):
+        with self.assertRaises(IntegrityError):
+            Balance.objects.create(user=self.alice, currency=self.base, amount=Decimal(1))
+
+
+class BalanceUniqueMigrationTestCase(MigrationTestCase):
+    migrate_from = '0012_trade_tape_indexes'
+
+    def test_duplicate_balances_are_merged(self):
+        User = self.apps.get_model('auth', 'User')
+        Currency = self.apps.get_model('sleight', 'Currency')
+        OldBalance = self.apps.get_model('sleight', 'Balance')
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        btc = Currency.objects.create(name='Bitcoin', code='BTC')
+        ppc = Currency.objects.create(name='Peercoin', code='PPC')
+        first = OldBalance.objects.create(user=alice, currency=btc, amount=Decimal(1))
+        OldBalance.objects.create(user=alice, currency=btc, amount=Decimal(2))
+        OldBalance.objects.create(user=alice, currency=btc, amount=Decimal('0.5'))
+        OldBalance.objects.create(user=alice, currency=ppc, amount=Decimal(4))
+        OldBalance.objects.create(user=bob, currency=btc, amount=Decimal(8))
+
+        self.migrate('0013_balance_unique')
+        self.assertEqual(
+            sorted(Balance.objects.values_list('id', 'user_id', 'currency_id', 'amount')),
+            sorted([
+                (first.id, alice.id, btc.id, Decimal('3.5')),
+                (first.id + 3, alice.id, ppc.id, Decimal(4)),
+                (first.id + 4, bob.id, btc.id, Decimal(8)),
+            ])
+        )
+        with self.assertRaises(IntegrityError):
+            Balance.objects.create(user_id=bob.id, currency_id=btc.id, amount=Decimal(1))
@@ -0,0 +1,108 @@
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from sleight.engine.book import get_book
+from sleight.engine.ticker import WINDOW_SECONDS, Ticker, load_ticker, publish_ticker, \
+    read_ticker
+from sleight.tests.base import EngineTestCase
+
+# the start of a minute
+NOW = 1500000000 - 1500000000 % 60
+
+
+class TickerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.ticker = Ticker(1)
+
+    def test_trades_are_summed_into_minute_buckets(self):
+        self.ticker.add_trade(NOW + 1, Decimal(2), Decimal(1))
+        self.ticker.add_trade(NOW + 59, Decimal(3), Decimal(2))
+        self.ticker.add_trade(NOW + 61, Decimal(1), Decimal(1))
+        self.assertEqual(
+            list(self.ticker.buckets),
+            [[NOW, 3, 2, 8, 3], [NOW + 60, 1, 1, 1, 1]]
+        )
+        self.assertEqual(self.ticker.last_price, 1)
+        self.assertEqual(self.ticker.base_volume, 9)
+        self.assertEqual(self.ticker.relative_volume, 4)
+
+    def test_late_trade_joins_the_latest_bucket(self):
+        self.ticker.add_trade(NOW + 61, Decimal(1), Decimal(1))
+        self.ticker.add_trade(NOW + 1, Decimal(4), Decimal(1))
+        self.assertEqual(list(self.ticker.buckets), [[NOW + 60, 4, 1, 5, 2]])
+
+    def test_buckets_leaving_the_window_expire(self):
+        self.assertIsNone(self.ticker.expires())
+        self.ticker.add_trade(NOW, Decimal(2), Decimal(1))
+        self.ticker.add_trade(NOW + 120, Decimal(3), Decimal(1))
+        self.assertEqual(self.ticker.expires(), NOW + WINDOW_SECONDS)
+        self.ticker.expire(NOW + WINDOW_SECONDS - 1)
+        self.assertEqual(len(self.ticker.buckets), 2)
+        self.ticker.expire(NOW + WINDOW_SECONDS)
+        self.assertEqual(list(self.ticker.buckets), [[NOW + 120, 3, 3, 3, 1]])
+        self.assertEqual(self.ticker.base_volume, 3)
+        self.assertEqual(self.ticker.relative_volume, 1)
+        self.assertEqual(self.ticker.expires(), NOW + 120 + WINDOW_SECONDS)
+        # the last price outlives the window
+        self.ticker.expire(NOW + 120 + WINDOW_SECONDS)
+        self.assertEqual(self.ticker.base_volume, 0)
+        self.assertEqual(self.ticker.last_price, 3)
+
+
+class PublishedTickerTestCase(EngineTestCase):
+
+    def test_quiet_pair_has_zero_high_and_low(self):
+        self.assertEqual(read_ticker(self.pair.id)['24_hour_high'], '0.0000000000')
+        get_book(self.pair.id)
+        ticker = read_ticker(self.pair.id)
+        self.assertEqual(ticker['24_hour_high'], '0.0000000000')
+        self.assertEqual(ticker['24_hour_low'], '0.0000000000')
+        self.assertEqual(ticker['base_volume'], '0.0000000000')
+
+    def test_stale_summary_is_worked_out_again_from_the_buckets(self):
+        book = get_book(self.pair.id)
+        book.ticker.add_trade(NOW, Decimal(2), Decimal(1))
+        book.ticker.add_trade(NOW + 120, Decimal(3), Decimal(1))
+        with mock.patch('sleight.engine.ticker.time.time', return_value=NOW + 180):
+            publish_ticker(book, traded=True)
+            ticker = read_ticker(self.pair.id)
+        self.assertEqual(ticker['24_hour_high'], '3.0000000000')
+        self.assertEqual(ticker['24_hour_low'], '2.0000000000')
+        self.assertEqual(ticker['base_volume'], '5.0000000000')
+        self.assertNotIn('expires', ticker)
+
+        # nothing has traded since, so only reading it notices the first bucket has gone
+        with mock.patch(
+                'sleight.engine.ticker.time.time',
+                return_value=NOW + WINDOW_SECONDS + 1
+        ):
+            ticker = read_ticker(self.pair.id)
+        self.assertEqual(ticker['24_hour_high'], '3.0000000000')
+        self.assertEqual(ticker['24_hour_low'], '3.0000000000')
+        self.assertEqual(ticker['base_volume'], '3.0000000000')
+        self.assertEqual(ticker['relative_volume'], '1.0000000000')
+        self.assertEqual(ticker['last_trade_price'], '3.0000000000')
+
+    def test_load_ticker_reads_the_last_day_of_trades(self):
+        ask = self.create_order(self.alice, 'ask', '1', '3')
+        bid = self.create_order(self.bob, 'bid', '4', '3')
+        now = timezone.now()
+        for hours, price in ((30, '1'), (2, '2'), (1, '4')):
+            self.create_trade(bid, ask, '1', price, now - datetime.timedelta(hours=hours))
+        ticker = load_ticker(self.pair.id)
+        self.assertEqual([bucket[1] for bucket in ticker.buckets], [2, 4])
+        self.assertEqual(ticker.base_volume, 6)
+        self.assertEqual(ticker.last_price, 4)
+
+    def test_load_ticker_keeps_the_last_price_of_a_quiet_pair(self):
+        ask = self.create_order(self.alice, 'ask', '2', '1')
+        bid = self.create_order(self.bob, 'bid', '3', '1')
+        self.create_trade(bid, ask, '1', '2.5', timezone.now() - datetime.timedelta(days=3))
+        ticker = load_ticker(self.pair.id)
+        self.assertEqual(len(ticker.buckets), 0)
+        self.assertEqual(ticker.last_price, Decimal('2.5'))
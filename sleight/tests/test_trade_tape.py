@@ -0,0 +1,92 @@
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+
+from sleight.models import Trade
+from sleight.tests.base import MigrationTestCase
+
+backfill = import_module('sleight.migrations.0011_trade_tape_backfill')
+
+
+class TradeTapeBackfillMigrationTestCase(MigrationTestCase):
+    migrate_from = '0010_trade_tape'
+
+    def setUp(self):
+        super(TradeTapeBackfillMigrationTestCase, self).setUp()
+        User = self.apps.get_model('auth', 'User')
+        Currency = self.apps.get_model('sleight', 'Currency')
+        CurrencyPair = self.apps.get_model('sleight', 'CurrencyPair')
+        self.Order = self.apps.get_model('sleight', 'Order')
+        self.OldTrade = self.apps.get_model('sleight', 'Trade')
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.pair = CurrencyPair.objects.create(
+            base_currency=Currency.objects.create(name='Bitcoin', code='BTC'),
+            relative_currency=Currency.objects.create(name='NuBits', code='USNBT')
+        )
+
+    def create_order(self, user, order_type, price):
+        return self.Order.objects.create(
+            user=user,
+            pair=self.pair,
+            order_type=order_type,
+            price=Decimal(price),
+            amount=Decimal(0),
+            original_amount=Decimal(1),
+            state='complete'
+        )
+
+    def create_trade(self, initiating_order, existing_order, **columns):
+        return self.OldTrade.objects.create(
+            initiating_order=initiating_order,
+            existing_order=existing_order,
+            amount=Decimal(1),
+            partial=False,
+            **columns
+        )
+
+    def test_trades_are_filled_in_from_their_orders(self):
+        asks = [self.create_order(self.alice, 'ask', price) for price in ('2', '2.5')]
+        bid = self.create_order(self.bob, 'bid', '3')
+        trades = [self.create_trade(bid, ask) for ask in asks]
+        resting_bid = self.create_order(self.alice, 'bid', '1')
+        taken = self.create_trade(self.create_order(self.bob, 'ask', '1'), resting_bid)
+
+        # batches of one so picking up after each batch is covered
+        with mock.patch.object(backfill, 'BATCH_SIZE', 1):
+            self.migrate('0011_trade_tape_backfill')
+        self.assertEqual(
+            list(
+                Trade.objects.order_by('id').values_list(
+                    'id', 'pair_id', 'price', 'taker_side', 'initiating_user_id',
+                    'existing_user_id'
+                )
+            ),
+            [
+                (trades[0].id, self.pair.id, 2, 'bid', self.bob.id, self.alice.id),
+                (trades[1].id, self.pair.id, Decimal('2.5'), 'bid', self.bob.id, self.alice.id),
+                (taken.id, self.pair.id, 1, 'ask', self.bob.id, self.alice.id),
+            ]
+        )
+
+    def test_trades_already_filled_in_are_left_alone(self):
+        ask = self.create_order(self.alice, 'ask', '2')
+        bid = self.create_order(self.bob, 'bid', '3')
+        filled = self.create_trade(
+            bid,
+            ask,
+            pair=self.pair,
+            price=Decimal(9),
+            taker_side='ask',
+            initiating_user=self.alice,
+            existing_user=self.bob
+        )
+        self.migrate('0011_trade_tape_backfill')
+        self.assertEqual(
+            Trade.objects.values_list(
+                'price', 'taker_side', 'initiating_user_id', 'existing_user_id'
+            ).get(
+                id=filled.id
+            ),
+            (9, 'ask', self.alice.id, self.bob.id)
+        )
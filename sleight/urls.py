@@ -19,8 +19,8 @@ from django.views.decorators.csrf import csrf_exempt
 
 from sleight.views.exchange import index, exchange, register, graph
 from sleight.views.private_api import GetBalances, PlaceOrder, GetOrders, CancelOrder, \
-    GetTrades
-from sleight.views.public_api import GetOrderBook, GetTicker
+    GetTrades, GetOrder, PlaceOrders, CancelOrders, CancelAll, ExportOrders, ExportTrades
+from sleight.views.public_api import GetOrderBook, GetTicker, GetCandles, GetRecentTrades
 
 urlpatterns = [
     # admin site
@@ -34,15 +34,21 @@ urlpatterns = [
 
     # front end exchange
     url(r'^$', index, name='index'),
-    url(r'^graph$', graph),
+    url(r'^graph/(?P<base_currency>\w+)/(?P<relative_currency>\w+)$', graph),
     url(r'^exchange/(?P<base_currency>\w+)/(?P<relative_currency>\w+)$', exchange),
 
     # private api
     url(r'^get_balances$', csrf_exempt(GetBalances.as_view())),
     url(r'^place_order$', csrf_exempt(PlaceOrder.as_view())),
+    url(r'^place_orders$', csrf_exempt(PlaceOrders.as_view())),
     url(r'^get_orders$', csrf_exempt(GetOrders.as_view())),
+    url(r'^get_order$', csrf_exempt(GetOrder.as_view())),
     url(r'^cancel_order$', csrf_exempt(CancelOrder.as_view())),
+    url(r'^cancel_orders$', csrf_exempt(CancelOrders.as_view())),
+    url(r'^cancel_all$', csrf_exempt(CancelAll.as_view())),
     url(r'^get_trades$', csrf_exempt(GetTrades.as_view())),
+    url(r'^export_orders$', csrf_exempt(ExportOrders.as_view())),
+    url(r'^export_trades$', csrf_exempt(ExportTrades.as_view())),
 
     # public api
     url(
@@ -53,5 +59,13 @@ urlpatterns = [
         r'^get_ticker/(?P<base_currency>\w+)/(?P<relative_currency>\w+)$',
         csrf_exempt(GetTicker.as_view())
     ),
+    url(
+        r'^get_candles/(?P<base_currency>\w+)/(?P<relative_currency>\w+)$',
+        csrf_exempt(GetCandles.as_view())
+    ),
+    url(
+        r'^get_trades/(?P<base_currency>\w+)/(?P<relative_currency>\w+)$',
+        csrf_exempt(GetRecentTrades.as_view())
+    ),
 
 ]
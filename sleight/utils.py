@@ -1,54 +1,354 @@
 import codecs
 import hashlib
 import hmac
+import json
+import time
+from collections import OrderedDict
+from decimal import Decimal
 
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import connection
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 
-from sleight.models import CurrencyPair, Profile
+from sleight.models import NONCE_BITMAP_FULL, NONCE_BITS, Currency, CurrencyPair, Profile
+
+_redis = None
+
+# prices and amounts are kept to ten decimal places
+_places = Decimal('0.0000000001')
+
+
+def format_decimal(value):
+    """
+    a price or amount as a string to ten decimal places, anything that isn't a
+    Decimal, such as None, is returned as it is
+    """
+    return '{:f}'.format(value.quantize(_places)) if isinstance(value, Decimal) else value
+
+
+def get_redis():
+    """
+    a client for the redis instance the channel layer runs on.
+    the connection pool is shared by everything in the process
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.StrictRedis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+PAIRS_VERSION_KEY = 'sleight:pairs:version'
+_pairs = None
+
+
+def _load_pairs():
+    """
+    Every pair, with its currencies, by lowercase currency codes e.g. ('btc', 'usnbt')
+    and by id. They are loaded once per process and reloaded after a currency or pair
+    is saved or deleted in any process, which bumps the version kept in redis. The
+    version is checked at most every settings.PAIRS_CHECK_SECONDS so a request that
+    looks up several pairs only pays for one round trip.
+    The pairs are shared so treat them as read only
+    """
+    global _pairs
+    now = time.monotonic()
+    if _pairs is not None and now < _pairs[1] + settings.PAIRS_CHECK_SECONDS:
+        return _pairs[2], _pairs[3]
+    version = get_redis().get(PAIRS_VERSION_KEY)
+    if _pairs is not None and _pairs[0] == version:
+        _pairs = (version, now, _pairs[2], _pairs[3])
+        return _pairs[2], _pairs[3]
+    if 'sleight_currencypair' not in connection.introspection.table_names():
+        return OrderedDict(), {}
+    pairs = OrderedDict(
+        ((pair.base_currency.code.lower(), pair.relative_currency.code.lower()), pair)
+        for pair in CurrencyPair.objects.select_related(
+            'base_currency',
+            'relative_currency'
+        ).order_by(
+            'id'
+        )
+    )
+    pairs_by_id = {pair.id: pair for pair in pairs.values()}
+    _pairs = (version, now, pairs, pairs_by_id)
+    return pairs, pairs_by_id
+
+
+def get_pairs():
+    """
+    every pair by lowercase currency codes, in the order they were added
+    """
+    return _load_pairs()[0]
+
+
+def find_pair(base_currency, relative_currency):
+    """
+    the pair with the given currency codes or None
+    """
+    return get_pairs().get((base_currency.lower(), relative_currency.lower()))
+
+
+def get_pair(pair_id):
+    """
+    the pair with the given id or None
+    """
+    return _load_pairs()[1].get(pair_id)
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+@receiver(post_save, sender=CurrencyPair)
+@receiver(post_delete, sender=CurrencyPair)
+def forget_pairs(sender, **kwargs):
+    transaction.on_commit(_bump_pairs_version)
+
+
+def _bump_pairs_version():
+    # this process sees the change straight away, the others within
+    # settings.PAIRS_CHECK_SECONDS
+    global _pairs
+    _pairs = None
+    get_redis().incr(PAIRS_VERSION_KEY)
 
 
 def get_all_pairs():
     pair_list = []
-    if 'sleight_currencypair' not in connection.introspection.table_names():
-        return pair_list
-    pairs = CurrencyPair.objects.select_related(
-        'base_currency',
-        'relative_currency'
-    ).all()
-    for pair in pairs:
+    for pair in get_pairs().values():
         this_pair = '{}/{}'.format(pair.base_currency.code, pair.relative_currency.code)
         pair_list.append((this_pair.lower(), this_pair))
     return pair_list
 
 
+def get_matching_channel(pair):
+    """
+    the channel a pair's orders are matched on
+    """
+    return 'check_trades.{}-{}'.format(
+        pair.base_currency.code.lower(),
+        pair.relative_currency.code.lower()
+    )
+
+
+def get_pair_name(pair):
+    """
+    the name a pair goes by in the api, e.g. btc/usnbt
+    """
+    return '{}/{}'.format(
+        pair.base_currency.code.lower(),
+        pair.relative_currency.code.lower()
+    )
+
+
+def get_pair_names():
+    """
+    the api name of every pair by id. look them up once for a response with many rows
+    """
+    return {pair.id: get_pair_name(pair) for pair in get_pairs().values()}
+
+
+def get_pair_group(prefix, pair):
+    """
+    the group following one of a pair's websocket feeds, e.g. ws-btc-usnbt
+    """
+    return '{}-{}-{}'.format(
+        prefix,
+        pair.base_currency.code.lower(),
+        pair.relative_currency.code.lower()
+    )
+
+
+def book_version_key(base_currency, relative_currency):
+    return 'sleight:book:{}-{}:version'.format(
+        base_currency.lower(),
+        relative_currency.lower()
+    )
+
+
+def get_book_version(base_currency, relative_currency):
+    """
+    the number of times the pair's book has changed.
+    it is kept by currency codes so it can be read without looking up the pair
+    """
+    version = get_redis().get(book_version_key(base_currency, relative_currency))
+    return int(version) if version is not None else 0
+
+
+def bump_book_version(pair, client=None):
+    """
+    record a change to the pair's book so cached copies of it are refreshed.
+    pass a redis pipeline as client to bump it along with other writes
+    """
+    (client or get_redis()).incr(
+        book_version_key(pair.base_currency.code, pair.relative_currency.code)
+    )
+
+
+def get_matching_channels():
+    return [get_matching_channel(pair) for pair in get_pairs().values()]
+
+
+def _credentials_key(api_key):
+    return 'sleight:credentials:{}'.format(api_key)
+
+
+def get_credentials(api_key):
+    """
+    The profile and user ids, username and api_secret for an api_key, or None if
+    the key isn't valid. Cached for settings.API_KEY_CACHE_SECONDS and dropped
+    whenever the profile or its user changes
+    """
+    redis = get_redis()
+    cache_key = _credentials_key(api_key)
+    credentials = redis.get(cache_key)
+    if credentials is not None:
+        return json.loads(credentials.decode('utf-8'))
+    credentials = Profile.objects.filter(
+        api_key=api_key
+    ).values(
+        'id',
+        'api_secret',
+        'nonce_window',
+        'user_id',
+        'user__username'
+    ).first()
+    if credentials is None:
+        return None
+    credentials['api_secret'] = '{}'.format(credentials['api_secret'])
+    redis.setex(cache_key, settings.API_KEY_CACHE_SECONDS, json.dumps(credentials))
+    return credentials
+
+
+def forget_credentials(*api_keys):
+    """
+    drop the cached credentials once the change to them is committed so a request
+    in between can't cache them again as they were
+    """
+    keys = [_credentials_key(api_key) for api_key in api_keys if api_key]
+    if keys:
+        transaction.on_commit(lambda: get_redis().delete(*keys))
+
+
+@receiver(pre_save, sender=Profile)
+def forget_replaced_credentials(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    forget_credentials(
+        *Profile.objects.filter(pk=instance.pk).values_list('api_key', flat=True)
+    )
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def forget_profile_credentials(sender, instance, **kwargs):
+    forget_credentials(instance.api_key)
+
+
+@receiver(post_save, sender=User)
+def forget_user_credentials(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    forget_credentials(
+        *Profile.objects.filter(user=instance).values_list('api_key', flat=True)
+    )
+
+
+def use_nonce(profile_id, window, nonce):
+    """
+    Record a nonce as used by the profile. Returns why it can't be used, if it can't.
+    Without a window the nonce must be bigger than the last one. With one, nonces
+    less than window below the highest are accepted once each so requests can be
+    sent in parallel
+    """
+    if not window:
+        # the conditional update means two requests can't both use the same nonce
+        if Profile.objects.filter(
+            pk=profile_id,
+            nonce__lt=nonce
+        ).update(
+            nonce=nonce,
+            nonce_bitmap=NONCE_BITMAP_FULL
+        ):
+            return None
+        last_nonce = Profile.objects.filter(
+            pk=profile_id
+        ).values_list(
+            'nonce',
+            flat=True
+        ).first()
+        return 'nonce needs to be greater than {}'.format(last_nonce)
+
+    for attempt in range(settings.NONCE_ATTEMPTS):
+        last_nonce, bitmap = Profile.objects.filter(
+            pk=profile_id
+        ).values_list(
+            'nonce',
+            'nonce_bitmap'
+        ).first()
+        if nonce > last_nonce:
+            # move the window up. the nonces skipped over haven't been used
+            shift = nonce - last_nonce
+            new_nonce = nonce
+            new_bitmap = 1
+            if shift < NONCE_BITS:
+                new_bitmap |= (bitmap << shift) & NONCE_BITMAP_FULL
+        elif last_nonce - nonce < window:
+            bit = 1 << (last_nonce - nonce)
+            if bitmap & bit:
+                return 'nonce {} has already been used'.format(nonce)
+            new_nonce = last_nonce
+            new_bitmap = bitmap | bit
+        else:
+            return 'nonce needs to be greater than {}'.format(last_nonce - window)
+        # only save it if no other request has used a nonce since we looked
+        if Profile.objects.filter(
+            pk=profile_id,
+            nonce=last_nonce,
+            nonce_bitmap=bitmap
+        ).update(
+            nonce=new_nonce,
+            nonce_bitmap=new_bitmap
+        ):
+            return None
+    return 'too many requests at once for nonce {}, try again'.format(nonce)
+
+
 def ensure_valid(data):
     """
     make sure the api_key returns a valid profile
-    ensure the nonce is bigger then the previous nonce
     ensure the hash of the nonce is valid given the users api_secret
+    ensure the nonce hasn't been used before
     """
     # ensure api_key is valid
-    try:
-        profile = Profile.objects.select_related('user').get(api_key=data['api_key'])
-    except ObjectDoesNotExist:
+    credentials = get_credentials(data['api_key'])
+    if credentials is None:
         return False, {'api_key': ['api_key not valid']}
 
-    # ensure nonce is bigger than previous
-    if profile.nonce >= data['nonce']:
-        return False, {
-            'nonce': ['nonce needs to be greater than {}'.format(profile.nonce)]
-        }
-    # save the nonce for the next request
-    profile.nonce = data['nonce']
-    profile.save()
-
     # ensure the secret hash of the nonce is correct
     calculated_hash = hmac.new(
-        '{}'.format(profile.api_secret).encode('utf-8'),
+        credentials['api_secret'].encode('utf-8'),
         '{}'.format(data['nonce']).encode('utf-8'),
         hashlib.sha256
     ).hexdigest()
-    if calculated_hash != data['nonce_hash']:
+    if not hmac.compare_digest(
+        calculated_hash.encode('utf-8'),
+        data['nonce_hash'].encode('utf-8')
+    ):
         return False, {'nonce_hash': ['nonce_hash is incorrect']}
+
+    # ensure the nonce hasn't been used and save it for the next request
+    error = use_nonce(credentials['id'], credentials.get('nonce_window'), data['nonce'])
+    if error:
+        return False, {'nonce': [error]}
+
+    user = User(id=credentials['user_id'], username=credentials['user__username'])
+    profile = Profile(
+        id=credentials['id'],
+        user=user,
+        api_key=data['api_key'],
+        api_secret=credentials['api_secret'],
+        nonce=data['nonce']
+    )
     return profile, ''
@@ -1,11 +1,20 @@
+import datetime
+import json
 from decimal import Decimal
+from itertools import accumulate
 
+from django.http import Http404
+from django.db.models import Q, Sum
 from django.http.response import JsonResponse
-from django.shortcuts import render, get_object_or_404
+from django.shortcuts import render
+from django.utils import timezone
 from graphos.renderers.gchart import LineChart
 from graphos.sources.model import ModelDataSource
 
-from sleight.models import CurrencyPair, Order, Trade, Balance
+from sleight.engine.recent_trades import read_recent_trades
+from sleight.forms import DepthChartForm
+from sleight.models import Order, Balance
+from sleight.utils import find_pair
 
 
 def index(request):
@@ -17,17 +26,11 @@ def exchange(request, base_currency, relative_currency):
     simple view to show orders on a pair
     """
     # get the pair
-    pair = get_object_or_404(
-        CurrencyPair,
-        base_currency__code__iexact=base_currency,
-        relative_currency__code__iexact=relative_currency
-    )
+    pair = find_pair(base_currency, relative_currency)
+    if pair is None:
+        raise Http404('pair not found')
     # get bid orders
-    bid_orders = Order.objects.exclude(
-        state='closed'
-    ).exclude(
-        state='cancelled'
-    ).exclude(
+    bid_orders = Order.objects.resting().exclude(
         amount=0
     ).filter(
         order_type='bid',
@@ -36,11 +39,7 @@ def exchange(request, base_currency, relative_currency):
         '-price',
     )
     # get ask orders
-    ask_orders = Order.objects.exclude(
-        state='closed'
-    ).exclude(
-        state='cancelled'
-    ).exclude(
+    ask_orders = Order.objects.resting().exclude(
         amount=0
     ).filter(
         order_type='ask',
@@ -48,15 +47,16 @@ def exchange(request, base_currency, relative_currency):
     ).order_by(
         'price',
     )
-    # get trades
-    trades = Trade.objects.select_related(
-        'initiating_order',
-        'existing_order'
-    ).order_by(
-        '-time'
-    ).filter(
-        initiating_order__pair=pair,
-    )[:150]
+    # get the trades the matcher keeps for the pair
+    trades = [
+        dict(
+            trade,
+            time=datetime.datetime.fromtimestamp(trade['time'], tz=timezone.utc),
+            price=Decimal(trade['price']),
+            amount=Decimal(trade['amount'])
+        )
+        for trade in read_recent_trades(pair.id)
+    ]
     # get user balances
     if request.user.is_authenticated:
         base_balance, _ = Balance.objects.get_or_create(
@@ -86,31 +86,69 @@ def register(request):
     return JsonResponse({'yup': True})
 
 
-def graph(request):
-    orders = Order.objects.exclude(
-        state='cancelled'
-    ).exclude(
-        state='complete'
+def depth_chart(pair, min_price=None, max_price=None):
+    """
+    Rows of [price, ask depth, bid depth] for the pair's book, lowest price first.
+    Depth is the total amount on offer at that price or better, so bids add up from
+    the highest price down and asks from the lowest up.
+    min_price and max_price clip the chart. Bids priced above max_price and asks
+    priced below min_price still count towards the depth inside it
+    """
+    bid_filter = Q(order_type='bid')
+    ask_filter = Q(order_type='ask')
+    if min_price is not None:
+        bid_filter &= Q(price__gte=min_price)
+    if max_price is not None:
+        ask_filter &= Q(price__lte=max_price)
+    levels = Order.objects.resting().filter(
+        pair=pair
+    ).filter(
+        bid_filter | ask_filter
+    ).values(
+        'order_type',
+        'price'
+    ).annotate(
+        amount=Sum('amount')
     ).order_by(
         'price'
     )
+    bids = [level for level in levels if level['order_type'] == 'bid']
+    asks = [level for level in levels if level['order_type'] == 'ask']
+    bids.reverse()
+
+    rows = [
+        (level['price'], None, depth)
+        for level, depth in zip(bids, accumulate(level['amount'] for level in bids))
+    ]
+    rows.reverse()
+    rows.extend(
+        (level['price'], depth, None)
+        for level, depth in zip(asks, accumulate(level['amount'] for level in asks))
+    )
+    return [
+        [float(value) if value is not None else None for value in row]
+        for row in rows
+        if (min_price is None or row[0] >= min_price) and
+        (max_price is None or row[0] <= max_price)
+    ]
 
-    prices = sorted(list(set(list(
-        float(order.price) for order in orders
-    ))))
 
-    order_totals = []
-    for price in prices:
-        this_total = {'ask': 0, 'bid': 0, 'price': price}
-        for order in orders:
-            if order.price == price:
-                this_total[order.order_type] += order.amount
-        order_totals.append(this_total)
+def graph(request, base_currency, relative_currency):
+    """
+    the depth chart for a pair.
+    optional GET parameters min_price and max_price clip it to a range of prices
+    """
+    pair = find_pair(base_currency, relative_currency)
+    if pair is None:
+        raise Http404('pair not found')
+    form = DepthChartForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'message': form.errors})
 
     context = {
-        'orders': list(
-            [float(total['price']), float(total['ask']), float(total['bid'])]
-            for total in order_totals
+        'pair': pair,
+        'orders': json.dumps(
+            depth_chart(pair, form.cleaned_data['min_price'], form.cleaned_data['max_price'])
         )
     }
     return render(request, 'chart.html', context)
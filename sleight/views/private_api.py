@@ -1,17 +1,266 @@
+import csv
+import datetime
 import json
+from collections import OrderedDict, defaultdict
 
 from channels import Channel
 from decimal import Decimal
 
 from channels import Group
 from django.core.exceptions import ObjectDoesNotExist
-from django.http.response import JsonResponse
+from django.db import connection, transaction
+from django.db.models import CharField, F, Q, Value
+from django.http.response import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.views.generic import View
 
+from sleight.consumers.notifier import Notifier, user_balances_group, user_orders_group
 from sleight.forms import GetBalanceForm, PlaceOrderForm, GetOrdersForm, CancelOrderForm, \
-    GetTradesForm
-from sleight.models import Balance, CurrencyPair, Order, Trade
-from sleight.utils import ensure_valid
+    GetTradesForm, GetOrderForm, PlaceOrdersForm, CancelOrdersForm, CancelAllForm, \
+    ExportOrdersForm, ExportTradesForm
+from sleight.models import Balance, Order, Trade
+from sleight.utils import bump_book_version, ensure_valid, find_pair, get_matching_channel, \
+    get_pair, get_pair_group, get_pair_name, get_pair_names
+
+# the number of orders or trades returned when no limit is given
+DEFAULT_PAGE = 100
+
+
+ORDER_FIELDS = (
+    'id',
+    'state',
+    'amount',
+    'original_amount',
+    'price',
+    'order_type',
+    'pair_id',
+    'time'
+)
+
+
+def order_values(order, pair_names):
+    """
+    an order as returned by the api, from a row of its ORDER_FIELDS.
+    pair_names is from get_pair_names
+    """
+    return {
+        'id': order['id'],
+        'state': order['state'],
+        'amount': float(str(order['amount'])),
+        'original_amount': float(str(order['original_amount'])),
+        'price': float(str(order['price'])),
+        'order_type': order['order_type'],
+        'pair': pair_names[order['pair_id']],
+        'time': order['time'].timestamp(),
+    }
+
+
+def matching_message(order, pair, user):
+    """
+    the message that has the matching engine put a new order on the pair's book
+    """
+    return {
+        'action': 'place',
+        'order_id': order.id,
+        'pair_id': pair.id,
+        'base_currency': pair.base_currency.code.lower(),
+        'relative_currency': pair.relative_currency.code.lower(),
+        'user_id': user.id,
+        'order_type': order.order_type,
+        'price': str(order.price),
+        'amount': str(order.amount),
+    }
+
+
+def reserved_currency(order_type, pair):
+    """
+    the currency an order holds back. bids pay with the base currency
+    """
+    return pair.relative_currency if order_type == 'ask' else pair.base_currency
+
+
+def reserved_amount(order_type, amount, price):
+    return amount if order_type == 'ask' else amount * price
+
+
+def notify_balances(notifier, user, currencies):
+    """
+    queue the user's current balance of each of the currencies for the websockets
+    """
+    for currency_id, amount in Balance.objects.filter(
+        user=user,
+        currency__in=currencies
+    ).values_list(
+        'currency_id',
+        'amount'
+    ):
+        notifier.balance(user.id, {
+            'message_type': 'balance',
+            'channel': 'balances',
+            'balance': str(amount),
+            'currency': currencies[currency_id].code.lower()
+        })
+
+
+def cancel_orders(user, orders):
+    """
+    Cancel the user's open orders among those in the queryset and refund what they
+    held back. The orders are locked until the refunds are written so a trade can't
+    settle against them in between. The matching engines are told with one message
+    per pair and see the cancellations when they settle.
+    returns the ids of the orders cancelled
+    """
+    with transaction.atomic():
+        cancelled = list(
+            orders.resting().select_for_update().filter(
+                user=user
+            ).order_by(
+                'id'
+            ).values(
+                'id',
+                'pair_id',
+                'order_type',
+                'amount',
+                'price'
+            )
+        )
+        if not cancelled:
+            return []
+        Order.objects.filter(
+            id__in=[order['id'] for order in cancelled]
+        ).update(
+            state='cancelled'
+        )
+        # return the order amounts to the user
+        currencies = {}
+        refunds = defaultdict(Decimal)
+        for order in cancelled:
+            currency = reserved_currency(order['order_type'], get_pair(order['pair_id']))
+            currencies[currency.id] = currency
+            refunds[currency.id] += reserved_amount(
+                order['order_type'],
+                order['amount'],
+                order['price']
+            )
+        for currency_id, refund in refunds.items():
+            Balance.objects.filter(
+                user=user,
+                currency_id=currency_id
+            ).update(
+                amount=F('amount') + refund
+            )
+
+    # take the orders off the books and the front end
+    notifier = Notifier()
+    pair_orders = OrderedDict()
+    for order in cancelled:
+        pair = get_pair(order['pair_id'])
+        pair_orders.setdefault(pair, []).append(order['id'])
+        notifier.order(get_pair_group('ws', pair), {
+            'message_type': 'order',
+            'order_id': order['id'],
+            'pair': get_pair_name(pair),
+            'state': 'cancelled',
+        }, user_id=user.id)
+    for pair, order_ids in pair_orders.items():
+        bump_book_version(pair)
+        Channel(get_matching_channel(pair)).send(
+            {
+                'action': 'cancel_batch',
+                'order_ids': order_ids,
+                'pair_id': pair.id,
+            }
+        )
+    notify_balances(notifier, user, currencies)
+    notifier.flush()
+    return [order['id'] for order in cancelled]
+
+
+def user_orders(user, data):
+    """
+    the user's orders narrowed down by the cleaned data of a HistoryForm
+    with a state, oldest first, as rows of their ORDER_FIELDS
+    """
+    orders = page_filter(Order.objects.filter(user=user), data, 'pair')
+    if data['state']:
+        orders = orders.filter(state=data['state'])
+    return orders.order_by('id').values(*ORDER_FIELDS)
+
+
+def user_trades(user, data):
+    """
+    The user's trades after since_id on the pair and between the times in the cleaned
+    data of a HistoryForm, oldest first. There is a row for each of the user's orders
+    a trade filled with the id, type and role of that order
+    """
+    # each side has its own index on the trade's user
+    sides = []
+    for side, role in (('initiating', 'taker'), ('existing', 'maker')):
+        sides.append(
+            page_filter(
+                Trade.objects.filter(**{side + '_user': user}),
+                data,
+                'pair'
+            ).values(
+                'id',
+                'time',
+                'amount',
+                'partial',
+                'initiating_order_id',
+                'existing_order_id',
+                'pair_id',
+                'price',
+                'taker_side',
+                order_id=F(side + '_order_id'),
+                role=Value(role, output_field=CharField()),
+            )
+        )
+    return sides[0].union(sides[1], all=True).order_by('id', 'role')
+
+
+def trade_values(trade, pair_names):
+    """
+    a trade as returned by the api, from a row of user_trades.
+    pair_names is from get_pair_names
+    """
+    return {
+        'id': trade['id'],
+        'order_id': trade['order_id'],
+        'order_type': (
+            trade['taker_side']
+            if trade['role'] == 'taker' else
+            ('ask' if trade['taker_side'] == 'bid' else 'bid')
+        ),
+        'role': trade['role'],
+        'initiating_order': trade['initiating_order_id'],
+        'existing_order': trade['existing_order_id'],
+        'pair': pair_names[trade['pair_id']],
+        'time': trade['time'].timestamp(),
+        'amount': float(str(trade['amount'])),
+        'price': float(str(trade['price'])),
+        'partial': trade['partial']
+    }
+
+
+def page_filter(queryset, data, pair_field):
+    """
+    narrow down a user's orders or trades to those after since_id on the pair
+    and between the times in the cleaned data of a HistoryForm
+    """
+    if data['since_id'] is not None:
+        queryset = queryset.filter(id__gt=data['since_id'])
+    if data['pair']:
+        base_currency, relative_currency = data['pair'].split('/')
+        queryset = queryset.filter(**{pair_field: find_pair(base_currency, relative_currency)})
+    if data['start'] is not None:
+        queryset = queryset.filter(
+            time__gte=datetime.datetime.fromtimestamp(data['start'], tz=timezone.utc)
+        )
+    if data['end'] is not None:
+        queryset = queryset.filter(
+            time__lte=datetime.datetime.fromtimestamp(data['end'], tz=timezone.utc)
+        )
+    return queryset
 
 
 class GetBalances(View):
@@ -81,23 +330,20 @@ class PlaceOrder(View):
 
             # parse out the pair
             form_pair = form.cleaned_data['pair'].split('/')
-            pair = CurrencyPair.objects.select_related(
-                'base_currency',
-                'relative_currency'
-            ).get(
-                base_currency__code__iexact=form_pair[0],
-                relative_currency__code__iexact=form_pair[1]
-            )
+            pair = find_pair(form_pair[0], form_pair[1])
 
             # check the user has available funds
+            currency = (
+                pair.relative_currency
+                if form.cleaned_data['order_type'] == 'ask' else
+                pair.base_currency
+            )
             balance, created = Balance.objects.get_or_create(
                 user=profile.user,
-                currency=(
-                    pair.relative_currency
-                    if form.cleaned_data['order_type'] == 'ask' else
-                    pair.base_currency
-                )
+                currency=currency
             )
+            # the pair's currency is already loaded
+            balance.currency = currency
             if created:
                 balance.amount = Decimal(0)
                 balance.save()
@@ -138,8 +384,16 @@ class PlaceOrder(View):
                     }
                 )
 
-            # check available balance
-            if balance.amount == Decimal(0.0) or balance.amount < order_amount:
+            # reserve the order amount if the balance covers it.
+            # the update is conditional and relative to the stored amount so trades
+            # settling against the same balance at the same time aren't lost
+            reserved = Balance.objects.filter(
+                pk=balance.pk,
+                amount__gte=order_amount
+            ).update(
+                amount=F('amount') - order_amount
+            )
+            if not reserved:
                 return JsonResponse(
                     {
                         'success': False,
@@ -156,15 +410,14 @@ class PlaceOrder(View):
                     }
                 )
 
-            # user has balance. reduce it by the amount of the order
-            balance.amount -= order_amount
-            balance.save()
+            balance.refresh_from_db(fields=['amount'])
             # update the balance through the channels websocket
-            Group(profile.user.username).send(
+            Group(user_balances_group(profile.user.id)).send(
                 {
                     'text': json.dumps(
                         {
                             'message_type': 'balance',
+                            'channel': 'balances',
                             'balance': str(balance.amount),
                             'currency': balance.currency.code.lower()
                         }
@@ -181,9 +434,12 @@ class PlaceOrder(View):
                 price=form.cleaned_data['price'],
                 state='open'
             )
+            bump_book_version(pair)
             # order is placed.
-            # Use channels to check for potential trades
-            Channel('check_trades').send({'order_id': order.id})
+            # Use the pair's channel to add it to the book and check for potential trades
+            Channel(get_matching_channel(pair)).send(
+                matching_message(order, pair, profile.user)
+            )
 
             return JsonResponse(
                 {
@@ -197,9 +453,136 @@ class PlaceOrder(View):
             return JsonResponse({'success': False, 'message': form.errors})
 
 
+class PlaceOrders(View):
+    """
+    Allow an authenticated user to place several orders at once.
+    Either every order is placed or, if the balances don't cover them all, none are
+    POST parameters
+        orders: a JSON list of up to 100 orders, each with the order_type, pair,
+                amount and price that place_order takes
+    the ids of the new orders are returned in the same order
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = PlaceOrdersForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            # add up what the orders hold back of each currency
+            orders = form.cleaned_data['orders']
+            currencies = OrderedDict()
+            reserve = defaultdict(Decimal)
+            for order in orders:
+                order['pair'] = find_pair(*order['pair'].split('/'))
+                currency = reserved_currency(order['order_type'], order['pair'])
+                currencies[currency.id] = currency
+                reserve[currency.id] += reserved_amount(
+                    order['order_type'],
+                    order['amount'],
+                    order['price']
+                )
+
+            with transaction.atomic():
+                # reserve the whole batch or nothing
+                for currency_id, currency in currencies.items():
+                    balance, created = Balance.objects.get_or_create(
+                        user=profile.user,
+                        currency=currency
+                    )
+                    if not Balance.objects.filter(
+                        pk=balance.pk,
+                        amount__gte=reserve[currency_id]
+                    ).update(
+                        amount=F('amount') - reserve[currency_id]
+                    ):
+                        transaction.set_rollback(True)
+                        return JsonResponse(
+                            {
+                                'success': False,
+                                'message': [
+                                    {
+                                        'balance': 'insufficient balance: {} {} < {} {}'.format(
+                                            float(balance.amount),
+                                            currency.code,
+                                            float(reserve[currency_id]),
+                                            currency.code,
+                                        )
+                                    }
+                                ]
+                            }
+                        )
+
+                placed = [
+                    Order(
+                        user=profile.user,
+                        order_type=order['order_type'],
+                        pair=order['pair'],
+                        original_amount=order['amount'],
+                        amount=order['amount'],
+                        price=order['price'],
+                        state='open'
+                    )
+                    for order in orders
+                ]
+                if connection.features.can_return_ids_from_bulk_insert:
+                    Order.objects.bulk_create(placed)
+                else:
+                    # the ids are needed for the matching engine
+                    for order in placed:
+                        order.save()
+
+            # update the balances through the channels websocket
+            notifier = Notifier()
+            notify_balances(notifier, profile.user, currencies)
+            notifier.flush()
+
+            # one message per pair has the matching engine add the orders to the book
+            pair_orders = OrderedDict()
+            for order in placed:
+                pair_orders.setdefault(order.pair, []).append(order)
+            for pair, pair_placed in pair_orders.items():
+                bump_book_version(pair)
+                Channel(get_matching_channel(pair)).send(
+                    {
+                        'action': 'place_batch',
+                        'pair_id': pair.id,
+                        'orders': [
+                            matching_message(order, pair, profile.user)
+                            for order in pair_placed
+                        ],
+                    }
+                )
+
+            return JsonResponse(
+                {
+                    'success': True,
+                    'message': {
+                        'order_ids': [order.id for order in placed]
+                    }
+                }
+            )
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
 class GetOrders(View):
     """
-    return all the orders for the authenticated user
+    return a page of the orders for the authenticated user, oldest first
+    optional POST parameters
+        since_id: only orders with a higher id. pass next_since_id to get the next page
+        limit: the most orders to return, up to 1000. defaults to 100
+        state: only orders in this state
+        pair: only orders on this pair
+        start, end: unix timestamps bounding the time the orders were placed
+    next_since_id is null once there are no more orders
     """
 
     @staticmethod
@@ -216,25 +599,109 @@ class GetOrders(View):
                 return JsonResponse({'success': False, 'message': message})
 
             # get the orders for the user
-            orders = Order.objects.select_related('pair').filter(user=profile.user)
+            limit = form.cleaned_data['limit'] or DEFAULT_PAGE
+            orders = list(user_orders(profile.user, form.cleaned_data)[:limit])
+            pair_names = get_pair_names()
             return JsonResponse(
                 {
                     'success': True,
                     'message': {
-                        'orders': [
+                        'orders': [order_values(order, pair_names) for order in orders],
+                        'next_since_id': orders[-1]['id'] if len(orders) == limit else None
+                    }
+                }
+            )
+
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
+class GetOrder(View):
+    """
+    return the state of some of the authenticated user's orders, with their fills
+    POST parameters
+        order_id: the order ids, repeated or comma separated. up to 1000 at once
+    ids that aren't the user's orders are listed in not_found
+    Sample response
+        "orders": [{
+            "id": 12,
+            "state": "partial",
+            "amount": 0.5,
+            "original_amount": 1.0,
+            "price": 0.00000035,
+            "order_type": "bid",
+            "pair": "btc/usnbt",
+            "time": 1475323200.125,
+            "fills": [{
+                "trade_id": 7,
+                "amount": 0.5,
+                "price": 0.00000034,
+                "time": 1475323260.5,
+                "role": "taker"
+            }]
+        }],
+        "not_found": []
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = GetOrderForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            # the orders and their trades are both found by primary or foreign key
+            order_ids = form.cleaned_data['order_id']
+            pair_names = get_pair_names()
+            orders = OrderedDict(
+                (order['id'], dict(order_values(order, pair_names), fills=[]))
+                for order in Order.objects.filter(
+                    id__in=order_ids,
+                    user=profile.user
+                ).order_by(
+                    'id'
+                ).values(
+                    *ORDER_FIELDS
+                )
+            )
+            trades = Trade.objects.filter(
+                Q(initiating_order_id__in=list(orders)) | Q(existing_order_id__in=list(orders))
+            ).order_by(
+                'id'
+            ).values(
+                'id',
+                'time',
+                'amount',
+                'initiating_order_id',
+                'existing_order_id',
+                'price'
+            ) if orders else []
+            sides = (('initiating_order_id', 'taker'), ('existing_order_id', 'maker'))
+            for trade in trades:
+                for side, role in sides:
+                    if trade[side] in orders:
+                        orders[trade[side]]['fills'].append(
                             {
-                                'id': order.id,
-                                'state': order.state,
-                                'amount': float(str(order.amount)),
-                                'original_amount': float(str(order.original_amount)),
-                                'price': float(str(order.price)),
-                                'order_type': order.order_type,
-                                'pair': '{}/{}'.format(
-                                    order.pair.base_currency.code.lower(),
-                                    order.pair.relative_currency.code.lower()
-                                ),
+                                'trade_id': trade['id'],
+                                'amount': float(str(trade['amount'])),
+                                'price': float(str(trade['price'])),
+                                'time': trade['time'].timestamp(),
+                                'role': role
                             }
-                            for order in orders
+                        )
+            return JsonResponse(
+                {
+                    'success': True,
+                    'message': {
+                        'orders': list(orders.values()),
+                        'not_found': [
+                            order_id for order_id in order_ids if order_id not in orders
                         ]
                     }
                 }
@@ -262,68 +729,82 @@ class CancelOrder(View):
             if not profile:
                 return JsonResponse({'success': False, 'message': message})
 
-            # get the order
-            try:
-                order = Order.objects.exclude(
-                    state='cancelled'
-                ).exclude(
-                    state='complete'
-                ).get(
-                    id=form.cleaned_data['order_id'],
-                    user=profile.user
-                )
-            except ObjectDoesNotExist:
-                return JsonResponse(
-                    {
-                        'success': False,
-                        'message': {
-                            'order_id': 'cannot cancel order {}'.format(
-                                form.cleaned_data['order_id']
-                            )
+            # get the order.
+            # it is locked until the refund is written so a trade can't settle against it
+            # in between. the matching engine sees the cancellation when it settles
+            with transaction.atomic():
+                try:
+                    order = Order.objects.resting().select_for_update().get(
+                        id=form.cleaned_data['order_id'],
+                        user=profile.user
+                    )
+                except ObjectDoesNotExist:
+                    return JsonResponse(
+                        {
+                            'success': False,
+                            'message': {
+                                'order_id': 'cannot cancel order {}'.format(
+                                    form.cleaned_data['order_id']
+                                )
+                            }
                         }
-                    }
+                    )
+                order.state = 'cancelled'
+                order.save(update_fields=['state'])
+                order.pair = get_pair(order.pair_id)
+
+                # return order amount to user
+                balance = Balance.objects.select_related(
+                    'currency'
+                ).get(
+                    user=profile.user,
+                    currency=(
+                        order.pair.relative_currency
+                        if order.order_type == 'ask' else
+                        order.pair.base_currency
+                    )
                 )
-            order.state = 'cancelled'
-            order.save()
-            # remove the order from the front end
-            Group(
-                'ws-{}-{}'.format(
-                    order.pair.base_currency.code.lower(),
-                    order.pair.relative_currency.code.lower()
+                Balance.objects.filter(
+                    pk=balance.pk
+                ).update(
+                    amount=F('amount') + (
+                        order.amount
+                        if order.order_type == 'ask' else
+                        (order.amount * order.price)
+                    )
                 )
-            ).send(
+                balance.refresh_from_db(fields=['amount'])
+            bump_book_version(order.pair)
+
+            # take the order off the matching engine's book
+            Channel(get_matching_channel(order.pair)).send(
                 {
-                    'text': json.dumps(
-                        {
-                            'message_type': 'order',
-                            'order_id': order.id,
-                            'state': order.state,
-                        }
-                    )
+                    'action': 'cancel',
+                    'order_id': order.id,
+                    'pair_id': order.pair_id,
                 }
             )
-
-            # return order amount to user
-            balance = Balance.objects.get(
-                user=profile.user,
-                currency=(
-                    order.pair.relative_currency
-                    if order.order_type == 'ask' else
-                    order.pair.base_currency
-                )
+            # remove the order from the front end
+            order_message = {
+                'message_type': 'order',
+                'order_id': order.id,
+                'pair': get_pair_name(order.pair),
+                'state': order.state,
+            }
+            Group(get_pair_group('ws', order.pair)).send(
+                {'text': json.dumps(order_message)}
             )
-            balance.amount += (
-                order.amount
-                if order.order_type == 'ask' else
-                (order.amount * order.price)
+            Group(user_orders_group(profile.user.id)).send(
+                {'text': json.dumps(dict(order_message, channel='orders'))}
             )
-            balance.save()
+
             # update the balance through the channels websocket
-            Group(profile.user.username).send(
+            Group(user_balances_group(profile.user.id)).send(
                 {
                     'text': json.dumps(
                         {
                             'message_type': 'balance',
+                            'channel': 'balances',
                             'balance': str(balance.amount),
                             'currency': balance.currency.code.lower()
                         }
@@ -342,9 +823,93 @@ class CancelOrder(View):
             return JsonResponse({'success': False, 'message': form.errors})
 
 
+class CancelOrders(View):
+    """
+    Allow an authenticated user to cancel several orders at once
+    POST parameters
+        order_id: the order ids, repeated or comma separated. up to 1000 at once
+    ids that aren't the user's open orders are listed in not_found
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = CancelOrdersForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            order_ids = form.cleaned_data['order_id']
+            cancelled = cancel_orders(profile.user, Order.objects.filter(id__in=order_ids))
+            return JsonResponse(
+                {
+                    'success': True,
+                    'message': {
+                        'orders_cancelled': cancelled,
+                        'not_found': [
+                            order_id for order_id in order_ids if order_id not in cancelled
+                        ]
+                    }
+                }
+            )
+
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
+class CancelAll(View):
+    """
+    Allow an authenticated user to cancel all their open orders on a pair
+    POST parameters
+        pair: the pair to cancel orders on
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = CancelAllForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            pair = find_pair(*form.cleaned_data['pair'].split('/'))
+            return JsonResponse(
+                {
+                    'success': True,
+                    'message': {
+                        'orders_cancelled': cancel_orders(
+                            profile.user,
+                            Order.objects.filter(pair=pair)
+                        )
+                    }
+                }
+            )
+
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
 class GetTrades(View):
     """
-    Get all trades for an authenticated user
+    Get a page of the trades for an authenticated user, oldest first.
+    A trade is listed for each of the user's orders it filled. order_id is the user's
+    order and role is taker if that order was the one that matched
+    optional POST parameters
+        since_id: only trades with a higher id. pass next_since_id to get the next page
+        limit: the most trades to return, up to 1000. defaults to 100
+        pair: only trades on this pair
+        start, end: unix timestamps bounding the time of the trades
+    next_since_id is null once there are no more trades
     """
 
     @staticmethod
@@ -360,27 +925,132 @@ class GetTrades(View):
             if not profile:
                 return JsonResponse({'success': False, 'message': message})
 
-            trades = Trade.objects.filter(
-                initiating_order__user=profile.user
-            )
+            limit = form.cleaned_data['limit'] or DEFAULT_PAGE
+            trades = list(user_trades(profile.user, form.cleaned_data)[:limit + 1])
+            # a trade between two of the user's orders is listed twice. keep both on
+            # the same page as the next page starts after its id
+            if len(trades) > limit and trades[limit]['id'] != trades[limit - 1]['id']:
+                trades.pop()
+            pair_names = get_pair_names()
             return JsonResponse(
                 {
                     'success': True,
                     'message': {
-                        'trades': [
-                            {
-                                'id': trade.id,
-                                'initiating_order': trade.initiating_order,
-                                'existing_order': trade.existing_order,
-                                'time': trade.time,
-                                'amount': float(str(trade.amount)),
-                                'partial': trade.partial
-                            }
-                            for trade in trades
-                            ]
+                        'trades': [trade_values(trade, pair_names) for trade in trades],
+                        'next_since_id': trades[-1]['id'] if len(trades) >= limit else None
                     }
                 }
             )
 
         else:
-            return JsonResponse({'success': False, 'message': form.errors})
\ No newline at end of file
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
+class Echo(object):
+    """
+    a file like object for csv.writer that hands back each row instead of keeping it
+    """
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def export_response(rows, export_format, name):
+    """
+    Stream the rows, dicts with the same keys, as a file of newline delimited JSON or
+    CSV. Rows are read and sent as the client takes them so the history never has
+    to be held in memory
+    """
+    rows = iter(rows)
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+
+        def content():
+            first = next(rows, None)
+            if first is None:
+                return
+            yield writer.writerow(list(first))
+            yield writer.writerow(list(first.values()))
+            for row in rows:
+                yield writer.writerow(list(row.values()))
+
+        response = StreamingHttpResponse(content(), content_type='text/csv')
+    else:
+        response = StreamingHttpResponse(
+            ('{}\n'.format(json.dumps(row)) for row in rows),
+            content_type='application/x-ndjson'
+        )
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(
+        name,
+        'csv' if export_format == 'csv' else 'ndjson'
+    )
+    return response
+
+
+class ExportOrders(View):
+    """
+    Stream all the orders for an authenticated user, oldest first
+    optional POST parameters
+        format: ndjson, one JSON order per line, or csv. defaults to ndjson
+        since_id, state, pair, start, end: as for get_orders
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = ExportOrdersForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            # a server side cursor where the database has them
+            orders = user_orders(profile.user, form.cleaned_data).iterator()
+            pair_names = get_pair_names()
+            return export_response(
+                (order_values(order, pair_names) for order in orders),
+                form.cleaned_data['format'],
+                'orders'
+            )
+
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
+
+
+class ExportTrades(View):
+    """
+    Stream all the trades for an authenticated user, oldest first
+    optional POST parameters
+        format: ndjson, one JSON trade per line, or csv. defaults to ndjson
+        since_id, pair, start, end: as for get_trades
+    """
+
+    @staticmethod
+    def get(request):
+        return JsonResponse({'success': False, 'message': {'HTTP Method': ['Use POST']}})
+
+    @staticmethod
+    def post(request):
+        form = ExportTradesForm(request.POST)
+
+        if form.is_valid():
+            profile, message = ensure_valid(form.cleaned_data)
+            if not profile:
+                return JsonResponse({'success': False, 'message': message})
+
+            # a server side cursor where the database has them
+            trades = user_trades(profile.user, form.cleaned_data).iterator()
+            pair_names = get_pair_names()
+            return export_response(
+                (trade_values(trade, pair_names) for trade in trades),
+                form.cleaned_data['format'],
+                'trades'
+            )
+
+        else:
+            return JsonResponse({'success': False, 'message': form.errors})
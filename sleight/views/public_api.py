@@ -1,84 +1,162 @@
+import datetime
+import json
 import time
+from functools import wraps
 
-import datetime
-from django.core.exceptions import ObjectDoesNotExist
-from django.http.response import JsonResponse
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.http.response import HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
 from django.views.generic import View
 
-from sleight.models import Order, CurrencyPair, Trade
+from sleight.engine.candles import RESOLUTIONS
+from sleight.engine.recent_trades import read_recent_trades
+from sleight.engine.ticker import read_ticker
+from sleight.forms import GetCandlesForm, GetOrderBookForm, GetRecentTradesForm
+from sleight.models import Candle, Order
+from sleight.utils import find_pair, get_book_version, get_pair_name, get_redis
+
+# the most candles get_candles will return in one call
+MAX_CANDLES = 1000
+
+
+def versioned(per_minute=False):
+    """
+    Serve a pair's view from a cache of its responses at the pair's book version,
+    which every order placed, cancelled or matched bumps.
+    The version is sent as the ETag so a client that sends it back in If-None-Match
+    gets a 304 until the book changes. Views that also change as time passes can add
+    the current minute to the version with per_minute
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, base_currency, relative_currency):
+            version = '{}'.format(get_book_version(base_currency, relative_currency))
+            if per_minute:
+                version = '{}.{}'.format(version, int(time.time()) // 60)
+            etag = '"{}"'.format(version)
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+            redis = get_redis()
+            cache_key = 'sleight:cache:{}:{}-{}:{}:{}'.format(
+                view.__qualname__,
+                base_currency.lower(),
+                relative_currency.lower(),
+                version,
+                request.META.get('QUERY_STRING', '')
+            )
+            body = redis.get(cache_key)
+            if body is not None:
+                response = HttpResponse(body, content_type='application/json')
+            else:
+                response = view(request, base_currency, relative_currency)
+                # errors aren't cached as they don't depend on the book
+                if not json.loads(response.content.decode('utf-8'))['success']:
+                    return response
+                redis.setex(cache_key, settings.BOOK_CACHE_SECONDS, response.content)
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
 
 
 class GetOrderBook(View):
     """
     Show open and partial orders on the books for the supplied pair.
+    optional GET parameters
+        depth: only return this many rows from the best price on each side
+        aggregate: return price levels with the total amount and number of orders
+                   at each instead of the orders themselves
+    bids are listed from the lowest price up and asks from the highest down
+    responses carry an ETag and are cached until the book changes
     """
 
     @staticmethod
+    @versioned()
     def get(request, base_currency, relative_currency):
         # parse out the pair
-        try:
-            pair = CurrencyPair.objects.get(
-                base_currency__code__iexact=base_currency,
-                relative_currency__code__iexact=relative_currency
-            )
-        except ObjectDoesNotExist:
+        pair = find_pair(base_currency, relative_currency)
+        if pair is None:
             return JsonResponse(
                 {'success': False, 'message': {'pair': ['pair not found']}}
             )
-        bid_orders = Order.objects.exclude(
-            state='cancelled'
-        ).exclude(
-            state='complete'
-        ).filter(
-            pair=pair,
-            order_type='bid'
-        ).order_by(
-            'price'
-        )
-        ask_orders = Order.objects.exclude(
-            state='cancelled'
-        ).exclude(
-            state='complete'
-        ).filter(
-            pair=pair,
-            order_type='ask'
-        ).order_by(
-            '-price'
-        )
+
+        form = GetOrderBookForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'success': False, 'message': form.errors})
+        depth = form.cleaned_data['depth']
+
+        sides = {}
+        for order_type, best_first in (('bid', '-price'), ('ask', 'price')):
+            orders = Order.objects.resting().filter(
+                pair=pair,
+                order_type=order_type
+            )
+            if form.cleaned_data['aggregate']:
+                rows = orders.values(
+                    'price'
+                ).annotate(
+                    amount=Sum('amount'),
+                    orders=Count('id')
+                ).order_by(
+                    best_first
+                )
+            else:
+                rows = orders.order_by(
+                    best_first,
+                    'id'
+                ).values(
+                    'id', 'order_type', 'amount', 'original_amount', 'price', 'state'
+                )
+            # take the best rows from the top of the book then list them worst first
+            if depth is not None:
+                rows = rows[:depth]
+            sides[order_type] = list(reversed(rows))
+
+        if form.cleaned_data['aggregate']:
+            return JsonResponse(
+                {
+                    'success': True,
+                    'message': {
+                        'bid_levels': sides['bid'],
+                        'ask_levels': sides['ask']
+                    }
+                }
+            )
+
+        pair_name = get_pair_name(pair)
         return JsonResponse(
             {
                 'success': True,
                 'message': {
                     'bid_orders': [
                         {
-                            'order_id': order.id,
-                            'order_type': order.order_type,
-                            'amount': order.amount,
-                            'original_amount': order.original_amount,
-                            'price': order.price,
-                            'state': order.state,
-                            'pair': '{}/{}'.format(
-                                order.pair.base_currency.code.lower(),
-                                order.pair.relative_currency.code.lower()
-                            )
+                            'order_id': order['id'],
+                            'order_type': order['order_type'],
+                            'amount': order['amount'],
+                            'original_amount': order['original_amount'],
+                            'price': order['price'],
+                            'state': order['state'],
+                            'pair': pair_name
                         }
-                        for order in bid_orders
+                        for order in sides['bid']
                     ],
                     'ask_orders': [
                         {
-                            'order_id': order.id,
-                            'order_type': order.order_type,
-                            'amount': order.amount,
-                            'original_amount': order.original_amount,
-                            'price': order.price,
-                            'state': order.state,
-                            'pair': '{}/{}'.format(
-                                order.pair.base_currency.code.lower(),
-                                order.pair.relative_currency.code.lower()
-                            )
+                            'order_id': order['id'],
+                            'order_type': order['order_type'],
+                            'amount': order['amount'],
+                            'original_amount': order['original_amount'],
+                            'price': order['price'],
+                            'state': order['state'],
+                            'pair': pair_name
                         }
-                        for order in ask_orders
-                        ]
+                        for order in sides['ask']
+                    ]
                 }
             }
         )
@@ -91,109 +169,116 @@ class GetOrderBook(View):
 class GetTicker(View):
     """
     Return a ticker for the chosen pair
+    The matching engine keeps it up to date as trades settle and the book changes
+    so this never has to look at the trades or orders themselves
     Sample response
-        "btc/usnbt": {
-            "last_trade_price": "0.00000035",
-            "lowest_ask_price": "0.00000036",
-            "highest_bid_price": "0.00000035",
-            "base_volume": "0.15543370",
-            "relative_volume": "512450.46072496",
-            "24_hour_high": "0.00000036",
-            "24_hour_low": "0.00000021"
-        },
+        "ticker": [{
+            "last_trade_price": "0.0000003500",
+            "lowest_ask_price": "0.0000003600",
+            "highest_bid_price": "0.0000003500",
+            "bid_volume": "1250.0000000000",
+            "ask_volume": "830.0000000000",
+            "base_volume": "0.1554337000",
+            "relative_volume": "512450.4607249600",
+            "24_hour_high": "0.0000003600",
+            "24_hour_low": "0.0000002100"
+        }]
+    responses carry an ETag and are cached until the book changes or the minute ends
     """
     @staticmethod
+    @versioned(per_minute=True)
     def get(request, base_currency, relative_currency):
         # parse out the pair
-        try:
-            pair = CurrencyPair.objects.get(
-                base_currency__code__iexact=base_currency,
-                relative_currency__code__iexact=relative_currency
-            )
-        except ObjectDoesNotExist:
+        pair = find_pair(base_currency, relative_currency)
+        if pair is None:
             return JsonResponse(
                 {'success': False, 'message': {'pair': ['pair not found']}}
             )
 
-        # get all trades in the last 24 hours
-        day_trades = Trade.objects.filter(
-            initiating_order__pair__base_currency__code__iexact=base_currency
-        ).filter(
-            time__gt=datetime.datetime.fromtimestamp(time.time() - 86400)
-        ).order_by(
-            '-time'
+        # the matcher keeps the ticker up to date as the book changes
+        return JsonResponse(
+            {
+                'success': True,
+                'message': {
+                    'ticker': [read_ticker(pair.id)]
+                }
+            }
         )
 
-        # get the last trade price
-        try:
-            last_trade_price = day_trades[0].existing_order.price
-            day_high = last_trade_price
-            day_low = last_trade_price
-        except IndexError:
-            last_trade_price = None
-            day_high = 0
-            day_low = 0
-        # get the highest and lowest trade prices
-        for trade in day_trades:
-            trade_price = trade.existing_order.price
-            day_high = trade_price if trade_price > day_high else day_high
-            day_low = trade_price if trade_price < day_low else day_low
-
-        # get all open and partial ask orders
-        all_asks = Order.objects.exclude(
-            state='cancelled'
-        ).exclude(
-            state='complete'
-        ).filter(
-            pair=pair,
-            order_type='ask'
-        ).order_by(
-            '-price'
-        )
-        # get the lowest ask price
-        try:
-            bottom_ask_price = all_asks[0].price
-        except IndexError:
-            bottom_ask_price = None
-        # sum the volume
-        ask_volume = 0
-        for order in all_asks:
-            ask_volume += order.amount
-
-        # get all open and partial bid orders
-        all_bids = Order.objects.exclude(
-            state='cancelled'
-        ).exclude(
-            state='complete'
-        ).filter(
+    @staticmethod
+    def post(request):
+        return JsonResponse(
+            {'success': False, 'message': {'HTTP Method': ['Use GET']}})
+
+
+class GetCandles(View):
+    """
+    Return open, high, low and close prices with traded volume for the chosen pair.
+    optional GET parameters
+        resolution: one of 1m, 5m, 1h or 1d. defaults to 1h
+        start, end: unix timestamps bounding the candle start times.
+                    end defaults to now and start to 1000 candles before end
+    at most 1000 candles are returned, oldest first. buckets with no trades have no
+    candle
+    Sample response
+        "candles": [{
+            "time": 1475323200,
+            "open": "0.0000003500",
+            "high": "0.0000003600",
+            "low": "0.0000003400",
+            "close": "0.0000003600",
+            "volume": "512450.4607249600",
+            "base_volume": "0.1794234400",
+            "trades": 12
+        }]
+    """
+    @staticmethod
+    def get(request, base_currency, relative_currency):
+        # parse out the pair
+        pair = find_pair(base_currency, relative_currency)
+        if pair is None:
+            return JsonResponse(
+                {'success': False, 'message': {'pair': ['pair not found']}}
+            )
+
+        form = GetCandlesForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'success': False, 'message': form.errors})
+        resolution = form.cleaned_data['resolution'] or '1h'
+        end = form.cleaned_data['end']
+        if end is None:
+            end = int(time.time())
+        start = form.cleaned_data['start']
+        if start is None:
+            start = end - RESOLUTIONS[resolution] * MAX_CANDLES
+
+        candles = Candle.objects.filter(
             pair=pair,
-            order_type='bid'
+            resolution=resolution,
+            start__gte=datetime.datetime.fromtimestamp(start, tz=timezone.utc),
+            start__lte=datetime.datetime.fromtimestamp(end, tz=timezone.utc)
         ).order_by(
-            'price'
-        )
-        # get the lowest bd price
-        try:
-            top_bid_price = all_bids[0].price
-        except IndexError:
-            top_bid_price = None
-        # calculate the bid volume
-        bid_volume = 0
-        for order in all_bids:
-            bid_volume += order.amount
+            'start'
+        ).values_list(
+            'start', 'open', 'high', 'low', 'close', 'volume', 'base_volume', 'trades'
+        )[:MAX_CANDLES]
         return JsonResponse(
             {
                 'success': True,
                 'message': {
-                    'ticker': [
+                    'candles': [
                         {
-                            'last_trade_price': last_trade_price,
-                            'lowest_ask_price': bottom_ask_price,
-                            'highest_bid_price': top_bid_price,
-                            'bid_volume': bid_volume,
-                            'ask_volume': ask_volume,
-                            '24_hour_high': day_high,
-                            '24_hour_low': day_low
+                            'time': int(candle_start.timestamp()),
+                            'open': open_price,
+                            'high': high,
+                            'low': low,
+                            'close': close,
+                            'volume': volume,
+                            'base_volume': base_volume,
+                            'trades': trades
                         }
+                        for candle_start, open_price, high, low, close, volume,
+                        base_volume, trades in candles
                     ]
                 }
             }
@@ -203,3 +288,48 @@ class GetTicker(View):
     def post(request):
         return JsonResponse(
             {'success': False, 'message': {'HTTP Method': ['Use GET']}})
+
+
+class GetRecentTrades(View):
+    """
+    Return the latest trades on the chosen pair, newest first.
+    optional GET parameters
+        limit: return at most this many trades. defaults to all that are kept, 150
+    The matching engine keeps them in redis as trades settle so this never has to
+    look at the trades themselves
+    Sample response
+        "trades": [{
+            "id": 1234,
+            "time": 1475323200.25,
+            "price": "0.0000003500",
+            "amount": "1250.0000000000",
+            "taker_side": "bid",
+            "initiating_order_id": 5678,
+            "existing_order_id": 5670
+        }]
+    """
+    @staticmethod
+    def get(request, base_currency, relative_currency):
+        # parse out the pair
+        pair = find_pair(base_currency, relative_currency)
+        if pair is None:
+            return JsonResponse(
+                {'success': False, 'message': {'pair': ['pair not found']}}
+            )
+
+        form = GetRecentTradesForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'success': False, 'message': form.errors})
+        return JsonResponse(
+            {
+                'success': True,
+                'message': {
+                    'trades': read_recent_trades(pair.id, form.cleaned_data['limit'])
+                }
+            }
+        )
+
+    @staticmethod
+    def post(request):
+        return JsonResponse(
+            {'success': False, 'message': {'HTTP Method': ['Use GET']}})